@@ -5,5 +5,11 @@ app = Flask(__name__)
 def hello():
 	return "Hello World!"
 
+# Images serve the application with wsgiserver.py, see README.md. Hello
+# world with Python 3.10 on one host CPU, utils/loadgen.py with keep-alive:
+#   app.run():              8 connections: 740 req/s, p50 10.8 ms, p99 16.9 ms
+#                          32 connections: 797 req/s, p50 41.7 ms, p99 54.0 ms
+#   wsgiserver.py (8 thr.): 8 connections: 2777 req/s, p50 2.8 ms, p99 5.9 ms
+#                          32 connections: 1497 req/s, p50 20.1 ms, p99 45.3 ms
 if __name__ == '__main__':
-	app.run(host='0.0.0.0', port=8000)
+	app.run(host='0.0.0.0', port=8080)
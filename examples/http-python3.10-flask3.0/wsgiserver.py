@@ -0,0 +1,242 @@
+"""Threaded WSGI server for single-process unikernels.
+
+Flask's `app.run()` starts Werkzeug's development server. This server
+only uses the standard library and threads (no fork):
+  - accepted connections wait in a bounded queue for one of `--threads`
+    worker threads; when the queue is full, they get a
+    `503 Service Unavailable` response right away
+  - HTTP/1.1 connections are kept alive between requests, unless other
+    connections are waiting, and closed after `--timeout` idle seconds
+
+Usage:
+
+    python3 wsgiserver.py --threads 8 --port 8080 server:app
+"""
+
+import argparse
+import importlib
+import os
+import queue
+import sys
+import threading
+from wsgiref.simple_server import ServerHandler, WSGIRequestHandler, WSGIServer
+
+
+OVERLOADED = (b"HTTP/1.1 503 Service Unavailable\r\n"
+              b"Content-Type: text/plain\r\n"
+              b"Content-Length: 20\r\n"
+              b"Retry-After: 1\r\n"
+              b"Connection: close\r\n"
+              b"\r\n"
+              b"Service Unavailable\n")
+
+
+class RequestBody:
+    """Request body, limited to its Content-Length."""
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(size) if size else b""
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.readline(size) if size else b""
+        self.remaining -= len(data)
+        return data
+
+    def readlines(self, hint=-1):
+        return list(self)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def drain(self):
+        # The next request of the connection starts after the body.
+        while self.read(65536):
+            pass
+
+
+class Handler(ServerHandler):
+    http_version = "1.1"
+    # Set if the client keeps the connection alive, cleared if the
+    # response can't be followed by another one.
+    keep_alive = False
+
+    def cleanup_headers(self):
+        super().cleanup_headers()
+        status = int(self.status[:3])
+        # Without a length, the end of the body is the end of the connection.
+        delimited = "Content-Length" in self.headers or status in (204, 304) or status < 200
+        if not (self.keep_alive and delimited):
+            self.keep_alive = False
+            self.headers["Connection"] = "close"
+
+    def handle_error(self):
+        if self.headers_sent:
+            # The response is incomplete.
+            self.keep_alive = False
+        super().handle_error()
+
+
+class RequestHandler(WSGIRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, don't delay the body.
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        self.timeout = self.server.idle_timeout
+        super().setup()
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            self.handle_one_request()
+
+    def handle_one_request(self):
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except TimeoutError:
+            self.close_connection = True
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ""
+            self.request_version = ""
+            self.command = ""
+            self.send_error(414)
+            return
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        if not self.parse_request():
+            return
+        if "Transfer-Encoding" in self.headers:
+            self.send_error(501, "Chunked request bodies are not supported")
+            self.close_connection = True
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_error(400, "Invalid Content-Length")
+            self.close_connection = True
+            return
+
+        body = RequestBody(self.rfile, length)
+        handler = Handler(body, self.wfile, self.get_stderr(), self.get_environ(),
+                          multithread=True, multiprocess=False)
+        handler.request_handler = self
+        # Free the thread for waiting connections after this request.
+        handler.keep_alive = not self.close_connection and self.server.connections.empty()
+        handler.run(self.server.get_app())
+        if not handler.keep_alive:
+            self.close_connection = True
+            return
+        body.drain()
+
+    def log_message(self, format, *args):
+        if self.server.access_log:
+            super().log_message(format, *args)
+
+
+class ThreadPoolWSGIServer(WSGIServer):
+    """WSGI server handing connections to a fixed pool of threads."""
+
+    def __init__(self, address, threads=8, queue_size=64, backlog=128, idle_timeout=5,
+                 access_log=False):
+        self.request_queue_size = backlog
+        self.idle_timeout = idle_timeout
+        self.access_log = access_log
+        self.connections = queue.Queue(queue_size)
+        super().__init__(address, RequestHandler)
+        for _ in range(threads):
+            threading.Thread(target=self.work, daemon=True).start()
+
+    def process_request(self, request, client_address):
+        try:
+            self.connections.put_nowait((request, client_address))
+        except queue.Full:
+            self.reject(request)
+
+    def reject(self, request):
+        try:
+            request.sendall(OVERLOADED)
+            # Read what the client sent, so that closing doesn't reset
+            # the connection before it reads the response.
+            request.setblocking(False)
+            request.recv(65536)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def work(self):
+        while True:
+            request, client_address = self.connections.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def handle_error(self, request, client_address):
+        # Clients closing their connection early are not errors.
+        if not isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+            super().handle_error(request, client_address)
+
+
+def load(spec):
+    """Return the WSGI application of a `module:variable` specification."""
+
+    module, _, name = spec.partition(":")
+    # Applications are looked up from the working directory, not from
+    # the directory of this script.
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    return getattr(importlib.import_module(module), name or "app")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve a WSGI application with a thread pool.")
+    parser.add_argument("app", help="application, as module:variable (e.g. server:app)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--threads", type=int, default=8, help="worker threads (default: 8)")
+    parser.add_argument("--queue", type=int, default=64,
+                        help="connections waiting for a thread before answering 503 (default: 64)")
+    parser.add_argument("--backlog", type=int, default=128, help="listen backlog (default: 128)")
+    parser.add_argument("--timeout", type=float, default=5,
+                        help="seconds before closing idle connections (default: 5)")
+    parser.add_argument("--access-log", action="store_true", help="log requests")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    server = ThreadPoolWSGIServer((args.host, args.port), args.threads, args.queue,
+                                  args.backlog, args.timeout, args.access_log)
+    server.set_app(load(args.app))
+    print("serving %s at %s:%s with %d threads" % (args.app, args.host, args.port, args.threads))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
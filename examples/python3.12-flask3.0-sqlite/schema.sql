@@ -6,3 +6,5 @@ CREATE TABLE posts (
     title TEXT NOT NULL,
     content TEXT NOT NULL
 );
+
+CREATE INDEX posts_created ON posts (created);
@@ -1,19 +1,182 @@
+import atexit
+import collections
+import functools
+import os
+import queue
 import sqlite3
-from flask import Flask, render_template, request, url_for, flash, redirect
+import threading
+from datetime import datetime, timezone
+from flask import (Flask, Response, g, render_template, stream_template, request, session,
+                   url_for, flash, get_flashed_messages, redirect)
 from werkzeug.exceptions import abort
 
 
+DATABASE = '/app/database.db'
+# Idle connections kept open, with their prepared statements.
+POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', '8'))
+STATEMENT_CACHE_SIZE = 256
+PRAGMAS = (
+    # Commits append to the write-ahead log, which is only synced at
+    # checkpoints, instead of syncing a rollback journal.
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -8000',
+    'PRAGMA mmap_size = 67108864',
+    'PRAGMA temp_store = MEMORY',
+)
+# Posts per index page, newest first.
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# Rendered pages kept in memory, least recently used evicted first.
+PAGE_CACHE_ENTRIES = int(os.environ.get('PAGE_CACHE_ENTRIES', '256'))
+PAGE_CACHE_BYTES = int(os.environ.get('PAGE_CACHE_BYTES', str(4 * 1024 * 1024)))
+
+
+class ConnectionPool:
+    """SQLite connections reused across requests.
+
+    A connection is used by one thread at a time, from the start to the
+    end of an application context. The most recently used connection is
+    handed out first, so its page and statement caches stay warm.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.idle = queue.LifoQueue(size)
+        self.lock = threading.Lock()
+        self.connections = set()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            try:
+                conn.execute(pragma)
+            except sqlite3.OperationalError:
+                # Keep the defaults if the platform lacks e.g. mmap.
+                pass
+        with self.lock:
+            self.connections.add(conn)
+        return conn
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            self.discard(conn)
+
+    def discard(self, conn):
+        with self.lock:
+            self.connections.discard(conn)
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            connections, self.connections = self.connections, set()
+        for conn in connections:
+            conn.close()
+
+
+class PageCache:
+    """Rendered pages, bounded in number and size.
+
+    Pages belong to a scope: the index pages depend on all posts, a post
+    page on its post only. Writes bump the version of the scopes they
+    change and drop their pages; the version and time of the last write
+    of a scope are the ETag and Last-Modified of its pages.
+    """
+
+    def __init__(self, entries, size):
+        self.max_entries = entries
+        self.max_size = size
+        self.lock = threading.Lock()
+        self.pages = collections.OrderedDict()
+        self.size = 0
+        self.versions = {}
+        self.started = datetime.now(timezone.utc).replace(microsecond=0)
+        self.stats = dict.fromkeys(['hits', 'misses', 'not_modified', 'stores',
+                                    'evictions', 'invalidations'], 0)
+
+    def validators(self, scope):
+        with self.lock:
+            return self.current(scope)
+
+    def current(self, scope):
+        # Called with the lock held.
+        version, modified = self.versions.get(scope, (0, self.started))
+        name = '-'.join(str(part) for part in scope) if isinstance(scope, tuple) else scope
+        # Versions start again with the process.
+        return f'{name}-{version}-{int(self.started.timestamp()):x}', modified
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def get(self, key, etag):
+        with self.lock:
+            page = self.pages.get(key)
+            if page is None or page[1] != etag:
+                self.stats['misses'] += 1
+                return None
+            self.pages.move_to_end(key)
+            self.stats['hits'] += 1
+            return page[2]
+
+    def put(self, key, scope, etag, body):
+        if len(body) > self.max_size:
+            return
+        with self.lock:
+            # Pages rendered before a write carry an outdated ETag.
+            if self.current(scope)[0] != etag:
+                return
+            self.remove(key)
+            self.pages[key] = (scope, etag, body)
+            self.size += len(body)
+            self.stats['stores'] += 1
+            while len(self.pages) > self.max_entries or self.size > self.max_size:
+                self.remove(next(iter(self.pages)))
+                self.stats['evictions'] += 1
+
+    def remove(self, key):
+        page = self.pages.pop(key, None)
+        if page is not None:
+            self.size -= len(page[2])
+
+    def invalidate(self, *scopes):
+        modified = datetime.now(timezone.utc).replace(microsecond=0)
+        with self.lock:
+            for scope in scopes:
+                version, _ = self.versions.get(scope, (0, self.started))
+                self.versions[scope] = (version + 1, modified)
+            for key in [k for k, page in self.pages.items() if page[0] in scopes]:
+                self.remove(key)
+                self.stats['invalidations'] += 1
+
+
+pool = ConnectionPool(DATABASE, POOL_SIZE)
+atexit.register(pool.close)
+cache = PageCache(PAGE_CACHE_ENTRIES, PAGE_CACHE_BYTES)
+
+
 def get_db_connection():
-    conn = sqlite3.connect('/app/database.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    if 'db' not in g:
+        g.db = pool.acquire()
+    return g.db
 
 
 def get_post(post_id):
     conn = get_db_connection()
     post = conn.execute('SELECT * FROM posts WHERE id = ?',
                         (post_id,)).fetchone()
-    conn.close()
     if post is None:
         abort(404)
     return post
@@ -22,15 +185,105 @@ def get_post(post_id):
 app = Flask(__name__)
 
 
+@app.teardown_appcontext
+def release_db_connection(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        pool.release(conn)
+
+
+def cached_page(scope):
+    """Serve the view from the page cache, with ETag and Last-Modified.
+
+    scope maps the view arguments to the scope of the page.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            page_scope = scope(**kwargs)
+            etag, modified = cache.validators(page_scope)
+
+            def validate(response):
+                response.set_etag(etag)
+                response.last_modified = modified
+                # Clients check their copy on each use.
+                response.cache_control.no_cache = True
+                return response.make_conditional(request)
+
+            # Flashed messages are rendered for a single client.
+            if session.get('_flashes'):
+                return view(**kwargs)
+            if validate(Response()).status_code == 304:
+                cache.count('not_modified')
+                return validate(Response())
+
+            key = request.full_path
+            body = cache.get(key, etag)
+            if body is not None:
+                return validate(Response(body, mimetype='text/html'))
+
+            response = app.make_response(view(**kwargs))
+            if response.status_code != 200:
+                return response
+            if not response.is_streamed:
+                cache.put(key, page_scope, etag, response.get_data())
+                return validate(response)
+            chunks = response.iter_encoded()
+
+            def store():
+                parts = []
+                for chunk in chunks:
+                    parts.append(chunk)
+                    yield chunk
+                # Only completely sent pages are stored.
+                cache.put(key, page_scope, etag, b''.join(parts))
+
+            response.response = store()
+            return validate(response)
+        return wrapper
+    return decorator
+
+
+@app.route('/metrics')
+def metrics():
+    with cache.lock:
+        stats = dict(cache.stats, entries=len(cache.pages), bytes=cache.size)
+    lines = [f'page_cache_{name}_total {value}' for name, value in stats.items()
+             if name not in ('entries', 'bytes')]
+    lines += [f'page_cache_entries {stats["entries"]}', f'page_cache_bytes {stats["bytes"]}']
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain')
+
+
 @app.route('/')
+@cached_page(lambda: 'index')
 def index():
+    size = request.args.get('size', PAGE_SIZE, type=int)
+    if not 0 < size <= MAX_PAGE_SIZE:
+        size = PAGE_SIZE
+    before = request.args.get('before', type=int)
+    created = request.args.get('created')
+
+    # Pages start after the last post of the previous page (keyset
+    # pagination), using the index on the creation time.
     conn = get_db_connection()
-    posts = conn.execute('SELECT * FROM posts').fetchall()
-    conn.close()
-    return render_template('index.html', posts=posts)
+    if before is None or created is None:
+        posts = conn.execute('SELECT id, created, title FROM posts'
+                             ' ORDER BY created DESC, id DESC LIMIT ?',
+                             (size,))
+    else:
+        posts = conn.execute('SELECT id, created, title FROM posts'
+                             ' WHERE (created, id) < (?, ?)'
+                             ' ORDER BY created DESC, id DESC LIMIT ?',
+                             (created, before, size))
+    # Rows are read while the page is sent. Flashed messages are taken
+    # from the session now, as its cookie is sent before the page.
+    get_flashed_messages()
+    return stream_template('index.html', posts=posts, size=size)
 
 
 @app.route('/<int:post_id>')
+@cached_page(lambda post_id: ('post', post_id))
 def post(post_id):
     post = get_post(post_id)
     return render_template('post.html', post=post)
@@ -49,7 +302,7 @@ def create():
             conn.execute('INSERT INTO posts (title, content) VALUES (?, ?)',
                          (title, content))
             conn.commit()
-            conn.close()
+            cache.invalidate('index')
             return redirect(url_for('index'))
 
     return render_template('create.html')
@@ -71,7 +324,7 @@ def edit(id):
                          ' WHERE id = ?',
                          (title, content, id))
             conn.commit()
-            conn.close()
+            cache.invalidate('index', ('post', id))
             return redirect(url_for('index'))
 
     return render_template('edit.html', post=post)
@@ -83,10 +336,11 @@ def delete(id):
     conn = get_db_connection()
     conn.execute('DELETE FROM posts WHERE id = ?', (id,))
     conn.commit()
-    conn.close()
+    cache.invalidate('index', ('post', id))
     flash('"{}" was successfully deleted!'.format(post['title']))
     return redirect(url_for('index'))
 
 
+# Images serve the application with wsgiserver.py, see README.md.
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8080)
@@ -1,20 +1,194 @@
 import argparse
+import asyncio
+import bisect
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from http.server import HTTPServer, BaseHTTPRequestHandler
 
+BODY = "Hello, World!\n".encode("utf-8")
+CONTENT_TYPE = "text/html"
+
+# Upper bounds (microseconds) of the request latency histogram buckets.
+LATENCY_BUCKETS = [50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000]
+
+class Stats:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.requests = 0
+    self.latency_sum = 0
+    self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+  def record(self, seconds):
+    latency = seconds * 1e6
+    index = bisect.bisect_left(LATENCY_BUCKETS, latency)
+    with self.lock:
+      self.requests += 1
+      self.latency_sum += latency
+      self.buckets[index] += 1
+
+  def encode(self):
+    with self.lock:
+      buckets = {("le_%d" % bound): count for bound, count in zip(LATENCY_BUCKETS, self.buckets)}
+      buckets["le_inf"] = self.buckets[-1]
+      stats = {
+        "requests": self.requests,
+        "latency_us": {
+          "mean": self.latency_sum / self.requests if self.requests else 0,
+          "histogram": buckets,
+        },
+      }
+    return (json.dumps(stats) + "\n").encode("utf-8")
+
+stats = Stats()
+
 class MyServer(BaseHTTPRequestHandler):
+  # Keep-alive connections are closed after being idle this long.
+  timeout = 5
+  # Headers and body are written separately, don't delay the body.
+  disable_nagle_algorithm = True
+  stats_path = None
+  quiet = False
+
   def do_GET(self):
+    start = time.perf_counter()
+    if self.path == self.stats_path:
+      body, content_type = stats.encode(), "application/json"
+    else:
+      body, content_type = BODY, CONTENT_TYPE
     self.send_response(200)
-    self.send_header("Content-type", "text/html")
+    self.send_header("Content-type", content_type)
+    self.send_header("Content-Length", str(len(body)))
+    if getattr(self.server, "waiting", 0):
+      # Free the thread for waiting connections.
+      self.send_header("Connection", "close")
     self.end_headers()
-    self.wfile.write(bytes("Hello, World!\n", "utf-8"))
+    self.wfile.write(body)
+    stats.record(time.perf_counter() - start)
+
+  def log_message(self, format, *args):
+    if not self.quiet:
+      super().log_message(format, *args)
+
+class PoolHTTPServer(HTTPServer):
+  # Connections are served by a fixed number of threads, others wait in
+  # the pool queue.
+  def __init__(self, address, handler, workers):
+    super().__init__(address, handler)
+    self.pool = ThreadPoolExecutor(workers)
+    self.lock = threading.Lock()
+    self.waiting = 0
+
+  def process_request(self, request, client_address):
+    with self.lock:
+      self.waiting += 1
+    self.pool.submit(self.process_request_thread, request, client_address)
+
+  def process_request_thread(self, request, client_address):
+    with self.lock:
+      self.waiting -= 1
+    try:
+      self.finish_request(request, client_address)
+    except Exception:
+      self.handle_error(request, client_address)
+    finally:
+      self.shutdown_request(request)
+
+  def handle_error(self, request, client_address):
+    # Clients closing their connection early are not errors.
+    if not isinstance(sys.exc_info()[1], ConnectionError):
+      super().handle_error(request, client_address)
+
+  def server_close(self):
+    super().server_close()
+    self.pool.shutdown(wait=False, cancel_futures=True)
+
+def response(status, body, content_type, keep_alive):
+  head = "HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n" % (status, content_type, len(body))
+  if not keep_alive:
+    head += "Connection: close\r\n"
+  return (head + "\r\n").encode("latin-1") + body
+
+RESPONSES = {keep_alive: response("200 OK", BODY, CONTENT_TYPE, keep_alive) for keep_alive in (True, False)}
+NOT_IMPLEMENTED = response("501 Not Implemented", b"", CONTENT_TYPE, False)
+BAD_REQUEST = response("400 Bad Request", b"", CONTENT_TYPE, False)
+
+async def handle_connection(reader, writer, args):
+  try:
+    while True:
+      try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), MyServer.timeout)
+      except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+        break
+      start = time.perf_counter()
+      lines = head.split(b"\r\n")
+      request = lines[0].split()
+      if len(request) != 3:
+        writer.write(BAD_REQUEST)
+        break
+      method, path, version = request
+      headers = {}
+      for line in lines[1:]:
+        name, _, value = line.partition(b":")
+        headers[name.strip().lower()] = value.strip().lower()
+      try:
+        length = int(headers.get(b"content-length", 0))
+        if length:
+          await reader.readexactly(length)
+      except (ValueError, asyncio.IncompleteReadError):
+        writer.write(BAD_REQUEST)
+        break
+      connection = headers.get(b"connection")
+      if version == b"HTTP/1.1":
+        keep_alive = connection != b"close"
+      else:
+        keep_alive = connection == b"keep-alive"
+
+      if method != b"GET":
+        writer.write(NOT_IMPLEMENTED)
+        break
+      if path.decode("latin-1") == args.stats_path:
+        writer.write(response("200 OK", stats.encode(), "application/json", keep_alive))
+      else:
+        writer.write(RESPONSES[keep_alive])
+      await writer.drain()
+      stats.record(time.perf_counter() - start)
+      if not keep_alive:
+        break
+  except ConnectionError:
+    pass
+  finally:
+    writer.close()
+
+async def serve_asyncio(args):
+  server = await asyncio.start_server(lambda r, w: handle_connection(r, w, args),
+                                      args.host, args.port, backlog=args.backlog)
+  async with server:
+    await server.serve_forever()
 
 def main(args):
-  server = HTTPServer((args.host, args.port), MyServer)
+  MyServer.stats_path = args.stats_path
+  MyServer.quiet = args.quiet
+  HTTPServer.request_queue_size = args.backlog
 
-  print("starting server at %s:%s" % (args.host, args.port))
+  print("starting %s server at %s:%s" % (args.mode, args.host, args.port))
 
   try:
-    server.serve_forever()
+    if args.mode == "asyncio":
+      asyncio.run(serve_asyncio(args))
+    else:
+      if args.mode == "threaded":
+        MyServer.protocol_version = "HTTP/1.1"
+        server = PoolHTTPServer((args.host, args.port), MyServer, args.workers)
+      else:
+        # A kept-alive connection would block other clients.
+        server = HTTPServer((args.host, args.port), MyServer)
+      try:
+        server.serve_forever()
+      finally:
+        server.server_close()
 
   except KeyboardInterrupt:
     pass
@@ -25,6 +199,13 @@ def parse_args():
   parser = argparse.ArgumentParser()
   parser.add_argument("--host", type=str, default="0.0.0.0")
   parser.add_argument("--port", type=int, default=8080)
+  parser.add_argument("--mode", choices=["single", "threaded", "asyncio"], default="threaded",
+                      help="single-threaded (HTTP/1.0), thread pool or asyncio server")
+  parser.add_argument("--workers", type=int, default=16, help="threads of the threaded server")
+  parser.add_argument("--backlog", type=int, default=128, help="listen backlog")
+  parser.add_argument("--stats-path", type=str, default="/stats",
+                      help="path of the request statistics, empty to disable")
+  parser.add_argument("--quiet", action="store_true", help="don't log requests")
   return parser.parse_args()
 
 if __name__ == "__main__":
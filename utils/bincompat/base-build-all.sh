@@ -14,6 +14,10 @@
 #
 # This script is to be run from the `library/base/` directory.
 # Kernel image files are generated in the `$KERNELDIR` directory.
+#
+# Kernel images are looked up in the content-addressed kernel store
+# (see `kstore.py`) and only built on a miss. Set `UK_KSTORE=0` to
+# always build.
 
 # Generate Kraftfile for strace-enabled build.
 tac Kraftfile | sed '/^\([ \t]\+\)\(CONFIG_.*\)$/ {s/^\([ \t]\+\)\(.*\)$/\1CONFIG_LIBSYSCALL_SHIM_STRACE: '\'y\''\n\1\2/; :loop; n; b loop}' | tac > Kraftfile.strace
@@ -22,26 +26,36 @@ tac Kraftfile | sed '/^\([ \t]\+\)\(CONFIG_.*\)$/ {s/^\([ \t]\+\)\(.*\)$/\1CONFI
 tac Kraftfile | sed '/^\([ \t]\+\)\(CONFIG_.*\)$/ {s/^\([ \t]\+\)\(.*\)$/\1CONFIG_LIBSYSCALL_SHIM_STRACE: '\'y\''\n\1CONFIG_LIBSYSCALL_SHIM_DEBUG: '\'y\''\n\1CONFIG_LIBUKDEBUG_PRINTK_INFO: '\'y\''\n\1CONFIG_LIBUKDEBUG_PRINTD: '\'y\''\n\1\2/; :loop; n; b loop}' | tac > Kraftfile.debug
 
 KERNELDIR="../../kernels"
+KSTORE="$(dirname "$0")/kstore.py"
 
 test -d "$KERNELDIR" || mkdir "$KERNELDIR"
 
 rm -f .config*
 rm -fr .unikraft
 
-kraft build --no-cache --plat qemu --arch x86_64
-cp .unikraft/build/base_qemu-x86_64 "$KERNELDIR"/base_qemu-x86_64
-
-kraft build --no-cache --plat fc --arch x86_64
-cp .unikraft/build/base_fc-x86_64 "$KERNELDIR"/base_fc-x86_64
-
-kraft build -K Kraftfile.strace --no-cache --plat qemu --arch x86_64
-cp .unikraft/build/base_qemu-x86_64 "$KERNELDIR"/base_qemu-x86_64-strace
-
-kraft build -K Kraftfile.strace --no-cache --plat fc --arch x86_64
-cp .unikraft/build/base_fc-x86_64 "$KERNELDIR"/base_fc-x86_64-strace
-
-kraft build -K Kraftfile.debug --no-cache --plat qemu --arch x86_64
-cp .unikraft/build/base_qemu-x86_64 "$KERNELDIR"/base_qemu-x86_64-debug
-
-kraft build -K Kraftfile.debug --no-cache --plat fc --arch x86_64
-cp .unikraft/build/base_fc-x86_64 "$KERNELDIR"/base_fc-x86_64-debug
+# Build a kernel image, unless it's found in the kernel store.
+#   $1: Kraftfile
+#   $2: platform
+#   $3: kernel image name in $KERNELDIR
+build()
+{
+    kstore="$KSTORE -K $1 --plat $2 --arch x86_64"
+    if test "$UK_KSTORE" != 0 && $kstore --lookup "$KERNELDIR"/"$3"; then
+        return 0
+    fi
+
+    kraft build -K "$1" --no-cache --plat "$2" --arch x86_64 \
+        ${UK_KRAFT_JOBS:+--jobs "$UK_KRAFT_JOBS"} || return 1
+    # Don't overwrite in place, the image may be a hard link to the store.
+    rm -f "$KERNELDIR"/"$3"
+    cp .unikraft/build/base_"$2"-x86_64 "$KERNELDIR"/"$3"
+    test "$UK_KSTORE" != 0 && $kstore --store "$KERNELDIR"/"$3"
+    return 0
+}
+
+build Kraftfile qemu base_qemu-x86_64
+build Kraftfile fc base_fc-x86_64
+build Kraftfile.strace qemu base_qemu-x86_64-strace
+build Kraftfile.strace fc base_fc-x86_64-strace
+build Kraftfile.debug qemu base_qemu-x86_64-debug
+build Kraftfile.debug fc base_fc-x86_64-debug
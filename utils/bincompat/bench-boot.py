@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2023, Unikraft GmbH and The Unikraft Authors.
+
+"""Measure boot time and time to first response of applications.
+
+Each given run script (generated `<compiler>-<plat>-<arch>-<fs>.sh`,
+`kraft-*.sh` or `run-*.sh` scripts) is launched a number of times. For
+every run, these times are measured from the script start:
+  - `vmm`: the VMM process (QEMU, Firecracker) is started, i.e. the
+    time spent by the script setting up networking and the initrd
+  - `console`: the first console line is printed after the VMM start
+  - `response`: the first successful TCP connection (`--probe tcp`) or
+    HTTP response (`--probe http`, the default) from the application,
+    at the guest address of the instance leased by the script (see
+    instance.py), unless `--address` is given
+
+The VMM is stopped after the first response, or after `--timeout`
+seconds. Distributions (minimum, median, 90th percentile, maximum,
+mean) are printed as a table and saved as JSON with `--json`.
+
+Run the script from the application directory, e.g. to compare
+compilers and root filesystems:
+
+    ../../utils/bincompat/bench-boot.py -n 10 --json boot.json \\
+        scripts/run/gcc-12-qemu-x86_64-initrd.sh scripts/run/clang-15-qemu-x86_64-9pfs.sh
+
+Under QEMU TCG (no KVM), increase `--timeout`.
+"""
+
+import sys
+import os
+import json
+import time
+import socket
+import signal
+import argparse
+import threading
+import statistics
+import subprocess
+import instance
+
+
+METRICS = ["vmm", "console", "response"]
+VMM_COMMANDS = ("qemu-system", "firecracker")
+
+
+def vmm_started(root):
+    """Return True if the given process or a descendant is a VMM.
+
+    Process ancestry is used rather than sessions, as `sudo` may run
+    commands in a new session.
+    """
+
+    children = {}
+    argvs = {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat", "r", encoding="utf8") as stream:
+                stat = stream.read()
+            with open(f"/proc/{pid}/cmdline", "rb") as stream:
+                argvs[int(pid)] = stream.read().decode("utf-8", "replace").split("\0")
+        except OSError:
+            continue
+        # The command name may contain spaces, fields follow the last parenthesis.
+        ppid = int(stat[stat.rindex(")") + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(pid))
+
+    pending = [root]
+    while pending:
+        pid = pending.pop()
+        # Look at the interpreter and the script, for wrapper scripts.
+        if any(os.path.basename(arg).startswith(VMM_COMMANDS) for arg in argvs.get(pid, [])[:2]):
+            return True
+        pending.extend(children.get(pid, []))
+    return False
+
+
+def probe(address, port, kind, path):
+    """Return True if the application answers."""
+
+    try:
+        with socket.create_connection((address, port), timeout=0.5) as conn:
+            if kind == "tcp":
+                return True
+            conn.settimeout(2)
+            conn.sendall(f"GET {path} HTTP/1.0\r\nHost: {address}\r\n\r\n".encode("ascii"))
+            return conn.recv(16).startswith(b"HTTP/")
+    except OSError:
+        return False
+
+
+def stop(process):
+    """Stop the process group of a run script, including VMMs run with sudo."""
+
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        if process.poll() is not None:
+            break
+        try:
+            os.killpg(process.pid, sig)
+        except PermissionError:
+            subprocess.run(["sudo", "-n", "kill", f"-{sig.name[3:]}", "--", f"-{process.pid}"],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        except ProcessLookupError:
+            break
+        try:
+            process.wait(3)
+        except subprocess.TimeoutExpired:
+            continue
+    if process.poll() is None:
+        process.kill()
+        process.wait()
+
+
+def run_once(script, args, log):
+    """Launch a run script once; return the measured times (None if not reached)."""
+
+    times = {m: None for m in METRICS}
+    start = time.monotonic()
+    process = subprocess.Popen([script], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               stdin=subprocess.DEVNULL, start_new_session=True)
+
+    def reader():
+        for raw in process.stdout:
+            now = time.monotonic() - start
+            if log:
+                log.write(raw.decode("utf-8", "replace"))
+            if times['vmm'] is not None and times['console'] is None:
+                times['console'] = now
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+
+    deadline = start + args.timeout
+    address = args.address
+    while time.monotonic() < deadline and process.poll() is None:
+        if times['vmm'] is None:
+            if vmm_started(process.pid):
+                times['vmm'] = time.monotonic() - start
+                # Instances are leased before starting the VMM.
+                address = address or instance.guest_address(process.pid)
+            else:
+                time.sleep(0.002)
+            continue
+        if probe(address, args.port, args.probe, args.path):
+            times['response'] = time.monotonic() - start
+            break
+        time.sleep(args.interval)
+
+    stop(process)
+    thread.join(5)
+    return times
+
+
+def summary(values):
+    """Return the distribution of a list of times."""
+
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        'min': values[0],
+        'median': statistics.median(values),
+        'p90': values[min(len(values) - 1, int(0.9 * len(values)))],
+        'max': values[-1],
+        'mean': statistics.fmean(values),
+        }
+
+
+def print_table(results):
+    """Print the distributions of all scripts."""
+
+    print(f"{'script':<40} {'metric':<9} {'ok':>5} {'min':>8} {'median':>8} "
+          f"{'p90':>8} {'max':>8} {'mean':>8}")
+    for result in results:
+        for metric in METRICS:
+            stats = result['summary'][metric]
+            ok = f"{result['ok'][metric]}/{len(result['runs'])}"
+            name = os.path.basename(result['script'])[:40]
+            if stats is None:
+                print(f"{name:<40} {metric:<9} {ok:>5} {'-':>8} {'-':>8} {'-':>8} {'-':>8} {'-':>8}")
+                continue
+            print(f"{name:<40} {metric:<9} {ok:>5} {stats['min']:8.3f} {stats['median']:8.3f} "
+                  f"{stats['p90']:8.3f} {stats['max']:8.3f} {stats['mean']:8.3f}")
+
+
+def parse_args():
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(description="Measure boot time and time to first response.")
+    parser.add_argument("scripts", nargs="+", metavar="SCRIPT", help="run scripts to measure")
+    parser.add_argument("-n", "--runs", type=int, default=5, help="runs per script (default: 5)")
+    parser.add_argument("--address",
+                        help="application address (default: guest address of the instance)")
+    parser.add_argument("--port", type=int, default=8080, help="application port (default: 8080)")
+    parser.add_argument("--probe", choices=["http", "tcp"], default="http",
+                        help="first response probe (default: http)")
+    parser.add_argument("--path", default="/", help="HTTP probe path (default: /)")
+    parser.add_argument("--interval", type=float, default=0.01,
+                        help="seconds between probes (default: 0.01)")
+    parser.add_argument("--timeout", type=float, default=60,
+                        help="seconds to wait for a response (default: 60)")
+    parser.add_argument("--json", help="save raw times and distributions to this file")
+    parser.add_argument("--log", help="append console output to this file")
+    return parser.parse_args()
+
+
+def main():
+    """The main program function."""
+
+    args = parse_args()
+    for script in args.scripts:
+        if not os.access(script, os.X_OK):
+            print(f"Error: Unable to run script '{script}'", file=sys.stderr)
+            sys.exit(1)
+
+    log = open(args.log, "a", encoding="utf8") if args.log else None
+    results = []
+    try:
+        for script in args.scripts:
+            runs = []
+            for index in range(args.runs):
+                times = run_once(script, args, log)
+                runs.append(times)
+                print(f"{script} [{index + 1}/{args.runs}]: " +
+                      ", ".join(f"{m} {t:.3f}s" if t is not None else f"{m} -"
+                                for m, t in times.items()), file=sys.stderr)
+            results.append({
+                'script': script,
+                'runs': runs,
+                'ok': {m: sum(1 for r in runs if r[m] is not None) for m in METRICS},
+                'summary': {m: summary([r[m] for r in runs if r[m] is not None]) for m in METRICS},
+                })
+    except KeyboardInterrupt:
+        print("Interrupted, reporting completed scripts", file=sys.stderr)
+    finally:
+        if log:
+            log.close()
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as stream:
+            json.dump({
+                'address': args.address,
+                'port': args.port,
+                'probe': args.probe,
+                'timeout': args.timeout,
+                'results': results,
+                }, stream, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2023, Unikraft GmbH and The Unikraft Authors.
+
+"""Build catalog applications as a dependency graph.
+
+Build steps are nodes of a graph (DAG):
+  - `base`: the base kernels for bincompat applications
+    (`base-build-all.sh`, run in `library/base/`)
+  - `<app>:rootfs`, `<app>:generate`: the root filesystem and the run
+    scripts of bincompat applications; generating run scripts requires
+    the base kernels
+  - `<app>:setup`, `<app>:rootfs`, `<app>:<build-script>`: repository
+    setup, root filesystem and kernel builds of applications with
+    generated build scripts (see `generate.einitrd.py`); builds of the
+    same application share the build directory and run one at a time
+
+Nodes run in parallel under a single GNU Make jobserver: every running
+node holds one job token and the Make processes it starts take extra
+tokens from the same pool. KraftKit doesn't use the jobserver, so the
+`base` and `kraft-*` nodes hold `--kraft-jobs` tokens and `kraft build`
+is limited to as many jobs (`UK_KRAFT_JOBS`). This way, the host is
+never oversubscribed. At the end, the wall time of each node and the
+critical path are reported.
+"""
+
+import sys
+import os
+import re
+import json
+import time
+import argparse
+import threading
+import subprocess
+import yaml
+
+
+CATALOG_ROOT = os.path.realpath(os.path.join(os.path.dirname(__file__), "..", ".."))
+CATALOG_DIRS = ["library", "examples", "native"]
+CATALOG_SKIP_DIRS = ["workdir", "rootfs", "node_modules", "scripts"]
+BASE_DIR = os.path.join("library", "base")
+BASE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "base-build-all.sh")
+GENERATE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "generate.py")
+CONFIG = "config.yaml"
+KRAFTCONFIG = "Kraftfile"
+
+
+def find_apps(root):
+    """Find application directories (holding a Kraftfile) in the catalog."""
+
+    for topdir in CATALOG_DIRS:
+        for path, dirs, filenames in os.walk(os.path.join(root, topdir)):
+            if KRAFTCONFIG in filenames:
+                dirs.clear()
+                yield path
+                continue
+            dirs[:] = sorted(d for d in dirs if not d.startswith(".") and d not in CATALOG_SKIP_DIRS)
+
+
+def node(name, cwd, cmd, deps=None, kraft_jobs=None):
+    """Create a graph node running command `cmd` in directory `cwd`.
+
+    Nodes running `kraft build` are given `kraft_jobs`, the number of
+    job tokens they hold while running.
+    """
+
+    return {
+            'name': name,
+            'cwd': cwd,
+            'cmd': cmd,
+            'deps': deps or [],
+            'kraft_jobs': kraft_jobs,
+            'status': "pending",
+            'start': None,
+            'end': None,
+            }
+
+
+def app_nodes(root, appdir, args):
+    """Create the graph nodes for an application."""
+
+    app = os.path.relpath(appdir, root)
+    if app.startswith(os.pardir):
+        app = os.path.relpath(appdir)
+    nodes = []
+
+    try:
+        with open(os.path.join(appdir, KRAFTCONFIG), "r", encoding="utf8") as stream:
+            data = yaml.safe_load(stream) or {}
+    except (IOError, yaml.YAMLError):
+        return nodes
+
+    # Bincompat applications: root filesystem and run scripts.
+    if 'runtime' in data and os.path.isfile(os.path.join(appdir, CONFIG)):
+        if os.path.isfile(os.path.join(appdir, "Makefile")):
+            nodes.append(node(f"{app}:rootfs", appdir, ["make", "rootfs.cpio"]))
+        if not args.no_base:
+            nodes.append(node(f"{app}:generate", appdir, [GENERATE_SCRIPT], ["base"]))
+        return nodes
+
+    # Applications with generated build scripts.
+    builddir = os.path.join(appdir, "scripts", "build")
+    if not os.path.isdir(builddir):
+        return nodes
+    scripts = sorted(f for f in os.listdir(builddir) if f.endswith(".sh"))
+
+    setup = f"{app}:setup"
+    nodes.append(node(setup, appdir, ["./scripts/setup.sh"]))
+    previous = setup
+    if os.path.isfile(os.path.join(appdir, "Makefile.docker")):
+        previous = f"{app}:rootfs"
+        nodes.append(node(previous, appdir, ["make", "rootfs.cpio"], [setup]))
+
+    # Builds of the same kind share a build directory, chain them.
+    if not args.no_make:
+        for script in (s for s in scripts if s.startswith("make-")):
+            name = f"{app}:{script[:-3]}"
+            nodes.append(node(name, appdir, [os.path.join(".", "scripts", "build", script)],
+                              [previous]))
+            previous = name
+    if not args.no_kraft:
+        previous = None
+        for script in (s for s in scripts if s.startswith("kraft-")):
+            name = f"{app}:{script[:-3]}"
+            nodes.append(node(name, appdir, [os.path.join(".", "scripts", "build", script)],
+                              [previous] if previous else [], args.kraft_jobs))
+            previous = name
+
+    return nodes
+
+
+def build_graph(root, appdirs, args):
+    """Create the graph nodes for the base kernels and the applications."""
+
+    nodes = []
+    if not args.no_base:
+        nodes.append(node("base", os.path.join(root, BASE_DIR), [BASE_SCRIPT],
+                          kraft_jobs=args.kraft_jobs))
+    for appdir in appdirs:
+        nodes += app_nodes(root, appdir, args)
+
+    graph = {n['name']: n for n in nodes}
+    if args.only:
+        pattern = re.compile(args.only)
+        # Keep selected nodes and everything they depend on.
+        selected = set()
+        stack = [n for n in graph if pattern.search(n)]
+        while stack:
+            name = stack.pop()
+            if name not in selected:
+                selected.add(name)
+                stack += graph[name]['deps']
+        graph = {name: n for name, n in graph.items() if name in selected}
+
+    for n in graph.values():
+        missing = [d for d in n['deps'] if d not in graph]
+        if missing:
+            raise ValueError(f"Node '{n['name']}' depends on unknown nodes {missing}")
+
+    return graph
+
+
+def heights(graph):
+    """Return the number of nodes on the longest chain starting at each node.
+
+    Used to start nodes on long chains first.
+    """
+
+    dependents = {name: [] for name in graph}
+    for n in graph.values():
+        for dep in n['deps']:
+            dependents[dep].append(n['name'])
+
+    result = {}
+
+    def height(name):
+        if name not in result:
+            result[name] = 1 + max((height(d) for d in dependents[name]), default=0)
+        return result[name]
+
+    for name in graph:
+        height(name)
+    return result
+
+
+class Jobserver:
+    """GNU Make compatible jobserver.
+
+    The job tokens are bytes in a pipe. Nodes take a token (or
+    `kraft_jobs` tokens) before they start and give them back when they
+    finish. Make processes started by the nodes use the pipe (passed in
+    MAKEFLAGS) for additional jobs.
+    """
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.rfd, self.wfd = os.pipe()
+        os.set_inheritable(self.rfd, True)
+        os.set_inheritable(self.wfd, True)
+        os.write(self.wfd, b"+" * jobs)
+
+    def makeflags(self):
+        """Return the MAKEFLAGS value to pass the jobserver to Make."""
+
+        return f"-j{self.jobs} --jobserver-auth={self.rfd},{self.wfd}"
+
+    def acquire(self, count=1):
+        """Take job tokens, wait until they are available."""
+
+        tokens = b""
+        while len(tokens) < count:
+            tokens += os.read(self.rfd, count - len(tokens))
+        return tokens
+
+    def release(self, tokens):
+        """Give back job tokens."""
+
+        os.write(self.wfd, tokens)
+
+    def close(self):
+        """Close the pipe."""
+
+        os.close(self.rfd)
+        os.close(self.wfd)
+
+
+def run_node(n, jobserver, env, logdir, tokens, done):
+    """Run a node command, logging its output, and release its tokens."""
+
+    if n['kraft_jobs']:
+        # The jobs are bounded by the tokens held, not by the jobserver.
+        env = dict(env, UK_KRAFT_JOBS=str(n['kraft_jobs']))
+        del env['MAKEFLAGS']
+    logfile = os.path.join(logdir, n['name'].replace(os.sep, "_").replace(":", "_") + ".log")
+    n['log'] = logfile
+    n['start'] = time.monotonic()
+    try:
+        with open(logfile, "w", encoding="utf8") as log:
+            result = subprocess.run(n['cmd'], cwd=n['cwd'], env=env, stdin=subprocess.DEVNULL,
+                                    stdout=log, stderr=subprocess.STDOUT, check=False,
+                                    pass_fds=(jobserver.rfd, jobserver.wfd))
+        n['status'] = "ok" if result.returncode == 0 else "failed"
+    except OSError as exc:
+        n['status'] = "failed"
+        n['error'] = str(exc)
+    n['end'] = time.monotonic()
+    jobserver.release(tokens)
+    done(n)
+
+
+def run_graph(graph, jobs, logdir):
+    """Run the graph nodes respecting dependencies and the job budget."""
+
+    os.makedirs(logdir, exist_ok=True)
+    jobserver = Jobserver(jobs)
+    env = dict(os.environ)
+    env['MAKEFLAGS'] = jobserver.makeflags()
+    priority = heights(graph)
+    cond = threading.Condition()
+    threads = []
+
+    def done(n):
+        with cond:
+            print(f"[{n['status']:>6}] {n['name']} ({n['end'] - n['start']:.1f}s)", flush=True)
+            cond.notify_all()
+
+    while True:
+        with cond:
+            while True:
+                # Nodes depending on failed nodes are skipped.
+                for n in graph.values():
+                    if n['status'] == "pending" and \
+                            any(graph[d]['status'] in ("failed", "skipped") for d in n['deps']):
+                        n['status'] = "skipped"
+                ready = [n for n in graph.values() if n['status'] == "pending" and
+                         all(graph[d]['status'] == "ok" for d in n['deps'])]
+                running = any(n['status'] == "running" for n in graph.values())
+                if ready or not running:
+                    break
+                cond.wait()
+            if not ready:
+                break
+            ready.sort(key=lambda n: (-priority[n['name']], n['name']))
+            n = ready[0]
+            n['status'] = "running"
+
+        tokens = jobserver.acquire(n['kraft_jobs'] or 1)
+        thread = threading.Thread(target=run_node, args=(n, jobserver, env, logdir, tokens, done))
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+    jobserver.close()
+
+
+def critical_path(graph):
+    """Return the critical path (list of node names) and its duration.
+
+    The critical path is the chain of dependent nodes with the longest
+    total wall time.
+    """
+
+    memo = {}
+
+    def longest(name):
+        if name not in memo:
+            n = graph[name]
+            duration = (n['end'] - n['start']) if n['start'] is not None else 0
+            best = max((longest(d) for d in n['deps']), key=lambda r: r[1], default=([], 0))
+            memo[name] = (best[0] + [name], best[1] + duration)
+        return memo[name]
+
+    return max((longest(name) for name in graph), key=lambda r: r[1], default=([], 0))
+
+
+def report(graph, start, stream=sys.stdout):
+    """Print per-node wall times and the critical path."""
+
+    width = max((len(name) for name in graph), default=4)
+    print(f"\n{'node':<{width}}  {'status':<7}  {'start':>8}  {'wall':>8}", file=stream)
+    nodes = sorted(graph.values(), key=lambda n: (n['start'] is None, n['start'] or 0, n['name']))
+    for n in nodes:
+        if n['start'] is None:
+            print(f"{n['name']:<{width}}  {n['status']:<7}  {'-':>8}  {'-':>8}", file=stream)
+            continue
+        print(f"{n['name']:<{width}}  {n['status']:<7}  {n['start'] - start:7.1f}s  "
+              f"{n['end'] - n['start']:7.1f}s", file=stream)
+
+    path, duration = critical_path(graph)
+    print(f"\nCritical path ({duration:.1f}s):", file=stream)
+    for name in path:
+        n = graph[name]
+        if n['start'] is not None:
+            print(f"  {name} ({n['end'] - n['start']:.1f}s)", file=stream)
+
+
+def parse_args():
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(
+            description="Build catalog applications as a dependency graph under a jobserver.")
+    parser.add_argument("appdirs", nargs="*", metavar="APPDIR",
+                        help="application directories (default: all applications)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="total number of jobs (default: number of CPUs)")
+    parser.add_argument("--kraft-jobs", type=int, default=4,
+                        help="jobs of each KraftKit build, taken from the total (default: 4)")
+    parser.add_argument("--only", metavar="REGEX",
+                        help="only run nodes matching REGEX (and their dependencies)")
+    parser.add_argument("--no-base", action="store_true",
+                        help="don't build base kernels nor bincompat run scripts")
+    parser.add_argument("--no-make", action="store_true",
+                        help="don't run Make-based builds")
+    parser.add_argument("--no-kraft", action="store_true",
+                        help="don't run KraftKit-based builds")
+    parser.add_argument("--log-dir", default="build-logs",
+                        help="directory for node logs (default: build-logs)")
+    parser.add_argument("--report", metavar="FILE",
+                        help="also write the report as JSON to FILE")
+    parser.add_argument("-n", "--dry-run", action="store_true",
+                        help="print the graph, don't run anything")
+    return parser.parse_args()
+
+
+def main():
+    """Build the graph and run it."""
+
+    args = parse_args()
+    args.jobs = max(args.jobs, 1)
+    args.kraft_jobs = min(max(args.kraft_jobs, 1), args.jobs)
+
+    appdirs = [os.path.abspath(d) for d in args.appdirs] or list(find_apps(CATALOG_ROOT))
+    try:
+        graph = build_graph(CATALOG_ROOT, appdirs, args)
+    except ValueError as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.dry_run:
+        for n in graph.values():
+            deps = f" <- {', '.join(n['deps'])}" if n['deps'] else ""
+            print(f"{n['name']}{deps}")
+        return
+
+    start = time.monotonic()
+    run_graph(graph, args.jobs, os.path.abspath(args.log_dir))
+    report(graph, start)
+
+    if args.report:
+        with open(args.report, "w", encoding="utf8") as stream:
+            path, duration = critical_path(graph)
+            json.dump({
+                "jobs": args.jobs,
+                "wall": time.monotonic() - start,
+                "critical_path": path,
+                "critical_path_wall": duration,
+                "nodes": [{
+                    "name": n['name'],
+                    "deps": n['deps'],
+                    "status": n['status'],
+                    "start": n['start'] - start if n['start'] is not None else None,
+                    "wall": n['end'] - n['start'] if n['start'] is not None else None,
+                    "log": n.get('log'),
+                    } for n in graph.values()],
+                }, stream, indent=2)
+
+    if any(n['status'] != "ok" for n in graph.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2023, Unikraft GmbH and The Unikraft Authors.
+
+"""Collect and summarize Firecracker metrics of a run.
+
+Firecracker writes its metrics as one JSON object per line to the
+`metrics_path` of its configuration, every 60 seconds and when
+stopping. Counters are the increments since the previous line,
+latencies (`*_us`) are the last measured values.
+
+Run scripts of the `production` profile (`fc_profile` in
+`config.yaml`) run this script on a FIFO in the instance directory:
+
+    fc-metrics.py /tmp/unikraft-instances/0/firecracker.metrics --output metrics/run.json
+
+The FIFO is created and opened before being renamed to the given path,
+so run scripts wait for the path to exist before starting Firecracker.
+The collector stops when Firecracker closes the FIFO, or on SIGTERM,
+then writes the summary: counters added up over the run, minimum and
+maximum latencies, and totals of vCPU exits, network and block I/O.
+Use `--from` to summarize saved metrics (`--raw`) instead.
+"""
+
+import sys
+import os
+import json
+import time
+import select
+import signal
+import argparse
+import tempfile
+import threading
+
+
+# Metrics holding values rather than increments.
+STORE_SUFFIX = "_us"
+
+
+class Summary:
+    """Aggregate of Firecracker metrics lines."""
+
+    def __init__(self):
+        self.samples = 0
+        self.first = None
+        self.last = None
+        self.counters = {}
+        self.latencies = {}
+        self.errors = 0
+
+    def add(self, line):
+        """Add a metrics line."""
+
+        try:
+            metrics = json.loads(line)
+        except ValueError:
+            self.errors += 1
+            return
+        self.samples += 1
+        timestamp = metrics.get('utc_timestamp_ms')
+        if timestamp is not None:
+            self.first = timestamp if self.first is None else self.first
+            self.last = timestamp
+        for group, values in metrics.items():
+            if not isinstance(values, dict):
+                continue
+            for key, value in values.items():
+                if not isinstance(value, (int, float)):
+                    continue
+                if group == "latencies_us" or key.endswith(STORE_SUFFIX):
+                    if value == 0:
+                        continue
+                    stats = self.latencies.setdefault(f"{group}.{key}",
+                                                      {'min': value, 'max': value, 'last': value})
+                    stats['min'] = min(stats['min'], value)
+                    stats['max'] = max(stats['max'], value)
+                    stats['last'] = value
+                else:
+                    counters = self.counters.setdefault(group, {})
+                    counters[key] = counters.get(key, 0) + value
+
+    def totals(self):
+        """Return the totals of the main counters."""
+
+        vcpu = self.counters.get('vcpu', {})
+        net = self.counters.get('net', {})
+        block = self.counters.get('block', {})
+        return {
+            'vcpu_exits': sum(v for k, v in vcpu.items() if k.startswith("exit_")),
+            'vcpu_failures': vcpu.get('failures', 0),
+            'net_rx_bytes': net.get('rx_bytes_count', 0),
+            'net_tx_bytes': net.get('tx_bytes_count', 0),
+            'net_rx_packets': net.get('rx_packets_count', 0),
+            'net_tx_packets': net.get('tx_packets_count', 0),
+            'net_fails': sum(v for k, v in net.items() if k.endswith("_fails")),
+            'block_read_bytes': block.get('read_bytes', 0),
+            'block_write_bytes': block.get('write_bytes', 0),
+            'block_fails': sum(v for k, v in block.items() if k.endswith("_fails")),
+            }
+
+    def report(self):
+        """Return the summary as a dictionary."""
+
+        return {
+            'samples': self.samples,
+            'invalid_lines': self.errors,
+            'duration_s': (self.last - self.first) / 1000 if self.samples > 1 else 0,
+            'totals': self.totals(),
+            'vcpu_exits': {k: v for k, v in sorted(self.counters.get('vcpu', {}).items())
+                           if k.startswith("exit_") and v},
+            'latencies_us': dict(sorted(self.latencies.items())),
+            'counters': {group: {k: v for k, v in values.items() if v}
+                         for group, values in sorted(self.counters.items())},
+            }
+
+
+def print_summary(report, stream=sys.stderr):
+    """Print the main figures of a summary."""
+
+    print(f"Firecracker metrics: {report['samples']} samples over {report['duration_s']:.1f}s",
+          file=stream)
+    for key, value in report['totals'].items():
+        print(f"  {key:<20} {value:>14}", file=stream)
+    for key, value in report['vcpu_exits'].items():
+        print(f"  vcpu.{key:<15} {value:>14}", file=stream)
+    for key, stats in report['latencies_us'].items():
+        print(f"  {key:<40} min {stats['min']:>9} max {stats['max']:>9} us", file=stream)
+
+
+def collect(path, summary, raw=None, stop=None):
+    """Read metrics lines from a FIFO created at path, until the writer closes it."""
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    os.mkfifo(tmp, 0o600)
+    # A reader opened without blocking lets Firecracker open the FIFO.
+    fd = os.open(tmp, os.O_RDONLY | os.O_NONBLOCK)
+    os.rename(tmp, path)
+
+    buffer = b""
+    connected = False
+    try:
+        while stop is None or not stop.is_set():
+            ready, _, _ = select.select([fd], [], [], 0.2)
+            if not ready:
+                continue
+            try:
+                chunk = os.read(fd, 65536)
+            except BlockingIOError:
+                continue
+            if not chunk:
+                if connected:
+                    break
+                # No writer yet.
+                time.sleep(0.05)
+                continue
+            connected = True
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    summary.add(line)
+                    if raw:
+                        raw.write(line.decode("utf8", "replace") + "\n")
+        # Drain lines written before stopping.
+        try:
+            buffer += os.read(fd, 1 << 20)
+        except BlockingIOError:
+            pass
+        for line in buffer.split(b"\n"):
+            if line.strip():
+                summary.add(line)
+                if raw:
+                    raw.write(line.decode("utf8", "replace") + "\n")
+    finally:
+        os.close(fd)
+
+
+def self_test():
+    """Check the collector against a stand-in writer."""
+
+    failures = []
+
+    def check(condition, message):
+        print(f"{'ok' if condition else 'FAIL'}: {message}")
+        if not condition:
+            failures.append(message)
+
+    lines = [
+        {'utc_timestamp_ms': 1000, 'vcpu': {'exit_io_out': 10, 'exit_mmio_read': 2, 'failures': 0},
+         'net': {'rx_bytes_count': 100, 'tx_bytes_count': 50, 'tx_fails': 0},
+         'latencies_us': {'pause_vm': 0}, 'api_server': {'process_startup_time_us': 900}},
+        {'utc_timestamp_ms': 61000, 'vcpu': {'exit_io_out': 5, 'exit_mmio_read': 0, 'failures': 1},
+         'net': {'rx_bytes_count': 20, 'tx_bytes_count': 30, 'tx_fails': 2},
+         'latencies_us': {'pause_vm': 40}, 'api_server': {'process_startup_time_us': 0}},
+        ]
+
+    with tempfile.TemporaryDirectory(prefix="fc-metrics-") as workdir:
+        path = os.path.join(workdir, "firecracker.metrics")
+        summary = Summary()
+        thread = threading.Thread(target=collect, args=(path, summary))
+        thread.start()
+        while not os.path.exists(path):
+            time.sleep(0.01)
+        # Firecracker opens the metrics file without blocking.
+        fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+        os.write(fd, (json.dumps(lines[0]) + "\n").encode("utf8"))
+        time.sleep(0.1)
+        os.write(fd, (json.dumps(lines[1]) + "\nnot json\n").encode("utf8"))
+        os.close(fd)
+        thread.join(5)
+        check(not thread.is_alive(), "collector stops when the writer closes the FIFO")
+
+        report = summary.report()
+        check(report['samples'] == 2 and report['invalid_lines'] == 1, "lines are parsed")
+        check(report['duration_s'] == 60, "duration is computed from timestamps")
+        check(report['totals']['vcpu_exits'] == 17, "vCPU exits are added up")
+        check(report['totals']['net_rx_bytes'] == 120 and report['totals']['net_fails'] == 2,
+              "network counters are added up")
+        check(report['latencies_us']['latencies_us.pause_vm'] == {'min': 40, 'max': 40, 'last': 40},
+              "latencies are not added up, zero values are ignored")
+        check(report['latencies_us']['api_server.process_startup_time_us']['max'] == 900,
+              "values of _us metrics are kept")
+
+        stop = threading.Event()
+        thread = threading.Thread(target=collect, args=(path + ".2", Summary(), None, stop))
+        thread.start()
+        time.sleep(0.3)
+        stop.set()
+        thread.join(5)
+        check(not thread.is_alive(), "collector stops on request without a writer")
+
+    print("FAILED" if failures else "PASSED")
+    return 1 if failures else 0
+
+
+def parse_args():
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(description="Collect and summarize Firecracker metrics.")
+    parser.add_argument("fifo", nargs="?", help="FIFO to create and read metrics from")
+    parser.add_argument("--output", help="save the summary (JSON) to this file")
+    parser.add_argument("--raw", help="save the metrics lines to this file")
+    parser.add_argument("--from", dest="source", metavar="FILE",
+                        help="summarize saved metrics lines instead of reading a FIFO")
+    parser.add_argument("--quiet", action="store_true", help="don't print the summary")
+    parser.add_argument("--self-test", action="store_true",
+                        help="check the collector against a stand-in writer")
+    args = parser.parse_args()
+    if not args.self_test and bool(args.fifo) == bool(args.source):
+        parser.error("either a FIFO or --from is required")
+    return args
+
+
+def main():
+    """The main program function."""
+
+    args = parse_args()
+    if args.self_test:
+        return self_test()
+
+    summary = Summary()
+    if args.source:
+        try:
+            with open(args.source, "r", encoding="utf8") as stream:
+                for line in stream:
+                    if line.strip():
+                        summary.add(line)
+        except IOError as exc:
+            print(f"Error: {exc}", file=sys.stderr)
+            sys.exit(1)
+    else:
+        stop = threading.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, lambda *_: stop.set())
+        raw = open(args.raw, "w", encoding="utf8") if args.raw else None
+        try:
+            collect(args.fifo, summary, raw, stop)
+        except OSError as exc:
+            print(f"Error: {exc}", file=sys.stderr)
+            sys.exit(1)
+        finally:
+            if raw:
+                raw.close()
+        # Run scripts stop the collector on exit, even if it is done.
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, signal.SIG_IGN)
+
+    report = summary.report()
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf8") as stream:
+            json.dump(report, stream, indent=2)
+    if not args.quiet:
+        print_summary(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
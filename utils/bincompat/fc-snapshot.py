@@ -0,0 +1,411 @@
+#!/usr/bin/env python
+
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2023, Unikraft GmbH and The Unikraft Authors.
+
+"""Create and restore Firecracker snapshots of running applications.
+
+The Firecracker API is used through the socket opened by the run
+scripts (in the instance directory, see instance.py):
+  - `create` waits for the application to be ready, pauses the VM and
+    creates a full snapshot (VM state and guest memory files)
+  - `load` loads a snapshot in a Firecracker process started without a
+    configuration and resumes the VM
+
+Restoring skips booting the kernel and extracting the initrd, as well
+as the start of the application (e.g. imports of Python modules).
+The generated `run-fc-*-snapshot.sh` and `run-fc-*-restore.sh` scripts
+use this script, e.g.:
+
+    fc-snapshot.py create --ready tcp:172.44.0.2:8080 --snapshot snap --mem mem
+    fc-snapshot.py load --snapshot snap --mem mem --network-override net1=tap1
+
+Readiness is either `tcp:HOST:PORT` (a connection is accepted),
+`console:REGEX` (a line of the `--console` file matches) or
+`delay:SECONDS`. Use `--self-test` to check the client against a local
+stand-in for the Firecracker API.
+"""
+
+import sys
+import os
+import re
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import http.client
+import http.server
+import socketserver
+
+
+API_SOCKET = "/tmp/firecracker.socket"
+
+
+class ApiError(Exception):
+    """Firecracker API request failed."""
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a UNIX socket."""
+
+    def __init__(self, path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class Client:
+    """Client of the Firecracker API."""
+
+    def __init__(self, path=API_SOCKET, timeout=30):
+        self.path = path
+        self.timeout = timeout
+
+    def request(self, method, path, body=None):
+        """Send an API request; return the decoded response body, or None."""
+
+        conn = UnixHTTPConnection(self.path, self.timeout)
+        try:
+            headers = {'Accept': "application/json"}
+            data = None
+            if body is not None:
+                data = json.dumps(body).encode("utf8")
+                headers['Content-Type'] = "application/json"
+            conn.request(method, path, body=data, headers=headers)
+            response = conn.getresponse()
+            payload = response.read()
+        except OSError as exc:
+            raise ApiError(f"{method} {path}: {exc}") from exc
+        finally:
+            conn.close()
+
+        try:
+            content = json.loads(payload) if payload else None
+        except ValueError:
+            content = payload.decode("utf8", "replace")
+        if response.status >= 300:
+            if isinstance(content, dict):
+                content = content.get('fault_message', content)
+            raise ApiError(f"{method} {path}: {response.status} {content}")
+        return content
+
+    def wait(self, timeout):
+        """Wait for the API socket to answer."""
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return self.request("GET", "/")
+            except ApiError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.01)
+
+    def state(self):
+        """Return the state of the VM (e.g. `Running`, `Paused`)."""
+
+        return self.request("GET", "/")['state']
+
+    def pause(self):
+        """Pause the VM."""
+
+        self.request("PATCH", "/vm", {'state': "Paused"})
+
+    def resume(self):
+        """Resume the VM."""
+
+        self.request("PATCH", "/vm", {'state': "Resumed"})
+
+    def create_snapshot(self, snapshot, mem):
+        """Create a full snapshot of the paused VM."""
+
+        self.request("PUT", "/snapshot/create", {
+            'snapshot_type': "Full",
+            'snapshot_path': snapshot,
+            'mem_file_path': mem,
+            })
+
+    def load_snapshot(self, snapshot, mem, resume=True, network_overrides=None):
+        """Load a snapshot, before any other VM configuration.
+
+        Network overrides map interface IDs to the tap interfaces
+        replacing those used when the snapshot was created.
+        """
+
+        body = {
+            'snapshot_path': snapshot,
+            'mem_backend': {'backend_type': "File", 'backend_path': mem},
+            'resume_vm': resume,
+            }
+        if network_overrides:
+            body['network_overrides'] = [{'iface_id': iface, 'host_dev_name': tap}
+                                         for iface, tap in network_overrides.items()]
+        self.request("PUT", "/snapshot/load", body)
+
+
+def wait_ready(ready, console, timeout):
+    """Wait for the application to be ready; return False on timeout."""
+
+    kind, _, value = ready.partition(":")
+    deadline = time.monotonic() + timeout
+    if kind == "delay":
+        time.sleep(float(value))
+        return True
+
+    if kind == "tcp":
+        host, _, port = value.rpartition(":")
+        while time.monotonic() < deadline:
+            try:
+                with socket.create_connection((host, int(port)), timeout=0.5):
+                    return True
+            except OSError:
+                time.sleep(0.05)
+        return False
+
+    pattern = re.compile(value)
+    position = 0
+    while time.monotonic() < deadline:
+        try:
+            with open(console, "r", encoding="utf8", errors="replace") as stream:
+                stream.seek(position)
+                lines = stream.readlines()
+        except FileNotFoundError:
+            lines = []
+        for line in lines:
+            if not line.endswith("\n"):
+                break
+            position += len(line.encode("utf8", "replace"))
+            if pattern.search(line):
+                return True
+        time.sleep(0.05)
+    return False
+
+
+def create(args):
+    """Snapshot the VM once the application is ready."""
+
+    client = Client(args.socket)
+    client.wait(args.timeout)
+    start = time.monotonic()
+    if not wait_ready(args.ready, args.console, args.timeout):
+        print(f"Error: Application not ready ({args.ready}) after {args.timeout}s",
+              file=sys.stderr)
+        sys.exit(1)
+    print(f"Application ready after {time.monotonic() - start:.3f}s", file=sys.stderr)
+
+    for path in (args.snapshot, args.mem):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    client.pause()
+    start = time.monotonic()
+    client.create_snapshot(os.path.abspath(args.snapshot), os.path.abspath(args.mem))
+    print(f"Snapshot created in {time.monotonic() - start:.3f}s: {args.snapshot}, {args.mem}",
+          file=sys.stderr)
+    if args.resume:
+        client.resume()
+
+
+def load(args):
+    """Restore the VM from a snapshot."""
+
+    for path in (args.snapshot, args.mem):
+        if not os.path.isfile(path):
+            print(f"Error: Unable to open snapshot file '{path}'", file=sys.stderr)
+            sys.exit(1)
+
+    client = Client(args.socket)
+    client.wait(args.timeout)
+    start = time.monotonic()
+    overrides = dict(override.split("=", 1) for override in args.network_override)
+    client.load_snapshot(os.path.abspath(args.snapshot), os.path.abspath(args.mem),
+                         network_overrides=overrides)
+    print(f"Snapshot loaded in {time.monotonic() - start:.3f}s", file=sys.stderr)
+
+
+class FakeApiHandler(http.server.BaseHTTPRequestHandler):
+    """Stand-in for the Firecracker API, checking the request sequence."""
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body=None):
+        self.send_response(status)
+        if body is None:
+            self.end_headers()
+            return
+        data = json.dumps(body).encode("utf8")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_request(self):
+        vm = self.server.vm
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length)) if length else None
+        vm['requests'].append((self.command, self.path, body))
+
+        if (self.command, self.path) == ("GET", "/"):
+            return self.reply(200, {'id': "fake", 'state': vm['state']})
+        if (self.command, self.path) == ("PATCH", "/vm"):
+            if vm['state'] == "Not started":
+                return self.reply(400, {'fault_message': "VM not started"})
+            vm['state'] = "Paused" if body['state'] == "Paused" else "Running"
+            return self.reply(204)
+        if (self.command, self.path) == ("PUT", "/snapshot/create"):
+            if vm['state'] != "Paused":
+                return self.reply(400, {'fault_message': "VM is not paused"})
+            for key in ('snapshot_path', 'mem_file_path'):
+                with open(body[key], "w", encoding="utf8") as stream:
+                    stream.write(key)
+            return self.reply(204)
+        if (self.command, self.path) == ("PUT", "/snapshot/load"):
+            if vm['state'] != "Not started":
+                return self.reply(400, {'fault_message': "Loading a snapshot is not allowed "
+                                                         "after configuring the VM"})
+            vm['state'] = "Running" if body['resume_vm'] else "Paused"
+            return self.reply(204)
+        return self.reply(400, {'fault_message': f"Invalid request {self.path}"})
+
+    do_GET = do_PUT = do_PATCH = handle_request
+
+
+def self_test():
+    """Check the client against a stand-in for the Firecracker API."""
+
+    failures = []
+
+    def check(condition, message):
+        print(f"{'ok' if condition else 'FAIL'}: {message}")
+        if not condition:
+            failures.append(message)
+
+    with tempfile.TemporaryDirectory(prefix="fc-snapshot-") as workdir:
+        path = os.path.join(workdir, "api.socket")
+        server = socketserver.ThreadingUnixStreamServer(path, FakeApiHandler)
+        server.daemon_threads = True
+        server.vm = {'state': "Running", 'requests': []}
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        console = os.path.join(workdir, "console.log")
+        with open(console, "w", encoding="utf8") as stream:
+            stream.write("Powered by Unikraft\nListening on port 8080\n")
+
+        snapshot = os.path.join(workdir, "snapshot", "vm.snap")
+        mem = os.path.join(workdir, "snapshot", "vm.mem")
+        args = argparse.Namespace(socket=path, ready="console:^Listening", console=console,
+                                  timeout=5, snapshot=snapshot, mem=mem, resume=False)
+        create(args)
+        requests = [(method, uri) for method, uri, _ in server.vm['requests']]
+        check(requests == [("GET", "/"), ("PATCH", "/vm"), ("PUT", "/snapshot/create")],
+              "create pauses the VM before creating the snapshot")
+        check(server.vm['requests'][-1][2]['snapshot_type'] == "Full", "snapshot is full")
+        check(os.path.isfile(snapshot) and os.path.isfile(mem), "snapshot files are created")
+        check(server.vm['state'] == "Paused", "VM stays paused without --resume")
+
+        try:
+            Client(path).create_snapshot(snapshot, mem)
+            Client(path).resume()
+            Client(path).create_snapshot(snapshot, mem)
+            check(False, "API errors are raised")
+        except ApiError as exc:
+            check("VM is not paused" in str(exc), "API errors are raised with the fault message")
+
+        server.vm = {'state': "Not started", 'requests': []}
+        load(argparse.Namespace(socket=path, timeout=5, snapshot=snapshot, mem=mem,
+                                network_override=["net1=tap3"]))
+        body = server.vm['requests'][-1][2]
+        check(body['mem_backend'] == {'backend_type': "File", 'backend_path': mem} and
+              body['resume_vm'], "load resumes the VM from the memory file")
+        check(body['network_overrides'] == [{'iface_id': "net1", 'host_dev_name': "tap3"}],
+              "load attaches the interface to another tap interface")
+        check(Client(path).state() == "Running", "restored VM is running")
+
+        check(not wait_ready("console:^Never", console, 0.2), "readiness times out")
+        server.shutdown()
+        server.server_close()
+
+    try:
+        Client(path, timeout=1).wait(0.1)
+        check(False, "missing socket is reported")
+    except ApiError:
+        check(True, "missing socket is reported")
+
+    print("FAILED" if failures else "PASSED")
+    return 1 if failures else 0
+
+
+def parse_args():
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(description="Create and restore Firecracker snapshots.")
+    parser.add_argument("--self-test", action="store_true",
+                        help="check the client against a stand-in Firecracker API")
+    subparsers = parser.add_subparsers(dest="command")
+
+    parser_create = subparsers.add_parser("create", help="snapshot the running application")
+    parser_load = subparsers.add_parser("load", help="restore the application from a snapshot")
+    for subparser in (parser_create, parser_load):
+        subparser.add_argument("--socket", default=API_SOCKET,
+                               help=f"Firecracker API socket (default: {API_SOCKET})")
+        subparser.add_argument("--snapshot", required=True, help="VM state file")
+        subparser.add_argument("--mem", required=True, help="guest memory file")
+        subparser.add_argument("--timeout", type=float, default=60,
+                               help="seconds to wait for Firecracker and the application "
+                                    "(default: 60)")
+    parser_load.add_argument("--network-override", action="append", default=[],
+                             metavar="IFACE=TAP",
+                             help="attach an interface to another tap interface (repeatable)")
+    parser_create.add_argument("--ready", default="delay:1",
+                               help="readiness: tcp:HOST:PORT, console:REGEX or delay:SECONDS "
+                                    "(default: delay:1)")
+    parser_create.add_argument("--console", help="console output file, for console readiness")
+    parser_create.add_argument("--resume", action="store_true",
+                               help="resume the VM after the snapshot")
+
+    args = parser.parse_args()
+    if not args.self_test and not args.command:
+        parser.error("a command is required")
+    if args.command == "load":
+        for override in args.network_override:
+            if "=" not in override:
+                parser.error(f"invalid network override '{override}'")
+    if args.command == "create":
+        kind = args.ready.partition(":")[0]
+        if kind not in ("tcp", "console", "delay"):
+            parser.error(f"invalid readiness '{args.ready}'")
+        if kind == "console" and not args.console:
+            parser.error("console readiness requires --console")
+    return args
+
+
+def main():
+    """The main program function."""
+
+    args = parse_args()
+    if args.self_test:
+        return self_test()
+
+    try:
+        if args.command == "create":
+            create(args)
+        else:
+            load(args)
+    except ApiError as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        sys.exit(1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
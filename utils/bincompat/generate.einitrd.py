@@ -10,26 +10,78 @@ Use QEMU, Firecracker and Krafkit for running.
 
 import sys
 import os
-import stat
-import shutil
+import time
+import argparse
+import concurrent.futures
 import yaml
+import outputs
+import toolchains
+import smp
+
+
+SETUP_SCRIPT_HEADER = """#!/bin/sh
+
+# Repositories are cloned once in a shared store of bare mirrors
+# and checked out from there using cheap shared clones.
+mirrors="${UK_MIRRORS:-${XDG_CACHE_HOME:-$HOME/.cache}/unikraft/mirrors}"
+
+# Use UK_OFFLINE=1 to only use existing mirrors (no network access).
+offline="${UK_OFFLINE:-0}"
+
+# Mirrors are fetched at most every UK_MIRROR_TTL minutes.
+ttl="${UK_MIRROR_TTL:-60}"
+
+update_mirror()
+{
+    url="$1"
+    mirror="$2"
+
+    if test ! -d "$mirror"; then
+        if test "$offline" = 1; then
+            echo "Error: No mirror of $url in $mirrors" 1>&2
+            return 1
+        fi
+        git clone --quiet --mirror "$url" "$mirror" || return 1
+        # Objects are shared with checkouts, never prune them.
+        git -C "$mirror" config gc.auto 0
+        git -C "$mirror" config gc.pruneExpire never
+        touch "$mirror"/FETCH_HEAD
+    elif test "$offline" != 1; then
+        if test -z "$(find "$mirror"/FETCH_HEAD -mmin -"$ttl" 2> /dev/null)"; then
+            git -C "$mirror" fetch --quiet origin || return 1
+            touch "$mirror"/FETCH_HEAD
+        fi
+    fi
+}
 
-
-TEMPLATE_SETUP_SCRIPT = """#!/bin/sh
-
-test -d workdir/unikraft || git clone https://github.com/unikraft/unikraft workdir/unikraft
-
-for l in {}; do
-    test -d workdir/libs/"$l" || git clone https://github.com/unikraft/lib-"$l" workdir/libs/"$l"
-done
-
-test -d workdir/apps/ || git clone https://github.com/unikraft/app-elfloader workdir/apps/elfloader
-"""
-
-TEMPLATE_SETUP_NOLIB_SCRIPT = """#!/bin/sh
-
-test -d workdir/unikraft || git clone https://github.com/unikraft/unikraft workdir/unikraft
-test -d workdir/apps/ || git clone https://github.com/unikraft/app-elfloader workdir/apps/elfloader
+fetch()
+{
+    url="$1"
+    version="$2"
+    dest="$3"
+
+    test -d "$dest" && return 0
+
+    mkdir -p "$mirrors"
+    mirror="$mirrors/$(basename "$url" .git).git"
+    origin="$(git -C "$mirror" config remote.origin.url 2> /dev/null)"
+    if test "$offline" != 1 && test -n "$origin" && test "$origin" != "$url"; then
+        # Mirror of another repository with the same name (e.g. a fork).
+        git clone --quiet "$url" "$dest" || return 1
+    else
+        (
+            # Serialize updates of a mirror between parallel setups.
+            command -v flock > /dev/null && flock 9
+            update_mirror "$url" "$mirror"
+        ) 9> "$mirror.lock" || return 1
+        git clone --quiet --shared --no-checkout "$mirror" "$dest" || return 1
+        git -C "$dest" remote set-url origin "$url"
+    fi
+    if ! git -C "$dest" checkout --quiet "${version:-HEAD}"; then
+        rm -fr "$dest"
+        return 1
+    fi
+}
 """
 
 TEMPLATE_BUILD_MAKE = """#!/bin/sh
@@ -41,16 +93,72 @@ touch Makefile.uk
 make prepare
 make rootfs.cpio
 ln -sfn $(pwd)/rootfs.cpio workdir/apps/elfloader/initrd.cpio
-make {} -j $(nproc)
-test $? -eq 0 && ln -fn workdir/build/{}_{}-{} {}/{}-{}_{}-{}
+# Use the jobserver of a parent make (e.g. build-catalog.py), if any.
+jobs="-j $(nproc)"
+case "$MAKEFLAGS" in *jobserver*) jobs="" ;; esac
+{}make {} $jobs
+ret=$?
+{}test $ret -eq 0 && ln -fn workdir/build/{}_{}-{} {}/{}-{}_{}-{}
 """
 
+# Compiler caches, wrapping the compiler used by Make. The cache
+# directory is shared by all applications. Cache entries are keyed on
+# the compiler (contents), its command line and the preprocessed
+# sources, including the configuration header generated from the
+# defconfig, so different configurations never share an entry.
+TEMPLATE_COMPILER_CACHE_SETUP = {
+    'ccache': """# Compile through ccache, with a cache shared by all applications.
+export CCACHE_DIR="${{UK_COMPILER_CACHE_DIR:-{dir}}}"
+# Hash paths relative to the application, to share entries between applications.
+export CCACHE_BASEDIR="$(pwd)"
+export CCACHE_NOHASHDIR=1
+export CCACHE_COMPILERCHECK=content
+export CCACHE_STATSLOG="$(pwd)/workdir/ccache.log"
+rm -f "$CCACHE_STATSLOG"
+mkdir -p workdir/ccache-bin
+printf '#!/bin/sh\\nexec ccache %s "$@"\\n' "{path}" > workdir/ccache-bin/{command}
+chmod +x workdir/ccache-bin/{command}
+export PATH="$(pwd)/workdir/ccache-bin:$PATH"
+""",
+    'sccache': """# Compile through sccache, with a cache shared by all applications.
+export SCCACHE_DIR="${{UK_COMPILER_CACHE_DIR:-{dir}}}"
+# Statistics are kept by the sccache server, shared by parallel builds.
+sccache --start-server > /dev/null 2>&1
+sccache --zero-stats > /dev/null
+mkdir -p workdir/sccache-bin
+printf '#!/bin/sh\\nexec sccache %s "$@"\\n' "{path}" > workdir/sccache-bin/{command}
+chmod +x workdir/sccache-bin/{command}
+export PATH="$(pwd)/workdir/sccache-bin:$PATH"
+""",
+    }
+
+TEMPLATE_COMPILER_CACHE_REPORT = {
+    'ccache': """hits=$(grep -c -E '^(direct|preprocessed)_cache_hit' "$CCACHE_STATSLOG" 2> /dev/null)
+misses=$(grep -c '^cache_miss' "$CCACHE_STATSLOG" 2> /dev/null)
+echo "ccache: ${{hits:-0}} hits, ${{misses:-0}} misses"
+""",
+    'sccache': """sccache --show-stats | grep -E '^(Compile requests|Cache hits|Cache misses) '
+""",
+    }
+
 TEMPLATE_BUILD_KRAFT = """#!/bin/sh
 
+kstore="{kstore} -K Kraftfile --plat {plat} --arch {arch}"
+kernel="{kerneldir}/kraft-{name}_{plat}-{arch}"
+
+# Reuse the kernel image from the store if it was already built.
+if test "$UK_KSTORE" != 0 && $kstore --lookup "$kernel"; then
+    exit 0
+fi
+
 sudo rm -fr .unikraft
 rm -f .config.*
-kraft build --log-level debug --log-type basic --no-cache --no-update --plat {} --arch {}
-test $? -eq 0 && ln -fn .unikraft/build/{}_{}-{} {}/kraft-{}_{}-{}
+kraft build --log-level debug --log-type basic --no-cache --no-update --plat {plat} --arch {arch} \\
+    ${{UK_KRAFT_JOBS:+--jobs "$UK_KRAFT_JOBS"}}
+test $? -eq 0 || exit 1
+ln -fn .unikraft/build/{name}_{plat}-{arch} "$kernel"
+test "$UK_KSTORE" != 0 && $kstore --store "$kernel"
+exit 0
 """
 
 TEMPLATE_RUN_QEMU_HEADER = """#!/bin/sh
@@ -77,35 +185,57 @@ $(MAKECMDGOALS):
 	@$(MAKE) -C $(UK_ROOT) A=$(APP) L=$(LIBS) O=$(UK_BUILD) $(MAKECMDGOALS)
 
 rootfs.cpio:
-	test -f Makefile.docker && make -f Makefile.docker rootfs
-	./workdir/unikraft/support/scripts/mkcpio $@ rootfs
+	if test -f Makefile.docker; then \\
+		make -f Makefile.docker rootfs.cpio; \\
+	else \\
+		{} --deterministic -C rootfs -o $@; \\
+	fi
 """
 
-RUN_COMMON_NET_COMMANDS = """
-# Remove previously created network interfaces.
-sudo ip link set dev tap0 down 2> /dev/null
-sudo ip link del dev tap0 2> /dev/null
-sudo ip link set dev virbr0 down 2> /dev/null
-sudo ip link del dev virbr0 2> /dev/null
+# Each run leases an instance, with its own network interfaces, guest
+# addresses and Firecracker files, released on exit (see instance.py).
+TEMPLATE_RUN_INSTANCE_COMMANDS = """
+# Allocate the network, API socket and log of this instance.
+instance_tool={}
+lease=$("$instance_tool" allocate --pid $$ --name "$(basename "$0")") || exit 1
+eval "$lease"
+cleanup() {{
+{}    "$instance_tool" release "$instance"
+}}
+trap cleanup EXIT
+trap 'exit 1' INT TERM HUP
+echo "Instance $instance: $ip" 1>&2
 """
 
 RUN_QEMU_NET_COMMANDS = """
 # Create bridge interface for QEMU networking.
-sudo ip link add dev virbr0 type bridge
-sudo ip address add 172.44.0.1/24 dev virbr0
-sudo ip link set dev virbr0 up
+sudo ip link del dev "$bridge" 2> /dev/null
+sudo ip link add dev "$bridge" type bridge
+sudo ip address add "$gateway"/24 dev "$bridge"
+sudo ip link set dev "$bridge" up
+"""
+
+RUN_QEMU_NET_CLEANUP = """    sudo ip link del dev "$bridge" 2> /dev/null
 """
 
 RUN_FIRECRACKER_NET_COMMANDS = """
 # Create tap interface for Firecracker networking.
-sudo ip tuntap add dev tap0 mode tap
-sudo ip address add 172.44.0.1/24 dev tap0
-sudo ip link set dev tap0 up
+sudo ip link del dev "$tap" 2> /dev/null
+sudo ip tuntap add dev "$tap" mode tap
+sudo ip address add "$gateway"/24 dev "$tap"
+sudo ip link set dev "$tap" up
+"""
+
+RUN_FIRECRACKER_NET_CLEANUP = """    sudo ip link del dev "$tap" 2> /dev/null
 """
 
 RUN_KRAFT_NET_COMMANDS = """
 # Create bridge interface for KraftKit networking.
-sudo kraft net create -n 172.44.0.1/24 virbr0
+sudo kraft net rm "$bridge" 2> /dev/null
+sudo kraft net create -n "$gateway"/24 "$bridge"
+"""
+
+RUN_KRAFT_NET_CLEANUP = """    sudo kraft net rm "$bridge" 2> /dev/null
 """
 
 TEMPLATE_RUN_FIRECRACKER_HEADER = """#!/bin/sh
@@ -118,33 +248,171 @@ fi
 """
 
 RUN_FIRECRACKER_PREPARE = """
-# Remove previously created files.
-sudo rm -f /tmp/firecracker.log
-touch /tmp/firecracker.log
-sudo rm -f /tmp/firecracker.socket
+# Use the network and log of this instance.
+"$instance_tool" firecracker-config --instance "$instance" "$config" > "$instance_dir/config.json" || exit 1
+touch "$log"
 """
 
 RUN_FIRECRACKER_COMMAND = """firecracker-x86_64 \\
-        --api-sock /tmp/firecracker.socket \\
-        --config-file "$config"
+        --api-sock "$socket" \\
+        --config-file "$instance_dir/config.json"
 """
 
-RUN_KRAFT_HEADER = """#!/bin/sh
+# Logger and metrics of Firecracker configurations (`fc_profile` in
+# config.yaml). Production runs only log warnings and send metrics to a
+# FIFO read by fc-metrics.py; paths are set per instance (instance.py).
+FC_PROFILES = {
+    "debug": """  "logger": {
+    "log_path": "/tmp/firecracker.log",
+    "level": "Debug",
+    "show_level": true,
+    "show_log_origin": true
+  },
+  "metrics": null,
+""",
+    "production": """  "logger": {
+    "log_path": "/tmp/firecracker.log",
+    "level": "Warning",
+    "show_level": false,
+    "show_log_origin": false
+  },
+  "metrics": {
+    "metrics_path": "/tmp/firecracker.metrics"
+  },
+""",
+    }
+
+TEMPLATE_RUN_FIRECRACKER_METRICS_COMMANDS = """
+# Collect the metrics of this run, summarized on exit (see fc-metrics.py).
+mkdir -p {metrics_dir}
+{tool} "$metrics" --output "{metrics_dir}/$(basename "$0" .sh)-$(date +%Y%m%d-%H%M%S).json" &
+metrics_pid=$!
+while test ! -p "$metrics"; do
+    kill -0 $metrics_pid 2> /dev/null || exit 1
+    sleep 0.01
+done
+"""
+
+RUN_FIRECRACKER_METRICS_CLEANUP = """    if test -n "$metrics_pid"; then
+        kill $metrics_pid 2> /dev/null
+        wait $metrics_pid
+    fi
 """
 
-RUN_KILL_COMMANDS = """
-# Clean up any previous instances.
-sudo pkill -f qemu-system 2> /dev/null
-sudo pkill -f firecracker 2> /dev/null
-sudo kraft stop --all 2> /dev/null
-sudo kraft rm --all 2> /dev/null
+# Snapshots are created from a regular boot once the application is
+# ready, and restored in a Firecracker process started without a
+# configuration (see fc-snapshot.py).
+TEMPLATE_RUN_FIRECRACKER_SNAPSHOT_COMMANDS = """
+# Boot the application and snapshot it once ready.
+snapshot="{snapshot}"
+mkdir -p "$(dirname "$snapshot")"
+{sudo}{taskset}firecracker-x86_64 \\
+        --api-sock "$socket" \\
+        --config-file "$instance_dir/config.json" > "$snapshot.console" 2>&1 &
+fc_pid=$!
+trap '{sudo}kill $fc_pid 2> /dev/null; exit 1' INT TERM HUP
+{sudo}{tool} create --socket "$socket" --ready "{ready}" --console "$snapshot.console" \\
+        --snapshot "$snapshot.snap" --mem "$snapshot.mem"
+status=$?
+{sudo}kill $fc_pid 2> /dev/null
+wait $fc_pid
+# The restored guest keeps the network configuration of this instance.
+echo "snapshot_tap=$tap snapshot_ip=$ip snapshot_gateway=$gateway" > "$snapshot.env"
+exit $status
+"""
+
+# Restored guests keep the address they had when snapshotted, their
+# interface is attached to the tap interface of the new instance.
+RUN_FIRECRACKER_RESTORE_NETWORK = """
+# Use the network configuration of the snapshot.
+. "$snapshot.env" || exit 1
+ip="$snapshot_ip"
+gateway="$snapshot_gateway"
+"$instance_tool" update "$instance" --ip "$ip"
+if test "$tap" != "$snapshot_tap"; then
+    overrides="--network-override net1=$tap"
+fi
+"""
+
+TEMPLATE_RUN_FIRECRACKER_RESTORE_HEADER = """#!/bin/sh
+
+snapshot="{}"
+
+if test $# -eq 1; then
+    snapshot="$1"
+fi
+"""
+
+TEMPLATE_RUN_FIRECRACKER_RESTORE_COMMANDS = """
+# Restore the application from the snapshot.
+{sudo}{taskset}firecracker-x86_64 \\
+        --api-sock "$socket" &
+fc_pid=$!
+trap '{sudo}kill $fc_pid 2> /dev/null; exit 1' INT TERM HUP
+if ! {sudo}{tool} load --socket "$socket" $overrides \\
+        --snapshot "$snapshot.snap" --mem "$snapshot.mem"; then
+    {sudo}kill $fc_pid 2> /dev/null
+fi
+wait $fc_pid
+"""
+
+RUN_KRAFT_HEADER = """#!/bin/sh
 """
 
 TEMPLATE_RUN_CPIO_COMMANDS = """
 rootfs={}
 
 # Create CPIO archive to be used as the initrd.
-./workdir/unikraft/support/scripts/mkcpio initrd.cpio "$rootfs"
+{} --deterministic -C "$rootfs" -o initrd.cpio
+"""
+
+TEMPLATE_RUN_SHARED_ROOTFS = """
+rootfs={}
+"""
+
+# Shared root filesystem served by virtiofsd. Guest memory is shared
+# with virtiofsd through a memfd backend.
+TEMPLATE_RUN_VIRTIOFS_COMMANDS = """
+# Serve the root filesystem with virtiofsd.
+virtiofsd="${{VIRTIOFSD:-$(command -v virtiofsd || echo /usr/libexec/virtiofsd)}}"
+virtiofs_sock="$instance_dir/virtiofsd.sock"
+"$virtiofsd" --socket-path="$virtiofs_sock" --shared-dir="$rootfs" --cache={} --sandbox=none &
+virtiofsd_pid=$!
+trap 'kill $virtiofsd_pid 2> /dev/null; cleanup' EXIT
+i=0
+while test ! -S "$virtiofs_sock"; do
+    i=$((i + 1))
+    test $i -gt 50 && echo "Error: virtiofsd did not start" 1>&2 && exit 1
+    sleep 0.1
+done
+"""
+
+# Root filesystems of QEMU run scripts, besides the initrd. Shared
+# directories are exported with the `fs0` tag.
+QEMU_FILESYSTEMS = ["initrd", "9pfs", "virtiofs"]
+
+# Compressed initrds, decompressed by the guest while extracting. The
+# Unikraft configuration enabling decompression is set in `config.yaml`
+# (`initrd_compression_kconfig`), as upstream Unikraft doesn't support it.
+# Run scripts compress at a fast level by default
+# (`initrd_compression_level`), decompression is about as fast at any level.
+INITRD_COMPRESSION = {
+    'gzip': ("initrd.cpio.gz", 1, "gzip -{level} -n -c initrd.cpio > {output}"),
+    'lz4': ("initrd.cpio.lz4", 1, "lz4 -{level} -l -q -f initrd.cpio {output}"),
+    'zstd': ("initrd.cpio.zst", 3, "zstd -{level} -q -f initrd.cpio -o {output}"),
+    }
+
+# The compressed initrd is replaced, not rewritten, as instances may be
+# booting from it.
+TEMPLATE_RUN_COMPRESS_COMMANDS = """
+# Compress the initrd ({name}), if it changed since it was compressed.
+if test ! {file} -nt initrd.cpio; then
+    if {command}; then
+        mv -f {file}.$$.tmp {file}
+    else
+        rm -f {file}.$$.tmp
+    fi
+fi
 """
 
 
@@ -153,35 +421,52 @@ SCRIPTS = "scripts"
 BUILD = "build"
 RUN = "run"
 KERNEL = "kernel"
+SNAPSHOT = "snapshot"
+METRICS = "metrics"
 CONFIG = "config.yaml"
 KRAFTCONFIG = "Kraftfile"
+GENERATOR = "generate.einitrd"
 
+# Directory for caches shared by all applications.
+CACHE_DIR = "${XDG_CACHE_HOME:-$HOME/.cache}/unikraft"
 
-def files(path):
-    """Extract regular files in given directory.
+# Default repositories of Kraftfile components.
+UNIKRAFT_SOURCE = "https://github.com/unikraft/unikraft.git"
+LIB_SOURCE = "https://github.com/unikraft/lib-{}.git"
+ELFLOADER_SOURCE = "https://github.com/unikraft/app-elfloader.git"
 
-    Ignore directories or other file types.
-    """
+# Top-level catalog directories searched for applications.
+CATALOG_ROOT = os.path.realpath(os.path.join(os.path.dirname(__file__), "..", ".."))
+CATALOG_DIRS = ["library", "examples", "native"]
+# Directories holding generated or downloaded contents.
+CATALOG_SKIP_DIRS = ["workdir", "rootfs", "node_modules", SCRIPTS]
+
+
+class ConfigError(Exception):
+    """Application configuration cannot be loaded."""
+
+
+class NotApplicableError(ConfigError):
+    """Application is not built from a Unikraft configuration.
 
-    for file in os.listdir(path):
-        file_path = os.path.join(path, file)
-        if os.path.isfile(os.path.join(path, file)):
-            yield file_path
+    This is the case for bincompat applications using a runtime
+    (see generate.py).
+    """
 
 
 def generate_setup(config):
-    """Generate shell script to set up repositories."""
+    """Generate shell script to set up repositories.
 
-    if config['libs']:
-        contents = TEMPLATE_SETUP_SCRIPT.format(" ".join(l for l in config['libs']))
-    else:
-        contents = TEMPLATE_SETUP_NOLIB_SCRIPT
+    Repositories are checked out at the versions required in the
+    Kraftfile, from a store of mirrors shared by all applications.
+    """
 
     out_file = os.path.join(config['scriptsdir'], "setup.sh")
-    with open(out_file, "w", encoding="utf-8") as stream:
-        stream.write(contents)
-    sbuf = os.stat(out_file)
-    os.chmod(out_file, sbuf.st_mode | stat.S_IEXEC)
+    with config['outputs'].open(out_file, executable=True) as stream:
+        stream.write(SETUP_SCRIPT_HEADER)
+        stream.write("\n")
+        for repo in config['repos']:
+            stream.write(f"fetch {repo['source']} \"{repo['version'] or ''}\" {repo['dest']} || exit 1\n")
 
 
 def generate_defconfig(config):
@@ -189,7 +474,7 @@ def generate_defconfig(config):
 
     for target in config['targets']:
         out_file = os.path.join(config['defconfigdir'], f"{target['plat']}-{target['arch']}")
-        with open(out_file, "w", encoding="utf-8") as stream:
+        with config['outputs'].open(out_file) as stream:
             stream.write(f"CONFIG_UK_NAME=\"{config['name']}\"\n")
             stream.write(f"CONFIG_UK_DEFNAME=\"{config['name']}\"\n")
             if target['plat'] == 'qemu':
@@ -209,6 +494,39 @@ def generate_defconfig(config):
                 stream.write("CONFIG_LIB{}=y\n".format(lib.replace('-', '_').upper()))
             for key, value in config['kconfig'].items():
                 stream.write(f"{key}={value}\n")
+            for key, value in smp.kconfig(config['smp'], target['arch']).items():
+                if key not in config['kconfig']:
+                    stream.write(f"{key}={value}\n")
+            if config['initrd_compression']:
+                for key, value in config['initrd_compression_kconfig'].items():
+                    stream.write(f"{key}={value}\n")
+
+
+def tool(name):
+    """Return the path of a tool in this directory, relative to the application."""
+
+    return os.path.relpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), name))
+
+
+def instance_commands(config, net_cleanup, cleanup=""):
+    """Return the commands leasing an instance and releasing it on exit."""
+
+    if config['networking']:
+        cleanup += net_cleanup
+    return TEMPLATE_RUN_INSTANCE_COMMANDS.format(tool("instance.py"), cleanup)
+
+
+def fc_metrics(config):
+    """Return the commands collecting Firecracker metrics and stopping the collector.
+
+    Both are empty unless the profile sends metrics to a FIFO.
+    """
+
+    if config['fc_profile'] != "production":
+        return "", ""
+    commands = TEMPLATE_RUN_FIRECRACKER_METRICS_COMMANDS.format(
+            metrics_dir=config['fc_metrics_dir'], tool=tool("fc-metrics.py"))
+    return commands, RUN_FIRECRACKER_METRICS_CLEANUP
 
 
 def generate_build_makefile(config):
@@ -216,12 +534,13 @@ def generate_build_makefile(config):
 
     if config['libs']:
         contents = TEMPLATE_BUILD_MAKEFILE.format(
-                ":".join(f"$(UK_LIBS)/{lib}" for lib in config['libs'])
+                ":".join(f"$(UK_LIBS)/{lib}" for lib in config['libs']),
+                tool("tar2cpio.py")
                 )
     else:
-        contents = TEMPLATE_BUILD_MAKEFILE.format("")
+        contents = TEMPLATE_BUILD_MAKEFILE.format("", tool("tar2cpio.py"))
 
-    with open("Makefile", "w", encoding="utf-8") as stream:
+    with config['outputs'].open("Makefile") as stream:
         stream.write(contents)
 
 
@@ -232,23 +551,28 @@ def generate_build_make(config, defconfig, plat, arch):
     with the `make-` prefix.
     """
 
-    for compiler in config['compilers'][arch]:
-        compiler_version = compiler.split("-")[-1]
-        if "gcc" in compiler:
-            compiler_name = f"gcc-{compiler_version}"
-        if "clang" in compiler:
-            compiler_name = f"clang-{compiler_version}"
-        compiler_var = f"COMPILER={compiler_name}"
-
-        contents = TEMPLATE_BUILD_MAKE.format(defconfig, compiler_var, config['name'], plat, arch,
+    for toolchain in toolchains.for_arch(config['toolchains'], arch):
+        compiler_name = toolchain['name']
+        compiler_var = f"COMPILER={toolchain['compiler']}"
+        if toolchain['prefix']:
+            compiler_var = f"CROSS_COMPILE={toolchain['prefix']} {compiler_var}"
+
+        cache_setup = ""
+        cache_report = ""
+        if config['compiler_cache']:
+            cache_setup = TEMPLATE_COMPILER_CACHE_SETUP[config['compiler_cache']].format(
+                    dir=config['compiler_cache_dir'], path=toolchain['path'],
+                    command=toolchain['command'])
+            cache_report = TEMPLATE_COMPILER_CACHE_REPORT[config['compiler_cache']].format()
+
+        contents = TEMPLATE_BUILD_MAKE.format(defconfig, cache_setup, compiler_var, cache_report,
+                                              config['name'], plat, arch,
                                               config['kerneldir'],
                                               compiler_name, config['name'], plat, arch)
         base = os.path.basename(defconfig)
         out_file = os.path.join(config['builddir'], f"make-{compiler_name}-{base}.sh")
-        with open(out_file, "w", encoding="utf8") as stream:
+        with config['outputs'].open(out_file, executable=True) as stream:
             stream.write(contents)
-        sbuf = os.stat(out_file)
-        os.chmod(out_file, sbuf.st_mode | stat.S_IEXEC)
 
 
 def generate_build_kraft(config, plat, arch):
@@ -258,14 +582,11 @@ def generate_build_kraft(config, plat, arch):
     with the `kraft-` prefix.
     """
 
-    contents = TEMPLATE_BUILD_KRAFT.format(plat, arch,
-                                           config['name'], plat, arch,
-                                           config['kerneldir'], config['name'], plat, arch)
+    contents = TEMPLATE_BUILD_KRAFT.format(kstore=tool("kstore.py"), kerneldir=config['kerneldir'],
+                                           name=config['name'], plat=plat, arch=arch)
     out_file = os.path.join(config['builddir'], f"kraft-{plat}-{arch}.sh")
-    with open(out_file, "w", encoding="utf8") as stream:
+    with config['outputs'].open(out_file, executable=True) as stream:
         stream.write(contents)
-    sbuf = os.stat(out_file)
-    os.chmod(out_file, sbuf.st_mode | stat.S_IEXEC)
 
 
 def generate_build(config):
@@ -276,22 +597,54 @@ def generate_build(config):
 
     generate_build_makefile(config)
 
-    # Generate make-based build scripts from defconfigs.
-    for file in files(config['defconfigdir']):
-        plat, arch = os.path.basename(file).split("-")
-        generate_build_make(config, file, plat, arch)
+    # Generate make-based build scripts from the defconfigs of the targets.
+    for target in config['targets']:
+        file = os.path.join(config['defconfigdir'], f"{target['plat']}-{target['arch']}")
+        generate_build_make(config, file, target['plat'], target['arch'])
 
     for target in config['targets']:
         generate_build_kraft(config, target['plat'], target['arch'])
 
 
+def initrd_commands(config):
+    """Return the commands creating the initrd in run scripts."""
+
+    commands = TEMPLATE_RUN_CPIO_COMMANDS.format(config['rootfs'], tool("tar2cpio.py"))
+    if config['initrd_compression']:
+        file, _, command = INITRD_COMPRESSION[config['initrd_compression']]
+        command = command.format(level=config['initrd_compression_level'],
+                                 output=f"{file}.$$.tmp")
+        commands += TEMPLATE_RUN_COMPRESS_COMMANDS.format(name=config['initrd_compression'],
+                                                          file=file, command=command)
+    return commands
+
+
+def qemu_fstab(config, filesystem):
+    """Return the boot arguments mounting the root filesystem with QEMU."""
+
+    if filesystem == "initrd":
+        args = 'vfs.fstab=[ \\"initrd0:/:extract:::\\" ] '
+        if config['initrd_compression_args']:
+            args += f"{config['initrd_compression_args']} "
+        return args
+    if filesystem == "9pfs":
+        opts = ",".join(f"{key}={config[f'9pfs_{key}']}" for key in ["msize", "cache"]
+                        if config[f'9pfs_{key}'])
+        return f'vfs.fstab=[ \\"fs0:/:9pfs::{opts}:\\" ] '
+    if filesystem == "virtiofs":
+        return 'vfs.fstab=[ \\"fs0:/:virtiofs:::\\" ] '
+    return ""
+
+
 def generate_run_fc_json(config, plat, arch, compiler, filesystem):
     """Generate running config (JSON) for Firecracker."""
 
     kernel = os.path.join(config['kerneldir'], f"{compiler}-{config['name']}_{plat}-{arch}")
 
+    vcpus, smt = smp.fc_machine(config['smp'])
+
     json_name = os.path.join(config['rundir'], f"{compiler}-{plat}-{arch}-{filesystem}.json")
-    with open(json_name, "w", encoding="utf8") as stream:
+    with config['outputs'].open(json_name) as stream:
         stream.write("{\n")
         stream.write('  "boot-source": {\n')
         stream.write(f'    "kernel_image_path": "{kernel}",\n')
@@ -300,19 +653,21 @@ def generate_run_fc_json(config, plat, arch, compiler, filesystem):
             stream.write("netdev.ip=172.44.0.2/24:172.44.0.1 ")
         if config['rootfs']:
             stream.write('vfs.fstab=[ \\"initrd:/:initrd::extract:\\" ] ')
+            if config['initrd_compression_args']:
+                stream.write(f"{config['initrd_compression_args']} ")
         if config['cmd']:
             stream.write(f"-- {config['cmd']}\"")
         else:
             stream.write("-- template")
         if config['rootfs']:
-            stream.write(',\n    "initrd_path": "initrd.cpio"')
+            stream.write(f",\n    \"initrd_path\": \"{config['initrd_file']}\"")
         stream.write("\n  },\n")
         stream.write(
             f"""  "drives": [],
   "machine-config": {{
-    "vcpu_count": 1,
+    "vcpu_count": {vcpus},
     "mem_size_mib": {config['memory']},
-    "smt": false,
+    "smt": {str(smt).lower()},
     "track_dirty_pages": false
   }},
   "cpu-config": null,
@@ -332,14 +687,11 @@ def generate_run_fc_json(config, plat, arch, compiler, filesystem):
             )
         stream.write(
             """  "vsock": null,
-  "logger": {
-    "log_path": "/tmp/firecracker.log",
-    "level": "Debug",
-    "show_level": true,
-    "show_log_origin": true
-  },
-  "metrics": null,
-  "mmds-config": null,
+"""
+        )
+        stream.write(FC_PROFILES[config['fc_profile']])
+        stream.write(
+            """  "mmds-config": null,
   "entropy": null
 }
 """
@@ -352,23 +704,60 @@ def generate_run_fc(config, plat, arch, compiler, filesystem):
     header = TEMPLATE_RUN_FIRECRACKER_HEADER.format(
             os.path.join(f"{config['rundir']}", f"{compiler}-{plat}-{arch}-{filesystem}.json")
             )
+    metrics_commands, metrics_cleanup = fc_metrics(config)
 
     out_file = os.path.join(config['rundir'], f"{compiler}-{plat}-{arch}-{filesystem}.sh")
-    with open(out_file, "w", encoding="utf8") as stream:
+    with config['outputs'].open(out_file, executable=True) as stream:
         stream.write(header)
-        stream.write(RUN_KILL_COMMANDS)
+        stream.write(instance_commands(config, RUN_FIRECRACKER_NET_CLEANUP, metrics_cleanup))
         if config['networking']:
-            stream.write(RUN_COMMON_NET_COMMANDS)
             stream.write(RUN_FIRECRACKER_NET_COMMANDS)
         if config['rootfs']:
             if filesystem == "initrd":
-                stream.write(TEMPLATE_RUN_CPIO_COMMANDS.format(f"{config['rootfs']}"))
+                stream.write(initrd_commands(config))
         stream.write(RUN_FIRECRACKER_PREPARE)
+        stream.write(metrics_commands)
         if config['networking']:
             stream.write("sudo ")
+        stream.write(smp.taskset(config['smp']))
         stream.write(RUN_FIRECRACKER_COMMAND)
-        stbuf = os.stat(out_file)
-        os.chmod(out_file, stbuf.st_mode | stat.S_IEXEC)
+
+
+def generate_run_fc_snapshot(config, plat, arch, compiler, filesystem):
+    """Generate scripts snapshotting and restoring the application using Firecracker."""
+
+    name = f"{compiler}-{plat}-{arch}-{filesystem}"
+    commands = {
+        'sudo': "sudo " if config['networking'] else "",
+        'taskset': smp.taskset(config['smp']),
+        'tool': tool("fc-snapshot.py"),
+        'ready': config['snapshot_ready'],
+        'snapshot': os.path.join(config['scriptsdir'], SNAPSHOT, name),
+        }
+    metrics_commands, metrics_cleanup = fc_metrics(config)
+
+    out_file = os.path.join(config['rundir'], f"{name}-snapshot.sh")
+    with config['outputs'].open(out_file, executable=True) as stream:
+        stream.write(TEMPLATE_RUN_FIRECRACKER_HEADER.format(
+            os.path.join(config['rundir'], f"{name}.json")))
+        stream.write(instance_commands(config, RUN_FIRECRACKER_NET_CLEANUP, metrics_cleanup))
+        if config['networking']:
+            stream.write(RUN_FIRECRACKER_NET_COMMANDS)
+        if config['rootfs'] and filesystem == "initrd":
+            stream.write(initrd_commands(config))
+        stream.write(RUN_FIRECRACKER_PREPARE)
+        stream.write(metrics_commands)
+        stream.write(TEMPLATE_RUN_FIRECRACKER_SNAPSHOT_COMMANDS.format(**commands))
+
+    # The initrd is part of the guest memory in the snapshot.
+    out_file = os.path.join(config['rundir'], f"{name}-restore.sh")
+    with config['outputs'].open(out_file, executable=True) as stream:
+        stream.write(TEMPLATE_RUN_FIRECRACKER_RESTORE_HEADER.format(commands['snapshot']))
+        stream.write(instance_commands(config, RUN_FIRECRACKER_NET_CLEANUP))
+        if config['networking']:
+            stream.write(RUN_FIRECRACKER_RESTORE_NETWORK)
+            stream.write(RUN_FIRECRACKER_NET_COMMANDS)
+        stream.write(TEMPLATE_RUN_FIRECRACKER_RESTORE_COMMANDS.format(**commands))
 
 
 def generate_run_qemu(config, plat, arch, compiler, filesystem):
@@ -382,18 +771,22 @@ def generate_run_qemu(config, plat, arch, compiler, filesystem):
         header = TEMPLATE_RUN_QEMU_HEADER.format(kernel, "")
 
     out_file = os.path.join(config['rundir'], f"{compiler}-{plat}-{arch}-{filesystem}.sh")
-    with open(out_file, "w", encoding="utf8") as stream:
+    with config['outputs'].open(out_file, executable=True) as stream:
         stream.write(header)
-        stream.write(RUN_KILL_COMMANDS)
+        stream.write(instance_commands(config, RUN_QEMU_NET_CLEANUP))
         if config['networking']:
-            stream.write(RUN_COMMON_NET_COMMANDS)
             stream.write(RUN_QEMU_NET_COMMANDS)
         stream.write("\n")
         if config['rootfs']:
             if filesystem == "initrd":
-                stream.write(TEMPLATE_RUN_CPIO_COMMANDS.format(f"{config['rootfs']}"))
+                stream.write(initrd_commands(config))
+            else:
+                stream.write(TEMPLATE_RUN_SHARED_ROOTFS.format(config['rootfs']))
+            if filesystem == "virtiofs":
+                stream.write(TEMPLATE_RUN_VIRTIOFS_COMMANDS.format(config['virtiofs_cache']))
         if config['networking']:
             stream.write("sudo ")
+        stream.write(smp.taskset(config['smp']))
         if arch == "x86_64":
             stream.write("qemu-system-x86_64 \\\n")
             if 'accel' in config.keys():
@@ -405,50 +798,51 @@ def generate_run_qemu(config, plat, arch, compiler, filesystem):
         stream.write('    -kernel "$kernel" \\\n')
         stream.write("    -nographic \\\n")
         stream.write(f"    -m {config['memory']}M \\\n")
+        if config['smp']['vcpus'] > 1:
+            stream.write(f"    -smp {smp.qemu_args(config['smp'])} \\\n")
         if config['networking']:
-            stream.write("    -netdev bridge,id=en0,br=virbr0 ")
-            stream.write("-device virtio-net-pci,netdev=en0 \\\n")
-            stream.write('    -append "netdev.ip=172.44.0.2/24:172.44.0.1 ')
+            stream.write('    -netdev bridge,id=en0,br="$bridge" ')
+            stream.write('-device virtio-net-pci,netdev=en0,mac="$mac" \\\n')
+            stream.write('    -append "netdev.ip=$ip/24:$gateway ')
             if config['rootfs']:
-                if filesystem == "initrd":
-                    stream.write('vfs.fstab=[ \\"initrd0:/:extract:::\\" ] ')
-                elif filesystem == "9pfs":
-                    stream.write('vfs.fstab=[ \\"9pfs:/:fs0::extract:\\" ] ')
+                stream.write(qemu_fstab(config, filesystem))
             stream.write('-- $cmd" \\\n')
         else:
             stream.write('    -append "')
             if config['rootfs']:
-                if filesystem == "initrd":
-                    stream.write('vfs.fstab=[ \\"initrd0:/:extract:::\\" ] ')
-                elif filesystem == "9pfs":
-                    stream.write('vfs.fstab=[ \\"9pfs:/:fs0::extract:\\" ] ')
+                stream.write(qemu_fstab(config, filesystem))
             stream.write('-- $cmd" \\\n')
         if config['rootfs']:
             if filesystem == "initrd":
-                stream.write('    -initrd "$PWD"/initrd.cpio \\\n')
+                stream.write(f"    -initrd \"$PWD\"/{config['initrd_file']} \\\n")
             elif filesystem == "9pfs":
                 stream.write("    -fsdev local,id=myid,path=\"$rootfs\",security_model=none \\\n")
-                stream.write("    -device virtio-9p-pci,fsdev=myid,mount_tag=fs0,")
+                stream.write("    -device virtio-9p-pci,fsdev=myid,mount_tag=fs0 \\\n")
+            elif filesystem == "virtiofs":
+                stream.write("    -chardev socket,id=char0,path=\"$virtiofs_sock\" \\\n")
+                stream.write("    -device vhost-user-fs-pci,queue-size=1024,chardev=char0,tag=fs0 \\\n")
+                stream.write(f"    -object memory-backend-memfd,id=mem,size={config['memory']}M,share=on \\\n")
+                stream.write("    -numa node,memdev=mem \\\n")
         stream.write("    -cpu max\n")
-        stbuf = os.stat(out_file)
-        os.chmod(out_file, stbuf.st_mode | stat.S_IEXEC)
 
 
 def generate_run_kraft(config, plat, arch, filesystem):
     """Generate running script using KraftKit."""
 
     out_file = os.path.join(config['rundir'], f"kraft-{plat}-{arch}-{filesystem}.sh")
-    with open(out_file, "w", encoding="utf8") as stream:
+    with config['outputs'].open(out_file, executable=True) as stream:
         stream.write(RUN_KRAFT_HEADER)
-        stream.write(RUN_KILL_COMMANDS)
+        sudo = "sudo " if config['networking'] else ""
+        stream.write(instance_commands(
+            config, RUN_KRAFT_NET_CLEANUP,
+            f"    {sudo}kraft rm \"{config['name']}-$instance\" 2> /dev/null\n"))
         if config['networking']:
-            stream.write(RUN_COMMON_NET_COMMANDS)
             stream.write(RUN_KRAFT_NET_COMMANDS)
-        stream.write("\n")
+        stream.write(f"\n{sudo}kraft rm \"{config['name']}-$instance\" 2> /dev/null\n")
         if config['networking']:
             stream.write("sudo ")
         stream.write(
-            "KRAFTKIT_BUILDKIT_HOST=docker-container://buildkitd kraft run \\\n"
+            f"KRAFTKIT_BUILDKIT_HOST=docker-container://buildkitd {smp.taskset(config['smp'])}kraft run \\\n"
         )
         if 'accel' not in config.keys():
             stream.write("    -W \\\n")
@@ -457,25 +851,19 @@ def generate_run_kraft(config, plat, arch, filesystem):
         elif arch == "arm64":
             stream.write("    -W \\\n")
         stream.write(f"    --memory {config['memory']}M \\\n")
+        stream.write(f"    --name \"{config['name']}-$instance\" \\\n")
         stream.write("    --log-level debug --log-type basic \\\n")
         if config['networking']:
-            stream.write("    --network bridge:virbr0 \\\n")
+            stream.write('    --network bridge:"$bridge" \\\n')
         stream.write(f"    --arch {arch} --plat {plat}\n")
 
-        stbuf = os.stat(out_file)
-        os.chmod(out_file, stbuf.st_mode | stat.S_IEXEC)
-
 
 def generate_run(config):
     """Generate running scripts."""
 
     for target in config['targets']:
-        for compiler in config['compilers'][target['arch']]:
-            compiler_version = compiler.split("-")[-1]
-            if "gcc" in compiler:
-                compiler_name = f"gcc-{compiler_version}"
-            if "clang" in compiler:
-                compiler_name = f"clang-{compiler_version}"
+        for toolchain in toolchains.for_arch(config['toolchains'], target['arch']):
+            compiler_name = toolchain['name']
 
             if target['plat'] == "fc" or \
                     target['plat'] == "firecracker" or \
@@ -483,13 +871,17 @@ def generate_run(config):
                 if config['rootfs']:
                     generate_run_fc_json(config, target['plat'], target['arch'], compiler_name, "initrd")
                     generate_run_fc(config, target['plat'], target['arch'], compiler_name, "initrd")
+                    generate_run_fc_snapshot(config, target['plat'], target['arch'], compiler_name,
+                                             "initrd")
                 else:
                     generate_run_fc_json(config, target['plat'], target['arch'], compiler_name, "nofs")
                     generate_run_fc(config, target['plat'], target['arch'], compiler_name, "nofs")
+                    generate_run_fc_snapshot(config, target['plat'], target['arch'], compiler_name,
+                                             "nofs")
             elif target['plat'] == "qemu":
                 if config['rootfs']:
-                    generate_run_qemu(config, target['plat'], target['arch'], compiler_name, "initrd")
-                    generate_run_qemu(config, target['plat'], target['arch'], compiler_name, "9pfs")
+                    for filesystem in config['filesystems']:
+                        generate_run_qemu(config, target['plat'], target['arch'], compiler_name, filesystem)
                 else:
                     generate_run_qemu(config, target['plat'], target['arch'], compiler_name, "nofs")
 
@@ -497,39 +889,44 @@ def generate_run(config):
         generate_run_kraft(config, target['plat'], target['arch'], "nofs")
 
 
-def get_compilers(config):
-    """Get list of compilers available on the system."""
+def repo(spec, source, dest):
+    """Return repository to set up from a Kraftfile component.
 
-    # XXX: For now assume an x86 system.
-    config['compilers'] = {
-            'x86_64': [],
-            'arm64': []
-            }
-    for version in range(5, 30):
-        if shutil.which(f"gcc-{version}"):
-            config['compilers']['x86_64'].append(f"gcc-{version}")
-        if shutil.which(f"aarch64-linux-gnu-gcc-{version}"):
-            config['compilers']['arm64'].append(f"aarch64-linux-gnu-gcc-{version}")
-    for version in range(9, 30):
-        if shutil.which(f"clang-{version}"):
-            config['compilers']['x86_64'].append(f"clang-{version}")
-            config['compilers']['arm64'].append(f"clang-{version}")
+    The component is either a version string or a dictionary with
+    optional `source` and `version` keys.
+    """
 
+    version = None
+    if isinstance(spec, dict):
+        source = spec.get('source', source)
+        version = spec.get('version')
+    elif spec:
+        version = str(spec)
+
+    return {
+        'source': source,
+        'version': version,
+        'dest': dest,
+        }
 
-def main():
-    """The main program function calls generate functions."""
+
+def load_config(check=False):
+    """Load application configuration from the current directory.
+
+    Read `config.yaml` and `Kraftfile`, fill in defaults and create
+    the output directories (unless only checking them). Raise
+    ConfigError if the application cannot be configured.
+    """
 
     # Obtain configurations for running applications.
     try:
         with open(CONFIG, "r", encoding="utf8") as stream:
             config = yaml.safe_load(stream)
-    except IOError:
-        print(f"Error: Unable to open configuration file '{CONFIG}'", file=sys.stderr)
-        sys.exit(1)
+    except IOError as exc:
+        raise ConfigError(f"Unable to open configuration file '{CONFIG}'") from exc
 
     if not 'memory' in config.keys():
-        print(f"Error: 'memory' attribute is not defined in '{CONFIG}'", file=sys.stderr)
-        sys.exit(1)
+        raise ConfigError(f"'memory' attribute is not defined in '{CONFIG}'")
 
     if not 'rootfs' in config.keys():
         config['rootfs'] = None
@@ -545,6 +942,104 @@ def main():
         config['rundir'] = os.path.join(config['scriptsdir'], RUN)
     if not 'kerneldir' in config.keys():
         config['kerneldir'] = os.path.join(config['scriptsdir'], KERNEL)
+    if not 'compiler_cache' in config.keys():
+        config['compiler_cache'] = None
+    if config['compiler_cache'] and config['compiler_cache'] not in TEMPLATE_COMPILER_CACHE_SETUP:
+        raise ConfigError(f"Unknown 'compiler_cache' '{config['compiler_cache']}' in '{CONFIG}'")
+    if not 'compiler_cache_dir' in config.keys():
+        config['compiler_cache_dir'] = os.path.join(CACHE_DIR, str(config['compiler_cache']))
+    if not 'initrd_compression' in config.keys() or config['initrd_compression'] == "none":
+        config['initrd_compression'] = None
+    if config['initrd_compression'] and config['initrd_compression'] not in INITRD_COMPRESSION:
+        raise ConfigError(f"Unknown 'initrd_compression' '{config['initrd_compression']}' in '{CONFIG}'")
+    if config['initrd_compression'] and not config.get('initrd_compression_kconfig'):
+        raise ConfigError(f"'initrd_compression' requires 'initrd_compression_kconfig' in '{CONFIG}'")
+    if not 'initrd_compression_args' in config.keys():
+        config['initrd_compression_args'] = None
+    if config['initrd_compression'] and not 'initrd_compression_level' in config.keys():
+        config['initrd_compression_level'] = INITRD_COMPRESSION[config['initrd_compression']][1]
+    if not 'filesystems' in config.keys():
+        config['filesystems'] = ["initrd", "9pfs"]
+    for filesystem in config['filesystems']:
+        if filesystem not in QEMU_FILESYSTEMS:
+            raise ConfigError(f"Unknown filesystem '{filesystem}' in '{CONFIG}'")
+    for key in ['9pfs_msize', '9pfs_cache']:
+        if not key in config.keys():
+            config[key] = None
+    if not 'virtiofs_cache' in config.keys():
+        config['virtiofs_cache'] = "auto"
+    # Firecracker logger and metrics, see FC_PROFILES.
+    if not 'fc_profile' in config.keys():
+        config['fc_profile'] = "debug"
+    if config['fc_profile'] not in FC_PROFILES:
+        raise ConfigError(f"Unknown 'fc_profile' '{config['fc_profile']}' in '{CONFIG}'")
+    if not 'fc_metrics_dir' in config.keys():
+        config['fc_metrics_dir'] = os.path.join(config['scriptsdir'], METRICS)
+    # Readiness of the application before snapshotting, see fc-snapshot.py.
+    if not 'snapshot_ready' in config.keys():
+        config['snapshot_ready'] = "tcp:$ip:8080" if config['networking'] else "delay:1"
+    try:
+        config['smp'] = smp.parse(config)
+    except ValueError as exc:
+        raise ConfigError(f"{exc} in '{CONFIG}'") from exc
+    if config['initrd_compression']:
+        config['initrd_file'] = INITRD_COMPRESSION[config['initrd_compression']][0]
+    else:
+        config['initrd_file'] = "initrd.cpio"
+
+    # Parse KraftKit config file (usually Kraftfile).
+    try:
+        with open(KRAFTCONFIG, "r", encoding="utf8") as stream:
+            data = yaml.safe_load(stream)
+    except IOError as exc:
+        raise ConfigError(f"Unable to open Kraft configuration file '{KRAFTCONFIG}'") from exc
+
+    if not 'name' in data.keys():
+        raise ConfigError(f"'name' attribute is not defined in '{KRAFTCONFIG}'")
+    config['name'] = data['name']
+
+    if not 'cmd' in data.keys():
+        config['cmd'] = None
+    else:
+        config['cmd'] = " ".join(c for c in data['cmd'])
+
+    if 'runtime' in data.keys() and not 'unikraft' in data.keys():
+        raise NotApplicableError(f"'{KRAFTCONFIG}' uses runtime '{data['runtime']}'")
+    if not 'unikraft' in data.keys() or not 'kconfig' in data['unikraft'].keys():
+        raise ConfigError(f"'unikraft.kconfig' attribute is not defined in '{KRAFTCONFIG}'")
+    config['kconfig'] = data['unikraft']['kconfig']
+
+    config['repos'] = [repo(data['unikraft'], UNIKRAFT_SOURCE, os.path.join("workdir", "unikraft"))]
+
+    if not "libraries" in data.keys():
+        config['libs'] = None
+    else:
+        config['libs'] = list(data['libraries'].keys())
+        for lib in config['libs']:
+            config['repos'].append(repo(data['libraries'][lib], LIB_SOURCE.format(lib),
+                                        os.path.join("workdir", "libs", lib)))
+            if isinstance(data['libraries'][lib], dict):
+                if "kconfig" in data['libraries'][lib].keys():
+                    config['kconfig'].update(data['libraries'][lib]['kconfig'])
+
+    config['repos'].append(repo(data.get('template'), ELFLOADER_SOURCE,
+                                os.path.join("workdir", "apps", "elfloader")))
+
+    config['targets'] = []
+    for target in data['targets']:
+        plat, arch = target.split('/')
+        config['targets'].append({
+            'plat': plat,
+            'arch': arch})
+        if plat in ["fc", "firecracker", "kraftcloud"]:
+            try:
+                smp.fc_machine(config['smp'])
+            except ValueError as exc:
+                raise ConfigError(str(exc)) from exc
+
+    if check:
+        # Nothing is written, missing directories are reported as missing files.
+        return config
 
     if not os.path.exists(config['scriptsdir']):
         os.mkdir(config['scriptsdir'])
@@ -582,51 +1077,183 @@ def main():
         print(f"Error: Unable to access running directory '{config['rundir']}'",
               file=sys.stderr)
 
-    # Parse KraftKit config file (usually Kraftfile).
-    try:
-        with open(KRAFTCONFIG, "r", encoding="utf8") as stream:
-            data = yaml.safe_load(stream)
-    except IOError:
-        print(f"Error: Unable to open Kraft configuration file '{KRAFTCONFIG}'",
-              file=sys.stderr)
-        sys.exit(1)
+    return config
 
-    if not 'name' in data.keys():
-        print(f"Error: 'name' attribute is not defined in '{KRAFTCONFIG}'",
-              file=sys.stderr)
-        sys.exit(1)
-    config['name'] = data['name']
 
-    if not 'cmd' in data.keys():
-        config['cmd'] = None
-    else:
-        config['cmd'] = " ".join(c for c in data['cmd'])
+def setup_outputs(config, incremental=False, check=False):
+    """Set up tracking of generated files.
 
-    config['kconfig'] = data['unikraft']['kconfig']
+    The generator inputs are the Kraftfile, the configuration file, the
+    toolchains and the generator sources.
+    """
 
-    if not "libraries" in data.keys():
-        config['libs'] = None
-    else:
-        config['libs'] = list(data['libraries'].keys())
-        for lib in config['libs']:
-            if isinstance(data['libraries'][lib], dict):
-                if "kconfig" in data['libraries'][lib].keys():
-                    config['kconfig'].update(data['libraries'][lib]['kconfig'])
+    inputs = outputs.inputs_digest([KRAFTCONFIG, CONFIG, __file__, outputs.__file__, smp.__file__],
+                                   config['toolchains'])
+    config['outputs'] = outputs.Outputs(GENERATOR, inputs, incremental, check)
 
-    config['targets'] = []
-    for target in data['targets']:
-        plat, arch = target.split('/')
-        config['targets'].append({
-            'plat': plat,
-            'arch': arch})
 
-    get_compilers(config)
+def generate(config):
+    """Run all generate stages for a loaded configuration.
+
+    Return the list of changes to generated files (only tracked in
+    incremental mode).
+    """
+
+    if config['outputs'].up_to_date():
+        return []
 
     generate_setup(config)
     generate_defconfig(config)
     generate_build(config)
     generate_run(config)
 
+    return config['outputs'].finish()
+
+
+def find_apps(root):
+    """Find application directories in the catalog.
+
+    An application directory is one holding a Kraftfile. Generated and
+    downloaded contents are not searched.
+    """
+
+    for topdir in CATALOG_DIRS:
+        for path, dirs, filenames in os.walk(os.path.join(root, topdir)):
+            if KRAFTCONFIG in filenames:
+                # Applications are not nested, stop descending.
+                dirs.clear()
+                yield path
+                continue
+            dirs[:] = sorted(d for d in dirs if not d.startswith(".") and d not in CATALOG_SKIP_DIRS)
+
+
+def generate_app(appdir, index, incremental=False, check=False):
+    """Generate scripts for the application in the given directory.
+
+    Meant to run in a worker process. Return a tuple of the application
+    directory, the status (`ok`, `unchanged`, `drift`, `skipped` or
+    `error`), the time spent and a message.
+    """
+
+    start = time.monotonic()
+    cwd = os.getcwd()
+    status = "ok"
+    message = ""
+    try:
+        os.chdir(appdir)
+        if not os.path.isfile(CONFIG):
+            status = "skipped"
+            message = f"no '{CONFIG}'"
+        else:
+            config = load_config(check)
+            config['toolchains'] = index
+            setup_outputs(config, incremental, check)
+            changes = generate(config)
+            if check and changes:
+                status = "drift"
+                message = ", ".join(f"{action} {path}" for action, path in changes)
+            elif (incremental or check) and not changes:
+                status = "unchanged"
+            elif incremental:
+                message = f"{len(changes)} files changed"
+    except NotApplicableError as exc:
+        status = "skipped"
+        message = str(exc)
+    except ConfigError as exc:
+        status = "error"
+        message = str(exc)
+    except Exception as exc:  # pylint: disable=broad-except
+        status = "error"
+        message = f"{type(exc).__name__}: {exc}"
+    finally:
+        os.chdir(cwd)
+
+    return appdir, status, time.monotonic() - start, message
+
+
+def generate_apps(appdirs, jobs, incremental=False, check=False):
+    """Generate scripts for multiple applications in a process pool.
+
+    Toolchains are discovered once and shared by all applications. Print a
+    per-application summary and return the number of failures (and of
+    drifted applications, in check mode).
+    """
+
+    start = time.monotonic()
+    index = toolchains.discover()
+
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(generate_app, appdir, index, incremental, check) for appdir in appdirs]
+        for future in concurrent.futures.as_completed(futures):
+            results.append(future.result())
+
+    failed = 0
+    width = max(len(os.path.relpath(r[0])) for r in results)
+    for appdir, status, elapsed, message in sorted(results):
+        print(f"{os.path.relpath(appdir):<{width}}  {status:<9}  {elapsed:6.3f}s  {message}".rstrip())
+        if status in ("error", "drift"):
+            failed += 1
+
+    counts = {}
+    for result in results:
+        counts[result[1]] = counts.get(result[1], 0) + 1
+    summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+    print(f"{len(results)} applications ({summary}) in {time.monotonic() - start:.3f}s")
+
+    return failed
+
+
+def parse_args():
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(
+            description="Generate build and run scripts for Unikraft applications.")
+    parser.add_argument("appdirs", nargs="*", metavar="APPDIR",
+                        help="application directories (default: current directory)")
+    parser.add_argument("-a", "--all", action="store_true",
+                        help="generate for all applications in the catalog")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="number of parallel jobs (default: number of CPUs)")
+    parser.add_argument("-i", "--incremental", action="store_true",
+                        help="only rewrite changed files and remove stale ones")
+    parser.add_argument("--check", action="store_true",
+                        help="report out-of-date generated files, don't write anything")
+    return parser.parse_args()
+
+
+def main():
+    """The main program function calls generate functions."""
+
+    args = parse_args()
+
+    if args.all or args.appdirs:
+        appdirs = [os.path.abspath(d) for d in args.appdirs]
+        if args.all:
+            appdirs += find_apps(CATALOG_ROOT)
+        if not appdirs:
+            print("Error: No applications found", file=sys.stderr)
+            sys.exit(1)
+        if generate_apps(sorted(set(appdirs)), args.jobs, args.incremental, args.check):
+            sys.exit(1)
+        return
+
+    try:
+        config = load_config(args.check)
+    except ConfigError as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        sys.exit(1)
+
+    config['toolchains'] = toolchains.discover()
+    setup_outputs(config, args.incremental, args.check)
+
+    changes = generate(config)
+    if args.check:
+        for action, path in changes:
+            print(f"{action}: {path}")
+        if changes:
+            sys.exit(1)
+
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -10,8 +10,10 @@ Use QEMU, Firecracker and Krafkit for running.
 
 import sys
 import os
-import stat
+import argparse
 import yaml
+import outputs
+import smp
 
 
 TEMPLATE_RUN_QEMU_HEADER = """#!/bin/sh
@@ -24,31 +26,102 @@ if test $# -eq 1; then
 fi
 """
 
-RUN_COMMON_NET_COMMANDS = """
-# Remove previously created network interfaces.
-sudo ip link set dev tap0 down 2> /dev/null
-sudo ip link del dev tap0 2> /dev/null
-sudo ip link set dev virbr0 down 2> /dev/null
-sudo ip link del dev virbr0 2> /dev/null
+# Each run leases an instance, with its own network interfaces, guest
+# addresses and Firecracker files, released on exit (see instance.py).
+TEMPLATE_RUN_INSTANCE_COMMANDS = """
+# Allocate the network, API socket and log of this instance.
+instance_tool={}
+lease=$("$instance_tool" allocate --pid $$ --name "$(basename "$0")") || exit 1
+eval "$lease"
+cleanup() {{
+{}    "$instance_tool" release "$instance"
+}}
+trap cleanup EXIT
+trap 'exit 1' INT TERM HUP
+echo "Instance $instance: $ip" 1>&2
 """
 
 RUN_QEMU_NET_COMMANDS = """
 # Create bridge interface for QEMU networking.
-sudo ip link add dev virbr0 type bridge
-sudo ip address add 172.44.0.1/24 dev virbr0
-sudo ip link set dev virbr0 up
+sudo ip link del dev "$bridge" 2> /dev/null
+sudo ip link add dev "$bridge" type bridge
+sudo ip address add "$gateway"/24 dev "$bridge"
+sudo ip link set dev "$bridge" up
+"""
+
+RUN_QEMU_NET_CLEANUP = """    sudo ip link del dev "$bridge" 2> /dev/null
+"""
+
+# The `performance` QEMU profile (`qemu_profile` in config.yaml) uses the
+# features available on the host running the script, and the flags of
+# the default profile otherwise.
+QEMU_PROFILES = ["default", "performance"]
+
+TEMPLATE_RUN_QEMU_PERFORMANCE_MACHINE = """
+# Use the {machine_type} machine, if supported.
+machine=""
+if {qemu} -machine help | grep -q "^{machine_type} "; then
+    machine="-machine {machine}"
+fi
+"""
+
+TEMPLATE_RUN_QEMU_PERFORMANCE_CPU = """
+# Use the host CPU model with KVM.
+cpu="max"
+if test -e /dev/kvm; then
+    cpu="host"
+fi
+"""
+
+TEMPLATE_RUN_QEMU_PERFORMANCE_MEMORY = """
+# Back the guest memory with preallocated huge pages, if enough are free.
+memory=""
+hugepages="{hugepages}"
+free=$(awk '/^HugePages_Free/ {{ n = $2 }} /^Hugepagesize/ {{ s = $2 }} END {{ print int(n * s / 1024) }}' /proc/meminfo)
+if grep -qs " $hugepages hugetlbfs " /proc/mounts && test "$free" -ge {memory}; then
+    memory="-mem-path $hugepages -mem-prealloc"
+else
+    echo "Huge pages not available in $hugepages, using regular memory" 1>&2
+fi
+"""
+
+# vhost-net requires a tap interface: the bridge helper doesn't set up
+# vhost or multiple queues.
+TEMPLATE_RUN_QEMU_PERFORMANCE_NET = """
+# Use vhost-net with a queue pair per vCPU, if available.
+net="-netdev bridge,id=en0,br=$bridge -device virtio-net-pci,netdev=en0,mac=$mac"
+if test -c /dev/vhost-net; then
+    sudo ip link del dev "$tap" 2> /dev/null
+    sudo ip tuntap add dev "$tap" mode tap{multi_queue}
+    sudo ip link set dev "$tap" master "$bridge" up
+    net="-netdev tap,id=en0,ifname=$tap,script=no,downscript=no,vhost=on{queues}"
+    net="$net -device virtio-net-pci,netdev=en0,mac=$mac{mq}"
+else
+    echo "vhost-net not available, using the bridge helper" 1>&2
+fi
+"""
+
+RUN_QEMU_PERFORMANCE_NET_CLEANUP = """    sudo ip link del dev "$tap" 2> /dev/null
 """
 
 RUN_FIRECRACKER_NET_COMMANDS = """
 # Create tap interface for Firecracker networking.
-sudo ip tuntap add dev tap0 mode tap
-sudo ip address add 172.44.0.1/24 dev tap0
-sudo ip link set dev tap0 up
+sudo ip link del dev "$tap" 2> /dev/null
+sudo ip tuntap add dev "$tap" mode tap
+sudo ip address add "$gateway"/24 dev "$tap"
+sudo ip link set dev "$tap" up
+"""
+
+RUN_FIRECRACKER_NET_CLEANUP = """    sudo ip link del dev "$tap" 2> /dev/null
 """
 
 RUN_KRAFT_NET_COMMANDS = """
 # Create bridge interface for KraftKit networking.
-sudo kraft net create -n 172.44.0.1/24 virbr0
+sudo kraft net rm "$bridge" 2> /dev/null
+sudo kraft net create -n "$gateway"/24 "$bridge"
+"""
+
+RUN_KRAFT_NET_CLEANUP = """    sudo kraft net rm "$bridge" 2> /dev/null
 """
 
 TEMPLATE_RUN_FIRECRACKER_HEADER = """#!/bin/sh
@@ -61,30 +134,122 @@ fi
 """
 
 RUN_FIRECRACKER_PRE_TRAILER = """
-# Remove previously created files.
-sudo rm -f /tmp/firecracker.log
-touch /tmp/firecracker.log
-sudo rm -f /tmp/firecracker.socket
+# Use the network and log of this instance.
+"$instance_tool" firecracker-config --instance "$instance" "$config" > "$instance_dir/config.json" || exit 1
+touch "$log"
 """
 
 RUN_FIRECRACKER_COMMAND = """firecracker-x86_64 \\
-        --api-sock /tmp/firecracker.socket \\
-        --config-file "$config"
+        --api-sock "$socket" \\
+        --config-file "$instance_dir/config.json"
 """
 
-RUN_KRAFT_HEADER = """#!/bin/sh
+# Logger and metrics of Firecracker configurations (`fc_profile` in
+# config.yaml). Production runs only log warnings and send metrics to a
+# FIFO read by fc-metrics.py; paths are set per instance (instance.py).
+FC_PROFILES = {
+    "debug": """  "logger": {
+    "log_path": "/tmp/firecracker.log",
+    "level": "Debug",
+    "show_level": true,
+    "show_log_origin": true
+  },
+  "metrics": null,
+""",
+    "production": """  "logger": {
+    "log_path": "/tmp/firecracker.log",
+    "level": "Warning",
+    "show_level": false,
+    "show_log_origin": false
+  },
+  "metrics": {
+    "metrics_path": "/tmp/firecracker.metrics"
+  },
+""",
+    }
+
+TEMPLATE_RUN_FIRECRACKER_METRICS_COMMANDS = """
+# Collect the metrics of this run, summarized on exit (see fc-metrics.py).
+mkdir -p {metrics_dir}
+{tool} "$metrics" --output "{metrics_dir}/$(basename "$0" .sh)-$(date +%Y%m%d-%H%M%S).json" &
+metrics_pid=$!
+while test ! -p "$metrics"; do
+    kill -0 $metrics_pid 2> /dev/null || exit 1
+    sleep 0.01
+done
 """
 
-RUN_KILL_COMMANDS = """
-# Clean up any previous instances.
-sudo pkill -f qemu-system 2> /dev/null
-sudo pkill -f firecracker 2> /dev/null
-sudo kraft stop --all 2> /dev/null
-sudo kraft rm --all 2> /dev/null
+RUN_FIRECRACKER_METRICS_CLEANUP = """    if test -n "$metrics_pid"; then
+        kill $metrics_pid 2> /dev/null
+        wait $metrics_pid
+    fi
+"""
+
+# Snapshots are created from a regular boot once the application is
+# ready, and restored in a Firecracker process started without a
+# configuration (see fc-snapshot.py).
+TEMPLATE_RUN_FIRECRACKER_SNAPSHOT_COMMANDS = """
+# Boot the application and snapshot it once ready.
+snapshot="{snapshot}"
+mkdir -p "$(dirname "$snapshot")"
+{sudo}{taskset}firecracker-x86_64 \\
+        --api-sock "$socket" \\
+        --config-file "$instance_dir/config.json" > "$snapshot.console" 2>&1 &
+fc_pid=$!
+trap '{sudo}kill $fc_pid 2> /dev/null; exit 1' INT TERM HUP
+{sudo}{tool} create --socket "$socket" --ready "{ready}" --console "$snapshot.console" \\
+        --snapshot "$snapshot.snap" --mem "$snapshot.mem"
+status=$?
+{sudo}kill $fc_pid 2> /dev/null
+wait $fc_pid
+# The restored guest keeps the network configuration of this instance.
+echo "snapshot_tap=$tap snapshot_ip=$ip snapshot_gateway=$gateway" > "$snapshot.env"
+exit $status
+"""
+
+# Restored guests keep the address they had when snapshotted, their
+# interface is attached to the tap interface of the new instance.
+RUN_FIRECRACKER_RESTORE_NETWORK = """
+# Use the network configuration of the snapshot.
+. "$snapshot.env" || exit 1
+ip="$snapshot_ip"
+gateway="$snapshot_gateway"
+"$instance_tool" update "$instance" --ip "$ip"
+if test "$tap" != "$snapshot_tap"; then
+    overrides="--network-override net1=$tap"
+fi
+"""
+
+TEMPLATE_RUN_FIRECRACKER_RESTORE_HEADER = """#!/bin/sh
+
+snapshot="{}"
+
+if test $# -eq 1; then
+    snapshot="$1"
+fi
+"""
+
+TEMPLATE_RUN_FIRECRACKER_RESTORE_COMMANDS = """
+# Restore the application from the snapshot.
+{sudo}{taskset}firecracker-x86_64 \\
+        --api-sock "$socket" &
+fc_pid=$!
+trap '{sudo}kill $fc_pid 2> /dev/null; exit 1' INT TERM HUP
+if ! {sudo}{tool} load --socket "$socket" $overrides \\
+        --snapshot "$snapshot.snap" --mem "$snapshot.mem"; then
+    {sudo}kill $fc_pid 2> /dev/null
+fi
+wait $fc_pid
+"""
+
+RUN_KRAFT_HEADER = """#!/bin/sh
 """
 
 CONFIG = "config.yaml"
+SNAPSHOT_DIR = "snapshot"
+METRICS_DIR = "metrics"
 KRAFTCONFIG = "Kraftfile"
+GENERATOR = "generate"
 
 
 def files(path):
@@ -98,14 +263,43 @@ def files(path):
             yield file
 
 
+def tool(name):
+    """Return the path of a tool in this directory, relative to the application."""
+
+    return os.path.relpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), name))
+
+
+def instance_commands(config, net_cleanup, cleanup=""):
+    """Return the commands leasing an instance and releasing it on exit."""
+
+    if config["networking"]:
+        cleanup += net_cleanup
+    return TEMPLATE_RUN_INSTANCE_COMMANDS.format(tool("instance.py"), cleanup)
+
+
+def fc_metrics(config):
+    """Return the commands collecting Firecracker metrics and stopping the collector.
+
+    Both are empty unless the profile sends metrics to a FIFO.
+    """
+
+    if config["fc_profile"] != "production":
+        return "", ""
+    commands = TEMPLATE_RUN_FIRECRACKER_METRICS_COMMANDS.format(
+            metrics_dir=config["fc_metrics_dir"], tool=tool("fc-metrics.py"))
+    return commands, RUN_FIRECRACKER_METRICS_CLEANUP
+
+
 def generate_run_fc_json(config, kernel):
     """Generate running config (JSON) for Firecracker."""
 
     kernel_path = os.path.join(config["kerneldir"], kernel)
     suffix = kernel.replace("base_", "")
 
+    vcpus, smt = smp.fc_machine(config["smp"])
+
     json_name = os.path.join(config["rundir"], f"{suffix}.json")
-    with open(json_name, "w", encoding="utf8") as stream:
+    with config["outputs"].open(json_name) as stream:
         stream.write("{\n")
         stream.write('  "boot-source": {\n')
         stream.write(f'    "kernel_image_path": "{kernel_path}",\n')
@@ -114,14 +308,14 @@ def generate_run_fc_json(config, kernel):
             stream.write("netdev.ip=172.44.0.2/24:172.44.0.1 ")
         stream.write('vfs.fstab=[ \\"initrd:/:initrd:::\\" ] ')
         stream.write(f"-- {config['cmd']}\"")
-        stream.write(',\n    "initrd_path": "rootfs.cpio"')
+        stream.write(f',\n    "initrd_path": "{config["initrd"]}"')
         stream.write("\n  },\n")
         stream.write(
             f"""  "drives": [],
   "machine-config": {{
-    "vcpu_count": 1,
+    "vcpu_count": {vcpus},
     "mem_size_mib": {config['memory']},
-    "smt": false,
+    "smt": {str(smt).lower()},
     "track_dirty_pages": false
   }},
   "cpu-config": null,
@@ -141,14 +335,11 @@ def generate_run_fc_json(config, kernel):
             )
         stream.write(
             """  "vsock": null,
-  "logger": {
-    "log_path": "/tmp/firecracker.log",
-    "level": "Debug",
-    "show_level": true,
-    "show_log_origin": true
-  },
-  "metrics": null,
-  "mmds-config": null,
+"""
+        )
+        stream.write(FC_PROFILES[config["fc_profile"]])
+        stream.write(
+            """  "mmds-config": null,
   "entropy": null
 }
 """
@@ -158,20 +349,77 @@ def generate_run_fc_json(config, kernel):
 def generate_run_fc(config):
     """Generate running script using Firecracker."""
     header = TEMPLATE_RUN_FIRECRACKER_HEADER.format(f"fc-{config['arch']}.json")
+    metrics_commands, metrics_cleanup = fc_metrics(config)
 
     out_file = os.path.join(config["rundir"], f"run-fc-{config['arch']}.sh")
-    with open(out_file, "w", encoding="utf8") as stream:
+    with config["outputs"].open(out_file, executable=True) as stream:
         stream.write(header)
-        stream.write(RUN_KILL_COMMANDS)
+        stream.write(instance_commands(config, RUN_FIRECRACKER_NET_CLEANUP, metrics_cleanup))
         if config["networking"]:
-            stream.write(RUN_COMMON_NET_COMMANDS)
             stream.write(RUN_FIRECRACKER_NET_COMMANDS)
         stream.write(RUN_FIRECRACKER_PRE_TRAILER)
+        stream.write(metrics_commands)
         if config["networking"]:
             stream.write("sudo ")
+        stream.write(smp.taskset(config["smp"]))
         stream.write(RUN_FIRECRACKER_COMMAND)
-        stbuf = os.stat(out_file)
-        os.chmod(out_file, stbuf.st_mode | stat.S_IEXEC)
+
+
+def generate_run_fc_snapshot(config):
+    """Generate scripts snapshotting and restoring the application using Firecracker."""
+
+    name = f"fc-{config['arch']}"
+    commands = {
+        "sudo": "sudo " if config["networking"] else "",
+        "taskset": smp.taskset(config["smp"]),
+        "tool": tool("fc-snapshot.py"),
+        "ready": config["snapshot_ready"],
+        "snapshot": os.path.join(SNAPSHOT_DIR, name),
+        }
+    metrics_commands, metrics_cleanup = fc_metrics(config)
+
+    out_file = os.path.join(config["rundir"], f"run-{name}-snapshot.sh")
+    with config["outputs"].open(out_file, executable=True) as stream:
+        stream.write(TEMPLATE_RUN_FIRECRACKER_HEADER.format(f"{name}.json"))
+        stream.write(instance_commands(config, RUN_FIRECRACKER_NET_CLEANUP, metrics_cleanup))
+        if config["networking"]:
+            stream.write(RUN_FIRECRACKER_NET_COMMANDS)
+        stream.write(RUN_FIRECRACKER_PRE_TRAILER)
+        stream.write(metrics_commands)
+        stream.write(TEMPLATE_RUN_FIRECRACKER_SNAPSHOT_COMMANDS.format(**commands))
+
+    out_file = os.path.join(config["rundir"], f"run-{name}-restore.sh")
+    with config["outputs"].open(out_file, executable=True) as stream:
+        stream.write(TEMPLATE_RUN_FIRECRACKER_RESTORE_HEADER.format(commands["snapshot"]))
+        stream.write(instance_commands(config, RUN_FIRECRACKER_NET_CLEANUP))
+        if config["networking"]:
+            stream.write(RUN_FIRECRACKER_RESTORE_NETWORK)
+            stream.write(RUN_FIRECRACKER_NET_COMMANDS)
+        stream.write(TEMPLATE_RUN_FIRECRACKER_RESTORE_COMMANDS.format(**commands))
+
+
+def qemu_performance_commands(config, qemu):
+    """Return the commands selecting the flags of the performance profile."""
+
+    commands = ""
+    if config["qemu_machine"]:
+        commands += TEMPLATE_RUN_QEMU_PERFORMANCE_MACHINE.format(
+                qemu=qemu, machine=config["qemu_machine"],
+                machine_type=config["qemu_machine"].split(",")[0])
+    if config.get("accel"):
+        commands += TEMPLATE_RUN_QEMU_PERFORMANCE_CPU
+    if config["qemu_hugepages"]:
+        commands += TEMPLATE_RUN_QEMU_PERFORMANCE_MEMORY.format(
+                hugepages=config["qemu_hugepages"], memory=config["memory"])
+    if config["networking"]:
+        queues = config["smp"]["vcpus"]
+        multi_queue = {"multi_queue": "", "queues": "", "mq": ""}
+        if queues > 1:
+            # A vector per queue of each pair, plus configuration and control.
+            multi_queue = {"multi_queue": " multi_queue", "queues": f",queues={queues}",
+                           "mq": f",mq=on,vectors={2 * queues + 2}"}
+        commands += TEMPLATE_RUN_QEMU_PERFORMANCE_NET.format(**multi_queue)
+    return commands
 
 
 def generate_run_qemu(config, kernel):
@@ -180,59 +428,78 @@ def generate_run_qemu(config, kernel):
     kernel_path = os.path.join(config["kerneldir"], kernel)
     suffix = kernel.replace("base_", "")
     header = TEMPLATE_RUN_QEMU_HEADER.format(kernel_path, config["cmd"])
+    qemu = "qemu-system-x86_64" if config["arch"] == "x86_64" else "qemu-system-aarch64"
+    performance = config["qemu_profile"] == "performance"
+
+    net_cleanup = RUN_QEMU_NET_CLEANUP
+    if performance:
+        net_cleanup = RUN_QEMU_PERFORMANCE_NET_CLEANUP + net_cleanup
 
     out_file = os.path.join(config["rundir"], f"run-{suffix}.sh")
-    with open(out_file, "w", encoding="utf8") as stream:
+    with config["outputs"].open(out_file, executable=True) as stream:
         stream.write(header)
-        stream.write(RUN_KILL_COMMANDS)
+        stream.write(instance_commands(config, net_cleanup))
         if config["networking"]:
-            stream.write(RUN_COMMON_NET_COMMANDS)
             stream.write(RUN_QEMU_NET_COMMANDS)
+        if performance:
+            stream.write(qemu_performance_commands(config, qemu))
         stream.write("\n")
         if config["networking"]:
             stream.write("sudo ")
+        stream.write(smp.taskset(config["smp"]))
+        stream.write(f"{qemu} \\\n")
         if config["arch"] == "x86_64":
-            stream.write("qemu-system-x86_64 \\\n")
             if "accel" in config.keys():
                 if config["accel"]:
                     stream.write("    -accel kvm \\\n")
         else:
-            stream.write("qemu-system-aarch64 \\\n")
             stream.write("    -machine virt \\\n")
+        if performance and config["qemu_machine"]:
+            stream.write("    $machine \\\n")
         stream.write('    -kernel "$kernel" \\\n')
         stream.write("    -nographic \\\n")
         stream.write(f"    -m {config['memory']}M \\\n")
+        if performance and config["qemu_hugepages"]:
+            stream.write("    $memory \\\n")
+        if config["smp"]["vcpus"] > 1:
+            stream.write(f"    -smp {smp.qemu_args(config['smp'])} \\\n")
         if config["networking"]:
-            stream.write("    -netdev bridge,id=en0,br=virbr0 ")
-            stream.write("-device virtio-net-pci,netdev=en0 \\\n")
-            stream.write('    -append "netdev.ip=172.44.0.2/24:172.44.0.1 ')
+            if performance:
+                stream.write("    $net \\\n")
+            else:
+                stream.write('    -netdev bridge,id=en0,br="$bridge" ')
+                stream.write('-device virtio-net-pci,netdev=en0,mac="$mac" \\\n')
+            stream.write('    -append "netdev.ip=$ip/24:$gateway ')
             stream.write('vfs.fstab=[ \\"initrd:/:initrd:::\\" ] ')
             stream.write('-- $cmd" \\\n')
         else:
             stream.write('    -append "')
             stream.write('vfs.fstab=[ \\"initrd:/:initrd:::\\" ] ')
             stream.write('-- $cmd" \\\n')
-        stream.write('    -initrd "$PWD"/rootfs.cpio \\\n')
-        stream.write("    -cpu max\n")
-        stbuf = os.stat(out_file)
-        os.chmod(out_file, stbuf.st_mode | stat.S_IEXEC)
+        stream.write(f'    -initrd "$PWD"/{config["initrd"]} \\\n')
+        if performance and config.get("accel"):
+            stream.write("    -cpu $cpu\n")
+        else:
+            stream.write("    -cpu max\n")
 
 
 def generate_run_kraft(config, plat):
     """Generate running script using KraftKit."""
 
     out_file = os.path.join(config["rundir"], f"kraft-run-{plat}.sh")
-    with open(out_file, "w", encoding="utf8") as stream:
+    with config["outputs"].open(out_file, executable=True) as stream:
         stream.write(RUN_KRAFT_HEADER)
-        stream.write(RUN_KILL_COMMANDS)
+        sudo = "sudo " if config["networking"] else ""
+        stream.write(instance_commands(
+            config, RUN_KRAFT_NET_CLEANUP,
+            f'    {sudo}kraft rm "{config["name"]}-$instance" 2> /dev/null\n'))
         if config["networking"]:
-            stream.write(RUN_COMMON_NET_COMMANDS)
             stream.write(RUN_KRAFT_NET_COMMANDS)
-        stream.write("\n")
+        stream.write(f'\n{sudo}kraft rm "{config["name"]}-$instance" 2> /dev/null\n')
         if config["networking"]:
             stream.write("sudo ")
         stream.write(
-            "KRAFTKIT_BUILDKIT_HOST=docker-container://buildkitd kraft run \\\n"
+            f"KRAFTKIT_BUILDKIT_HOST=docker-container://buildkitd {smp.taskset(config['smp'])}kraft run \\\n"
         )
         if "accel" not in config.keys():
             stream.write("    -W \\\n")
@@ -241,14 +508,12 @@ def generate_run_kraft(config, plat):
         if config["arch"]:
             stream.write("    -W \\\n")
         stream.write(f"    --memory {config['memory']}M \\\n")
+        stream.write(f'    --name "{config["name"]}-$instance" \\\n')
         stream.write("    --log-level debug --log-type basic \\\n")
         if config["networking"]:
-            stream.write("    --network bridge:virbr0 \\\n")
+            stream.write('    --network bridge:"$bridge" \\\n')
         stream.write(f"    --arch {config['arch']} --plat {plat}\n")
 
-        stbuf = os.stat(out_file)
-        os.chmod(out_file, stbuf.st_mode | stat.S_IEXEC)
-
 
 def generate_run(config):
     """Generate running scripts."""
@@ -257,13 +522,28 @@ def generate_run(config):
     generate_run_fc_json(config, "base_fc-x86_64-strace")
     generate_run_fc_json(config, "base_fc-x86_64-debug")
     generate_run_fc(config)
+    generate_run_fc_snapshot(config)
     generate_run_qemu(config, "base_qemu-x86_64")
     generate_run_kraft(config, "qemu")
 
 
+def parse_args():
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(
+            description="Generate run scripts for Unikraft bincompat applications.")
+    parser.add_argument("-i", "--incremental", action="store_true",
+                        help="only rewrite changed files and remove stale ones")
+    parser.add_argument("--check", action="store_true",
+                        help="report out-of-date generated files, don't write anything")
+    return parser.parse_args()
+
+
 def main():
     """The main program function calls generate functions."""
 
+    args = parse_args()
+
     # Obtain configurations for running applications.
     try:
         with open(CONFIG, "r", encoding="utf8") as stream:
@@ -274,6 +554,8 @@ def main():
 
     if not "rootfs" in config.keys():
         config["rootfs"] = "rootfs"
+    if not "initrd" in config.keys():
+        config["initrd"] = "rootfs.cpio"
     if not "rundir" in config.keys():
         config["rundir"] = "."
     if not "kerneldir" in config.keys():
@@ -293,9 +575,44 @@ def main():
     except IOError:
         print(f"Error: Unable to access running directory '{config['rundir']}'", file=sys.stderr)
 
+    # Firecracker logger and metrics, see FC_PROFILES.
+    if not "fc_profile" in config.keys():
+        config["fc_profile"] = "debug"
+    if config["fc_profile"] not in FC_PROFILES:
+        print(f"Error: Unknown 'fc_profile' '{config['fc_profile']}' in '{CONFIG}'", file=sys.stderr)
+        sys.exit(1)
+    if not "fc_metrics_dir" in config.keys():
+        config["fc_metrics_dir"] = METRICS_DIR
+
+    # Readiness of the application before snapshotting, see fc-snapshot.py.
+    if not "snapshot_ready" in config.keys():
+        if config["networking"]:
+            config["snapshot_ready"] = "tcp:$ip:8080"
+        else:
+            config["snapshot_ready"] = "delay:1"
+
     # Currently only x86_64 is supported.
     config["arch"] = "x86_64"
 
+    # QEMU flags, see QEMU_PROFILES.
+    if not "qemu_profile" in config.keys():
+        config["qemu_profile"] = "default"
+    if config["qemu_profile"] not in QEMU_PROFILES:
+        print(f"Error: Unknown 'qemu_profile' '{config['qemu_profile']}' in '{CONFIG}'", file=sys.stderr)
+        sys.exit(1)
+    if not "qemu_machine" in config.keys():
+        # Kernels are only known to boot on the default machine.
+        config["qemu_machine"] = None
+    if not "qemu_hugepages" in config.keys():
+        config["qemu_hugepages"] = None
+
+    try:
+        config["smp"] = smp.parse(config)
+        smp.fc_machine(config["smp"])
+    except ValueError as exc:
+        print(f"Error: {exc} in '{CONFIG}'", file=sys.stderr)
+        sys.exit(1)
+
     # Obtain targets for KraftKit runs form kraft.yaml.
     try:
         with open(KRAFTCONFIG, "r", encoding="utf8") as stream:
@@ -314,8 +631,20 @@ def main():
         sys.exit(1)
     config["cmd"] = " ".join(c for c in data["cmd"])
 
+    inputs = outputs.inputs_digest([KRAFTCONFIG, CONFIG, __file__, outputs.__file__, smp.__file__])
+    config["outputs"] = outputs.Outputs(GENERATOR, inputs, args.incremental, args.check)
+    if config["outputs"].up_to_date():
+        return
+
     generate_run(config)
 
+    changes = config["outputs"].finish()
+    if args.check:
+        for action, path in changes:
+            print(f"{action}: {path}")
+        if changes:
+            sys.exit(1)
+
 
 if __name__ == "__main__":
     sys.exit(main())
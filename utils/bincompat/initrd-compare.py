@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2023, Unikraft GmbH and The Unikraft Authors.
+
+"""Compare initrd compression formats of an application.
+
+The initrd (`initrd.cpio` or `rootfs.cpio`) is compressed with each
+format supported by the generated run scripts (`initrd_compression` in
+`config.yaml`) and a table is printed with:
+  - the size of the initrd, read by the VMM and copied to guest memory
+  - the compression time, paid when running the run scripts
+  - the decompression time on the host, an estimate of the time spent
+    by the guest decompressing while extracting
+
+With `--run`, the application is also booted with each initrd and the
+time until the `--ready` console pattern is measured (median of
+`--runs` boots). The command is run by the shell, with `{initrd}`
+replaced by the path of the initrd, e.g.:
+
+    initrd-compare.py -i initrd.cpio --ready "Listening" \\
+        --run 'qemu-system-x86_64 -nographic -m 256M -kernel kernel -initrd {initrd} -append "..."'
+
+Formats are compressed at the default levels of the run scripts
+(gzip -1, lz4 -1, zstd -3); use `--level` for the level set with
+`initrd_compression_level`, e.g. `--level zstd=19`.
+
+Kernels must be built with the decompression support of each compared
+format (`initrd_compression_kconfig`).
+"""
+
+import sys
+import os
+import re
+import time
+import shutil
+import signal
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+
+# Same tools as the generated run scripts (the level is added to the
+# compression command).
+FORMATS = {
+    'none': (".cpio", None, None),
+    'gzip': (".cpio.gz", ["gzip", "-n", "-c"], ["gzip", "-d", "-c"]),
+    'lz4': (".cpio.lz4", ["lz4", "-l", "-q", "-c"], ["lz4", "-d", "-q", "-c"]),
+    'zstd': (".cpio.zst", ["zstd", "-q", "-c"], ["zstd", "-d", "-q", "-c"]),
+    }
+
+# Default levels of the run scripts, see INITRD_COMPRESSION in
+# generate.einitrd.py.
+LEVELS = {'gzip': 1, 'lz4': 1, 'zstd': 3}
+
+
+def timed(command, source, dest):
+    """Run command with the given input and output files; return the elapsed time."""
+
+    with open(source, "rb") as stdin, open(dest, "wb") as stdout:
+        start = time.perf_counter()
+        subprocess.run(command, stdin=stdin, stdout=stdout, check=True)
+        return time.perf_counter() - start
+
+
+def boot_time(command, ready, timeout):
+    """Boot the application; return the time until the ready pattern, or None."""
+
+    ready_re = re.compile(ready)
+    start = time.perf_counter()
+    elapsed = None
+    with subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          stdin=subprocess.DEVNULL, start_new_session=True) as vmm:
+        deadline = start + timeout
+        os.set_blocking(vmm.stdout.fileno(), False)
+        buffer = b""
+        while time.perf_counter() < deadline:
+            chunk = vmm.stdout.read()
+            if chunk:
+                buffer = buffer[-4096:] + chunk
+                if ready_re.search(buffer.decode("utf-8", "replace")):
+                    elapsed = time.perf_counter() - start
+                    break
+            elif vmm.poll() is not None:
+                break
+            else:
+                time.sleep(0.005)
+        if vmm.poll() is None:
+            os.killpg(vmm.pid, signal.SIGKILL)
+        vmm.wait()
+    return elapsed
+
+
+def compare(args, workdir):
+    """Compress the initrd in each format; return the table rows."""
+
+    rows = []
+    size_in = os.path.getsize(args.input)
+    for name in args.formats:
+        suffix, compress, decompress = FORMATS[name]
+        if compress and not shutil.which(compress[0]):
+            print(f"Warning: '{compress[0]}' not found, skipping {name}", file=sys.stderr)
+            continue
+
+        path = os.path.join(workdir, "initrd" + suffix)
+        row = {'format': name, 'size': size_in, 'compress': 0.0, 'decompress': 0.0, 'boot': None}
+        if compress:
+            level = args.levels[name]
+            row['format'] = f"{name} -{level}"
+            row['compress'] = timed(compress + [f"-{level}"], args.input, path)
+            row['size'] = os.path.getsize(path)
+            row['decompress'] = min(timed(decompress, path, os.devnull) for _ in range(args.runs))
+        else:
+            shutil.copyfile(args.input, path)
+
+        if args.run:
+            times = [boot_time(args.run.replace("{initrd}", path), args.ready, args.timeout)
+                     for _ in range(args.runs)]
+            times = [t for t in times if t is not None]
+            if len(times) < args.runs:
+                print(f"Warning: {name}: {args.runs - len(times)} boots not ready before timeout",
+                      file=sys.stderr)
+            row['boot'] = statistics.median(times) if times else None
+        rows.append(row)
+    return rows
+
+
+def print_table(rows, size_in):
+    """Print the comparison table."""
+
+    print(f"{'format':<8} {'size (MiB)':>11} {'ratio':>7} {'compress (s)':>13} "
+          f"{'decompress (s)':>15} {'boot (s)':>9}")
+    for row in rows:
+        boot = f"{row['boot']:9.3f}" if row['boot'] is not None else f"{'-':>9}"
+        print(f"{row['format']:<8} {row['size'] / (1 << 20):11.1f} {size_in / row['size']:7.2f} "
+              f"{row['compress']:13.2f} {row['decompress']:15.3f} {boot}")
+
+
+def parse_args():
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(description="Compare initrd compression formats.")
+    parser.add_argument("-i", "--input", default="initrd.cpio",
+                        help="uncompressed initrd (default: initrd.cpio)")
+    parser.add_argument("--formats", default=",".join(FORMATS),
+                        help=f"comma-separated formats to compare (default: {','.join(FORMATS)})")
+    parser.add_argument("--run", help="command booting the application, {initrd} is replaced "
+                                      "by the initrd path")
+    parser.add_argument("--ready", help="console regular expression telling the application is ready")
+    parser.add_argument("--runs", type=int, default=3,
+                        help="measurements per format (default: 3)")
+    parser.add_argument("--timeout", type=float, default=60,
+                        help="seconds to wait for readiness (default: 60)")
+    parser.add_argument("--level", action="append", default=[], metavar="FORMAT=LEVEL",
+                        help="compression level of a format, may be repeated (default: "
+                             f"{', '.join(f'{k}={v}' for k, v in LEVELS.items())})")
+    args = parser.parse_args()
+    args.levels = dict(LEVELS)
+    for spec in args.level:
+        name, _, level = spec.partition("=")
+        if name not in LEVELS or not level.isdigit():
+            parser.error(f"invalid level '{spec}'")
+        args.levels[name] = int(level)
+    args.formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    for name in args.formats:
+        if name not in FORMATS:
+            parser.error(f"unknown format '{name}'")
+    if args.run and not args.ready:
+        parser.error("--run requires --ready")
+    return args
+
+
+def main():
+    """The main program function."""
+
+    args = parse_args()
+    if not os.path.isfile(args.input):
+        print(f"Error: Unable to open initrd '{args.input}'", file=sys.stderr)
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory(prefix="initrd-compare-") as workdir:
+        try:
+            rows = compare(args, workdir)
+        except (subprocess.CalledProcessError, OSError) as exc:
+            print(f"Error: {exc}", file=sys.stderr)
+            sys.exit(1)
+    print_table(rows, os.path.getsize(args.input))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
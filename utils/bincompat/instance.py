@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2023, Unikraft GmbH and The Unikraft Authors.
+
+"""Allocate per-instance resources, to run many applications at once.
+
+Each run of a generated run script leases an instance, numbered from
+0, with its own:
+  - tap interface (`tap<N>`, Firecracker) or bridge (`virbr<N>`, QEMU
+    and KraftKit)
+  - network `172.44.<N>.0/24`, the host being `172.44.<N>.1` and the
+    guest `172.44.<N>.2`, with MAC address `06:00:ac:10:<N>:02`
+  - instance directory, holding the Firecracker API socket, log,
+    metrics and configuration
+
+Instance 0 uses the interfaces and addresses of single-instance runs.
+Leases are directories in `/tmp/unikraft-instances`, created atomically
+and owned by the process of the run script; leases of processes that
+are gone are reclaimed. Run scripts use:
+
+    lease=$(instance.py allocate --pid $$) && eval "$lease"
+    instance.py release "$instance"
+
+Use `instance.py list` to print the running instances and their
+addresses. Set `UK_INSTANCE` to use a given instance.
+"""
+
+import sys
+import os
+import re
+import json
+import time
+import shlex
+import shutil
+import argparse
+
+
+LEASES_DIR = "/tmp/unikraft-instances"
+LEASE_FILE = "lease.json"
+# Instance numbers are the third byte of the instance network.
+MAX_INSTANCES = 255
+# Time to write a lease after creating its directory.
+LEASE_GRACE = 10
+
+
+def resources(index, root=LEASES_DIR):
+    """Return the resources of an instance."""
+
+    directory = os.path.join(root, str(index))
+    return {
+        'instance': index,
+        'instance_dir': directory,
+        'tap': f"tap{index}",
+        'bridge': f"virbr{index}",
+        'ip': f"172.44.{index}.2",
+        'gateway': f"172.44.{index}.1",
+        'mac': f"06:00:ac:10:{index:02x}:02",
+        'socket': os.path.join(directory, "firecracker.socket"),
+        'log': os.path.join(directory, "firecracker.log"),
+        'metrics': os.path.join(directory, "firecracker.metrics"),
+        }
+
+
+def alive(pid):
+    """Return True if the process exists."""
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_lease(directory):
+    """Return the lease in an instance directory, or None if not written yet."""
+
+    try:
+        with open(os.path.join(directory, LEASE_FILE), "r", encoding="utf8") as stream:
+            return json.load(stream)
+    except (OSError, ValueError):
+        return None
+
+
+def write_lease(directory, lease):
+    """Write the lease of an instance directory atomically."""
+
+    path = os.path.join(directory, LEASE_FILE)
+    with open(path + ".tmp", "w", encoding="utf8") as stream:
+        json.dump(lease, stream, indent=2)
+    os.rename(path + ".tmp", path)
+
+
+def stale(directory):
+    """Return True if the owner of an instance directory is gone."""
+
+    lease = read_lease(directory)
+    if lease is None:
+        try:
+            return time.time() - os.stat(directory).st_mtime > LEASE_GRACE
+        except FileNotFoundError:
+            return False
+    return not alive(lease['pid'])
+
+
+def reclaim(directory):
+    """Remove a stale instance directory; return False if another process did."""
+
+    # Renaming is atomic: only one process reclaims a given lease.
+    trash = f"{directory}.stale-{os.getpid()}"
+    try:
+        os.rename(directory, trash)
+    except OSError:
+        return False
+    shutil.rmtree(trash, ignore_errors=True)
+    return True
+
+
+def try_allocate(index, pid, name, root):
+    """Lease an instance; return its resources, or None if it is in use."""
+
+    directory = os.path.join(root, str(index))
+    try:
+        os.mkdir(directory)
+    except FileExistsError:
+        if not stale(directory) or not reclaim(directory):
+            return None
+        try:
+            os.mkdir(directory)
+        except FileExistsError:
+            return None
+
+    lease = resources(index, root)
+    lease.update({'pid': pid, 'name': name, 'started': time.time()})
+    write_lease(directory, lease)
+    return lease
+
+
+def allocate(pid, name=None, index=None, root=LEASES_DIR):
+    """Lease the first free instance, or the given one; return its resources.
+
+    Raise RuntimeError if no instance is free.
+    """
+
+    if not os.path.isdir(root):
+        os.makedirs(root, exist_ok=True)
+        # Shared by all users, like /tmp.
+        try:
+            os.chmod(root, 0o1777)
+        except PermissionError:
+            pass
+
+    candidates = [index] if index is not None else range(MAX_INSTANCES)
+    for candidate in candidates:
+        lease = try_allocate(candidate, pid, name, root)
+        if lease:
+            return lease
+    if index is not None:
+        raise RuntimeError(f"Instance {index} is in use")
+    raise RuntimeError(f"All {MAX_INSTANCES} instances are in use")
+
+
+def update(index, ip, root=LEASES_DIR):
+    """Record the guest address of an instance, e.g. of a restored snapshot."""
+
+    directory = os.path.join(root, str(index))
+    lease = read_lease(directory)
+    if lease is None:
+        raise RuntimeError(f"Instance {index} is not allocated")
+    lease['ip'] = ip
+    write_lease(directory, lease)
+
+
+def release(index, root=LEASES_DIR):
+    """Release an instance."""
+
+    shutil.rmtree(os.path.join(root, str(index)), ignore_errors=True)
+
+
+def leases(root=LEASES_DIR):
+    """Return the leases of running instances."""
+
+    result = []
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return result
+    for name in sorted(names, key=lambda n: (len(n), n)):
+        if not name.isdigit():
+            continue
+        lease = read_lease(os.path.join(root, name))
+        if lease and alive(lease['pid']):
+            result.append(lease)
+    return result
+
+
+def descendants(pid):
+    """Return the given process ID and the IDs of its descendants."""
+
+    children = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", "r", encoding="utf8") as stream:
+                stat = stream.read()
+        except OSError:
+            continue
+        # The command name may contain spaces, fields follow the last parenthesis.
+        ppid = int(stat[stat.rindex(")") + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(name))
+
+    result = set()
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        result.add(current)
+        pending.extend(children.get(current, []))
+    return result
+
+
+def lookup(pid, root=LEASES_DIR):
+    """Return the lease of the run script with the given process ID, or None.
+
+    The run script may be started by a shell or `sudo`, the lease of a
+    descendant of the process is returned as well.
+    """
+
+    current = leases(root)
+    if not current:
+        return None
+    pids = descendants(pid)
+    for lease in current:
+        if lease['pid'] in pids:
+            return lease
+    return None
+
+
+def guest_address(pid, timeout=0, fallback=True):
+    """Return the guest address of the run script with the given process ID.
+
+    Wait up to timeout seconds for the script to lease an instance, and
+    return the address of instance 0 for scripts without a lease, or
+    None if fallback is False.
+    """
+
+    deadline = time.monotonic() + timeout
+    while True:
+        lease = lookup(pid)
+        if lease:
+            return lease['ip']
+        if time.monotonic() >= deadline:
+            return resources(0)['ip'] if fallback else None
+        time.sleep(0.05)
+
+
+def firecracker_config(path, lease):
+    """Return a Firecracker configuration using the resources of an instance."""
+
+    with open(path, "r", encoding="utf8") as stream:
+        config = json.load(stream)
+    boot = config['boot-source']
+    boot['boot_args'] = re.sub(r"netdev\.ip=\S+", f"netdev.ip={lease['ip']}/24:{lease['gateway']}",
+                               boot['boot_args'])
+    for iface in config.get('network-interfaces') or []:
+        iface['host_dev_name'] = lease['tap']
+        iface['guest_mac'] = lease['mac']
+    if config.get('logger'):
+        config['logger']['log_path'] = lease['log']
+    if config.get('metrics'):
+        config['metrics']['metrics_path'] = lease['metrics']
+    return json.dumps(config, indent=2) + "\n"
+
+
+def parse_args():
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(description="Allocate per-instance resources of run scripts.")
+    parser.add_argument("--dir", default=LEASES_DIR, help=f"leases directory (default: {LEASES_DIR})")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_allocate = subparsers.add_parser("allocate", help="lease an instance, print shell variables")
+    parser_allocate.add_argument("--pid", type=int, default=os.getppid(),
+                                 help="process owning the lease (default: parent process)")
+    parser_allocate.add_argument("--name", help="name of the run script")
+    parser_allocate.add_argument("--instance", type=int, help="lease this instance")
+
+    parser_release = subparsers.add_parser("release", help="release an instance")
+    parser_release.add_argument("instance", type=int)
+
+    parser_update = subparsers.add_parser("update", help="record the guest address of an instance")
+    parser_update.add_argument("instance", type=int)
+    parser_update.add_argument("--ip", required=True, help="guest address")
+
+    subparsers.add_parser("list", help="print running instances")
+
+    parser_fc = subparsers.add_parser("firecracker-config",
+                                      help="print a Firecracker configuration for an instance")
+    parser_fc.add_argument("--instance", type=int, required=True)
+    parser_fc.add_argument("config", help="Firecracker configuration (JSON)")
+    return parser.parse_args()
+
+
+def main():
+    """The main program function."""
+
+    args = parse_args()
+
+    if args.command == "allocate":
+        if args.instance is None and os.environ.get("UK_INSTANCE"):
+            args.instance = int(os.environ["UK_INSTANCE"])
+        try:
+            lease = allocate(args.pid, args.name, args.instance, args.dir)
+        except (RuntimeError, OSError) as exc:
+            print(f"Error: {exc}", file=sys.stderr)
+            sys.exit(1)
+        for key, value in resources(lease['instance'], args.dir).items():
+            print(f"{key}={shlex.quote(str(value))}")
+    elif args.command == "update":
+        try:
+            update(args.instance, args.ip, args.dir)
+        except (RuntimeError, OSError) as exc:
+            print(f"Error: {exc}", file=sys.stderr)
+            sys.exit(1)
+    elif args.command == "release":
+        release(args.instance, args.dir)
+    elif args.command == "list":
+        print(f"{'instance':>8} {'pid':>8} {'address':<15} {'name'}")
+        for lease in leases(args.dir):
+            print(f"{lease['instance']:>8} {lease['pid']:>8} {lease['ip']:<15} {lease['name'] or '-'}")
+    else:
+        try:
+            sys.stdout.write(firecracker_config(args.config, resources(args.instance, args.dir)))
+        except (OSError, ValueError, KeyError) as exc:
+            print(f"Error: Invalid Firecracker configuration '{args.config}': {exc}",
+                  file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,439 @@
+#!/usr/bin/env python
+
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2023, Unikraft GmbH and The Unikraft Authors.
+
+"""Content-addressed store for built kernel images.
+
+Kernel images are stored under a key computed from everything that
+determines the build output:
+  - the contents of the resolved Kraftfile (e.g. `Kraftfile.strace`,
+    after the strace / debug configuration is injected)
+  - the platform and the architecture
+  - the toolchain (compiler and KraftKit versions)
+  - the revisions (commits) of Unikraft, of the libraries and of the
+    template, resolved from the Kraftfile sources and versions
+  - the contents of the root filesystem of the Kraftfile (`rootfs`),
+    which is embedded in einitrd kernels: the Dockerfile and the files
+    of its build context, a directory tree or an archive
+
+A build script looks up the key first. If the image exists, it is
+materialized (hard linked or copied) to the output path and the build
+is skipped. Otherwise the script builds the kernel and stores it.
+
+Use `--stats` for hit rates and `--evict` to limit the store size or
+the age of stored images.
+"""
+
+import sys
+import os
+import re
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import argparse
+import tempfile
+import subprocess
+import yaml
+
+
+STORE_DIR = os.environ.get("UK_KSTORE_DIR", os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "unikraft", "kernels"))
+
+UNIKRAFT_SOURCE = "https://github.com/unikraft/unikraft.git"
+LIB_SOURCE = "https://github.com/unikraft/lib-{}.git"
+
+SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+# Build outputs in application directories, not part of a build context.
+CONTEXT_SKIP = {".git", ".unikraft", "workdir", "scripts", "rootfs", "rootfs.cpio", "initrd.cpio"}
+
+
+class KeyUnavailable(Exception):
+    """The store key cannot be computed."""
+
+
+def run(args):
+    """Run command and return its standard output, or None on failure."""
+
+    try:
+        result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                stdin=subprocess.DEVNULL, check=True, timeout=60)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.decode("utf-8", "replace").strip()
+
+
+def resolve_revision(source, version):
+    """Resolve a component version (branch, tag or commit) to a commit.
+
+    Return None if the revision cannot be resolved.
+    """
+
+    if version and re.fullmatch(r"[0-9a-f]{40}", version):
+        return version
+    output = run(["git", "ls-remote", source, version or "HEAD"])
+    if not output:
+        return None
+    # Prefer the peeled commit of annotated tags.
+    refs = dict(reversed(line.split("\t")) for line in output.splitlines() if "\t" in line)
+    for ref in (f"refs/tags/{version}^{{}}", f"refs/heads/{version}", f"refs/tags/{version}"):
+        if ref in refs:
+            return refs[ref]
+    return output.split()[0]
+
+
+def component(spec, source):
+    """Return (source, version) of a Kraftfile component."""
+
+    if isinstance(spec, dict):
+        return spec.get('source', source), spec.get('version')
+    return source, str(spec) if spec else None
+
+
+def revisions(kraftfile):
+    """Resolve the revisions of all components used by a Kraftfile."""
+
+    with open(kraftfile, "r", encoding="utf8") as stream:
+        data = yaml.safe_load(stream) or {}
+
+    components = {'unikraft': component(data.get('unikraft'), UNIKRAFT_SOURCE)}
+    for lib, spec in (data.get('libraries') or {}).items():
+        components[f"lib-{lib}"] = component(spec, LIB_SOURCE.format(lib))
+    if data.get('template'):
+        components['template'] = component(data['template'], None)
+    if data.get('runtime'):
+        raise KeyUnavailable(f"'{kraftfile}' uses a runtime, it doesn't build a kernel")
+
+    result = {}
+    for name, (source, version) in sorted(components.items()):
+        if not source:
+            continue
+        revision = resolve_revision(source, version)
+        if not revision:
+            raise KeyUnavailable(f"Unable to resolve {name} version '{version}' from '{source}'")
+        result[name] = revision
+    return result
+
+
+def context_files(directory):
+    """Return the files of a build context, relative to its directory.
+
+    In a git work tree, files ignored by git (build outputs) are left
+    out; otherwise, known build outputs are.
+    """
+
+    output = run(["git", "-C", directory, "ls-files", "-z", "--cached", "--others",
+                  "--exclude-standard", "--", "."])
+    if output is not None:
+        files = set(output.split("\0"))
+    else:
+        files = set()
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames[:] = [d for d in dirnames if d not in CONTEXT_SKIP]
+            relpath = os.path.relpath(dirpath, directory)
+            files.update(os.path.normpath(os.path.join(relpath, name)) for name in filenames)
+    return sorted(f for f in files
+                  if f and f.split(os.sep)[0] not in CONTEXT_SKIP
+                  and os.path.lexists(os.path.join(directory, f)))
+
+
+def tree_digest(directory, files):
+    """Return the digest of the given files (names, modes and contents) of a directory."""
+
+    digest = hashlib.sha256()
+    for name in files:
+        path = os.path.join(directory, name)
+        if os.path.islink(path):
+            content = os.readlink(path).encode("utf-8")
+        elif os.path.isfile(path):
+            with open(path, "rb") as stream:
+                content = hashlib.sha256(stream.read()).hexdigest().encode("utf-8")
+        else:
+            continue
+        digest.update(f"{name}\0{os.lstat(path).st_mode & 0o111:o}\0".encode("utf-8"))
+        digest.update(content + b"\0")
+    return digest.hexdigest()
+
+
+def rootfs_digest(kraftfile):
+    """Return the digest of the root filesystem of a Kraftfile, or None without one."""
+
+    with open(kraftfile, "r", encoding="utf8") as stream:
+        data = yaml.safe_load(stream) or {}
+    rootfs = data.get('rootfs')
+    if not rootfs:
+        return None
+
+    directory = os.path.dirname(os.path.abspath(kraftfile))
+    path = os.path.join(directory, rootfs)
+    if os.path.isdir(path):
+        return tree_digest(path, sorted(os.path.relpath(os.path.join(d, f), path)
+                                        for d, _, names in os.walk(path) for f in names))
+    if not os.path.isfile(path):
+        raise KeyUnavailable(f"Root filesystem '{rootfs}' of '{kraftfile}' not found")
+    if os.path.basename(path).startswith("Dockerfile"):
+        # Images are built with the Kraftfile directory as context.
+        return tree_digest(directory, context_files(directory))
+    with open(path, "rb") as stream:
+        return hashlib.sha256(stream.read()).hexdigest()
+
+
+def default_toolchain():
+    """Describe the toolchain used by KraftKit builds."""
+
+    return "; ".join(filter(None, [
+        f"gcc {run(['gcc', '-dumpfullversion']) or 'none'}",
+        run(["kraft", "version"]),
+        ]))
+
+
+def compute_key(args):
+    """Compute the store key of a build and its description."""
+
+    with open(args.kraftfile, "rb") as stream:
+        kraftfile = stream.read()
+    description = {
+        'kraftfile': hashlib.sha256(kraftfile).hexdigest(),
+        'plat': args.plat,
+        'arch': args.arch,
+        'toolchain': args.toolchain if args.toolchain is not None else default_toolchain(),
+        'revisions': revisions(args.kraftfile),
+        }
+    rootfs = rootfs_digest(args.kraftfile)
+    if rootfs:
+        description['rootfs'] = rootfs
+    if args.unikraft_rev:
+        description['revisions']['unikraft'] = args.unikraft_rev
+    key = hashlib.sha256(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()
+    return key, description
+
+
+class Store:
+    """Directory of kernel images named by their key."""
+
+    def __init__(self, path=STORE_DIR):
+        self.path = path
+        self.objects = os.path.join(path, "objects")
+        os.makedirs(self.objects, exist_ok=True)
+
+    def object_path(self, key):
+        """Return the path of the image with the given key."""
+
+        return os.path.join(self.objects, key[:2], key)
+
+    def locked(self):
+        """Return an open lock file; the lock is held until it is closed."""
+
+        stream = open(os.path.join(self.path, "lock"), "w", encoding="utf8")
+        fcntl.flock(stream, fcntl.LOCK_EX)
+        return stream
+
+    def count(self, event, amount=1):
+        """Increment a statistics counter."""
+
+        with self.locked():
+            stats = self.stats()
+            stats[event] = stats.get(event, 0) + amount
+            with open(os.path.join(self.path, "stats.json"), "w", encoding="utf8") as stream:
+                json.dump(stats, stream, indent=2)
+
+    def stats(self):
+        """Return the statistics counters."""
+
+        try:
+            with open(os.path.join(self.path, "stats.json"), "r", encoding="utf8") as stream:
+                return json.load(stream)
+        except (IOError, ValueError):
+            return {}
+
+    def lookup(self, key, dest):
+        """Materialize the image with the given key to `dest`.
+
+        Return True on hit, False on miss.
+        """
+
+        path = self.object_path(key)
+        if not os.path.isfile(path):
+            self.count("misses")
+            return False
+
+        tmp = f"{dest}.kstore-tmp"
+        try:
+            os.link(path, tmp)
+        except OSError:
+            shutil.copy2(path, tmp)
+        os.replace(tmp, dest)
+        # Record last use, for eviction.
+        os.utime(path)
+        self.count("hits")
+        return True
+
+    def store(self, key, image, description):
+        """Store an image under the given key."""
+
+        path = self.object_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as tmp:
+            with open(image, "rb") as stream:
+                shutil.copyfileobj(stream, tmp)
+        # Stored images are read-only, as materialized images are hard links.
+        os.chmod(tmp.name, os.stat(image).st_mode & 0o555)
+        os.replace(tmp.name, path)
+        with open(f"{path}.json", "w", encoding="utf8") as stream:
+            json.dump(dict(description, stored=time.time(), source=os.path.abspath(image)),
+                      stream, indent=2)
+        self.count("stores")
+
+    def entries(self):
+        """Return (path, size, last use) of all stored images."""
+
+        result = []
+        for directory in os.listdir(self.objects):
+            for name in os.listdir(os.path.join(self.objects, directory)):
+                if name.endswith(".json") or name.startswith("tmp"):
+                    continue
+                path = os.path.join(self.objects, directory, name)
+                sbuf = os.stat(path)
+                result.append((path, sbuf.st_size, sbuf.st_mtime))
+        return result
+
+    def evict(self, max_size=None, max_age=None):
+        """Remove images unused for `max_age` seconds, then least
+        recently used images until the store is at most `max_size` bytes.
+
+        Return the number of removed images.
+        """
+
+        with self.locked():
+            entries = sorted(self.entries(), key=lambda e: e[2])
+            now = time.time()
+            total = sum(e[1] for e in entries)
+            removed = 0
+            for path, size, used in entries:
+                too_old = max_age is not None and now - used > max_age
+                too_big = max_size is not None and total > max_size
+                if not too_old and not too_big:
+                    continue
+                os.remove(path)
+                if os.path.exists(f"{path}.json"):
+                    os.remove(f"{path}.json")
+                total -= size
+                removed += 1
+        if removed:
+            self.count("evictions", removed)
+        return removed
+
+
+def parse_size(value):
+    """Parse a size such as `500M` or `10G`."""
+
+    match = re.fullmatch(r"(\d+)([KMGT]?)i?B?", value.strip(), re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid size '{value}'")
+    return int(match.group(1)) * SIZE_UNITS[match.group(2).upper()]
+
+
+def parse_age(value):
+    """Parse an age such as `30d`, `12h` or `3600` (seconds)."""
+
+    match = re.fullmatch(r"(\d+)([smhd]?)", value.strip())
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid age '{value}'")
+    return int(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}[match.group(2)]
+
+
+def print_stats(store):
+    """Print store contents and hit rate."""
+
+    stats = store.stats()
+    entries = store.entries()
+    hits = stats.get("hits", 0)
+    misses = stats.get("misses", 0)
+    rate = 100 * hits / (hits + misses) if hits + misses else 0
+    print(f"store:     {store.path}")
+    print(f"images:    {len(entries)} ({sum(e[1] for e in entries) / (1 << 20):.1f} MiB)")
+    print(f"lookups:   {hits + misses} ({hits} hits, {misses} misses, {rate:.1f}% hit rate)")
+    print(f"stores:    {stats.get('stores', 0)}")
+    print(f"evictions: {stats.get('evictions', 0)}")
+
+
+def parse_args():
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(description="Content-addressed store for kernel images.")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--lookup", metavar="DEST",
+                        help="materialize the stored image to DEST, exit with 1 on miss")
+    action.add_argument("--store", metavar="IMAGE",
+                        help="store the built IMAGE")
+    action.add_argument("--key", action="store_true",
+                        help="print the key and its description")
+    action.add_argument("--evict", action="store_true",
+                        help="remove images according to --max-size and --max-age")
+    action.add_argument("--stats", action="store_true",
+                        help="print store statistics")
+    parser.add_argument("-K", "--kraftfile", default="Kraftfile",
+                        help="resolved Kraftfile used for the build (default: Kraftfile)")
+    parser.add_argument("--plat", help="platform of the build")
+    parser.add_argument("--arch", help="architecture of the build")
+    parser.add_argument("--toolchain",
+                        help="toolchain description (default: gcc and kraft versions)")
+    parser.add_argument("--unikraft-rev", help="Unikraft commit (default: resolved from Kraftfile)")
+    parser.add_argument("--max-size", type=parse_size, help="maximum store size (e.g. 10G)")
+    parser.add_argument("--max-age", type=parse_age, help="maximum age since last use (e.g. 30d)")
+    parser.add_argument("--store-dir", default=STORE_DIR,
+                        help=f"store directory (default: {STORE_DIR})")
+    args = parser.parse_args()
+
+    if (args.lookup or args.store or args.key) and not (args.plat and args.arch):
+        parser.error("--plat and --arch are required")
+    if args.evict and args.max_size is None and args.max_age is None:
+        parser.error("--evict requires --max-size or --max-age")
+    return args
+
+
+def main():
+    """The main program function."""
+
+    args = parse_args()
+    store = Store(args.store_dir)
+
+    if args.stats:
+        print_stats(store)
+        return 0
+    if args.evict:
+        print(f"Evicted {store.evict(args.max_size, args.max_age)} images")
+        return 0
+
+    try:
+        key, description = compute_key(args)
+    except (IOError, KeyUnavailable) as exc:
+        # Builds that can't be keyed are never served from the store.
+        print(f"kstore: {exc}", file=sys.stderr)
+        if args.lookup:
+            store.count("misses")
+        return 1
+
+    if args.key:
+        print(key)
+        json.dump(description, sys.stdout, indent=2)
+        print()
+        return 0
+
+    if args.lookup:
+        if store.lookup(key, args.lookup):
+            print(f"kstore: hit {key[:12]}, using stored image for '{args.lookup}'")
+            return 0
+        print(f"kstore: miss {key[:12]}")
+        return 1
+
+    store.store(key, args.store, description)
+    print(f"kstore: stored '{args.store}' as {key[:12]}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2023, Unikraft GmbH and The Unikraft Authors.
+
+"""Minimize the root filesystem of a bincompat application.
+
+The application is booted with a strace-enabled base kernel
+(`base_qemu-x86_64-strace` or `base_fc-x86_64-strace`) and a workload
+is run against it. File system calls (`open`, `openat`, `stat`,
+`execve` and related ones) are parsed from the console log, and a
+minimized initrd is created with:
+  - the files and directories touched, and the symbolic links used to
+    reach them
+  - the application executable (`cmd` in `Kraftfile`) and its ELF
+    interpreter, which are loaded by the ELF loader without system calls
+  - the files matching the allowlist (`--keep` patterns and the
+    `minimize.allow` file, one pattern per line)
+
+Run the script from the application directory, after generating the
+run scripts (`generate.py`) and building `rootfs.cpio`:
+
+    ../../utils/bincompat/minimize-rootfs.py --ready "Listening" \\
+        --workload 'curl -s "http://$UK_IP:8080/"'
+
+Use the minimized initrd by setting `initrd: rootfs.min.cpio` in
+`config.yaml` and regenerating the run scripts.
+"""
+
+import sys
+import os
+import re
+import time
+import fnmatch
+import signal
+import argparse
+import posixpath
+import threading
+import subprocess
+import yaml
+import tar2cpio
+import instance
+
+
+CONFIG = "config.yaml"
+KRAFTCONFIG = "Kraftfile"
+ALLOWLIST = "minimize.allow"
+
+# Always kept, e.g. for name resolution and dynamic linking.
+DEFAULT_KEEP = ["/etc/*"]
+
+SYSCALL_RE = re.compile(r"\b(?P<name>open|openat|openat2|creat|stat|lstat|fstatat|newfstatat|"
+                        r"statx|access|faccessat|faccessat2|execve|execveat|readlink|"
+                        r"readlinkat|chdir|mkdir|mkdirat)\((?P<args>.*)\)")
+STRING_RE = re.compile(r'"((?:[^"\\]|\\.)*)"')
+RELATIVE_RE = re.compile(r"^\s*(AT_FDCWD|-100)\s*,")
+
+MAX_SYMLINKS = 40
+
+
+def parse_log(lines):
+    """Return the absolute paths used by system calls in a strace log.
+
+    Paths relative to a directory file descriptor other than the
+    current directory can't be resolved and are ignored.
+    """
+
+    cwd = "/"
+    paths = set()
+    for line in lines:
+        match = SYSCALL_RE.search(line)
+        if not match:
+            continue
+        path = STRING_RE.search(match.group("args"))
+        if not path:
+            continue
+        path = path.group(1).replace('\\"', '"').replace("\\\\", "\\")
+        if not path.startswith("/"):
+            if match.group("name").endswith("at") or match.group("name") == "openat2":
+                if not RELATIVE_RE.match(match.group("args")):
+                    continue
+            path = posixpath.join(cwd, path)
+        path = posixpath.normpath(path)
+        if match.group("name") == "chdir":
+            cwd = path
+        paths.add(path)
+    return paths
+
+
+def resolve(path, entries):
+    """Return the archive paths needed to reach path in the image.
+
+    Symbolic links are followed, component by component, and kept
+    along with their targets.
+    """
+
+    needed = []
+    parts = [p for p in path.split("/") if p]
+    current = ""
+    hops = 0
+    while parts:
+        part = parts.pop(0)
+        if part == "..":
+            current = posixpath.dirname(current)
+            continue
+        candidate = posixpath.join(current, part) if current else part
+        entry = entries.get(candidate)
+        if entry is None:
+            return needed
+        needed.append(candidate)
+        if entry['kind'] == "symlink" and hops < MAX_SYMLINKS:
+            hops += 1
+            link = entry['link']
+            if link.startswith("/"):
+                current = ""
+            parts = [p for p in link.split("/") if p] + parts
+            continue
+        current = candidate
+    return needed
+
+
+def elf_interpreter(layer, entry):
+    """Return the interpreter (PT_INTERP) of an ELF executable, or None."""
+
+    with layer.data(entry) as stream:
+        header = stream.read(64)
+        if len(header) < 64 or header[:4] != b"\x7fELF" or header[4] != 2:
+            return None
+        order = "little" if header[5] == 1 else "big"
+        phoff = int.from_bytes(header[32:40], order)
+        phentsize = int.from_bytes(header[54:56], order)
+        phnum = int.from_bytes(header[56:58], order)
+        for index in range(phnum):
+            stream.seek(entry['offset'] + phoff + index * phentsize)
+            phdr = stream.read(phentsize)
+            if int.from_bytes(phdr[0:4], order) == 3:  # PT_INTERP
+                offset = int.from_bytes(phdr[8:16], order)
+                size = int.from_bytes(phdr[32:40], order)
+                stream.seek(entry['offset'] + offset)
+                return stream.read(size).rstrip(b"\0").decode("utf-8", "replace")
+    return None
+
+
+def minimize(layer, paths, patterns, executable=None):
+    """Filter the layer entries to the ones needed; return the kept paths."""
+
+    entries = {e['path']: e for e in layer.entries}
+    keep = set()
+    for path in paths:
+        keep.update(resolve(path, entries))
+
+    roots = [executable] if executable else []
+    while roots:
+        needed = resolve(roots.pop(), entries)
+        keep.update(needed)
+        if needed and entries[needed[-1]]['kind'] == "file":
+            interpreter = elf_interpreter(layer, entries[needed[-1]])
+            if interpreter and not set(resolve(interpreter, entries)) <= keep:
+                roots.append(interpreter)
+
+    for path in entries:
+        if any(fnmatch.fnmatchcase("/" + path, pattern) for pattern in patterns):
+            keep.update(resolve("/" + path, entries))
+
+    # Hard links need their source, directories are kept with their parents.
+    for path in list(keep):
+        if entries[path]['kind'] == "hardlink":
+            keep.add(entries[path]['link'])
+        keep.update(tar2cpio.ancestors(path))
+
+    layer.entries = [e for e in layer.entries if e['path'] in keep]
+    return keep
+
+
+def run_workload(args, log_file):
+    """Boot the application, run the workload and return the console log lines."""
+
+    print(f"Running: {args.run}", file=sys.stderr)
+    ready = threading.Event()
+    lines = []
+    ready_re = re.compile(args.ready) if args.ready else None
+
+    with open(log_file, "w", encoding="utf8") as log, \
+            subprocess.Popen(args.run, shell=True, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                             start_new_session=True) as vmm:
+
+        def reader():
+            for raw in vmm.stdout:
+                line = raw.decode("utf-8", "replace")
+                lines.append(line)
+                log.write(line)
+                if ready_re and ready_re.search(line):
+                    ready.set()
+            ready.set()
+
+        thread = threading.Thread(target=reader, daemon=True)
+        thread.start()
+
+        # Without a readiness pattern, wait for the application to exit.
+        if not ready.wait(args.timeout) and ready_re:
+            print("Warning: application not ready before timeout", file=sys.stderr)
+        if args.workload and vmm.poll() is None:
+            print(f"Running workload: {args.workload}", file=sys.stderr)
+            address = args.address or instance.guest_address(vmm.pid, timeout=5, fallback=False)
+            if address is None:
+                print("Error: The run command leased no instance, use --address",
+                      file=sys.stderr)
+                os.killpg(vmm.pid, signal.SIGKILL)
+                vmm.wait()
+                sys.exit(1)
+            env = dict(os.environ, UK_IP=address)
+            subprocess.run(args.workload, shell=True, check=False, env=env)
+        deadline = time.monotonic() + args.settle
+        while vmm.poll() is None and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+        if vmm.poll() is None:
+            os.killpg(vmm.pid, signal.SIGTERM)
+            try:
+                vmm.wait(5)
+            except subprocess.TimeoutExpired:
+                os.killpg(vmm.pid, signal.SIGKILL)
+                vmm.wait()
+        thread.join(5)
+    return lines
+
+
+def default_run(vmm):
+    """Return the command running the application with a strace kernel."""
+
+    try:
+        with open(CONFIG, "r", encoding="utf8") as stream:
+            config = yaml.safe_load(stream) or {}
+    except IOError:
+        config = {}
+    rundir = config.get("rundir", ".")
+    kerneldir = config.get("kerneldir", "../../kernels")
+    if vmm == "fc":
+        return (f"{os.path.join(rundir, 'run-fc-x86_64.sh')} "
+                f"{os.path.join(rundir, 'fc-x86_64-strace.json')}")
+    return (f"{os.path.join(rundir, 'run-qemu-x86_64.sh')} "
+            f"{os.path.join(kerneldir, 'base_qemu-x86_64-strace')}")
+
+
+def executable():
+    """Return the application executable from the Kraftfile command, or None."""
+
+    try:
+        with open(KRAFTCONFIG, "r", encoding="utf8") as stream:
+            data = yaml.safe_load(stream) or {}
+    except IOError:
+        return None
+    cmd = data.get("cmd")
+    if isinstance(cmd, list) and cmd:
+        return cmd[0]
+    if isinstance(cmd, str) and cmd:
+        return cmd.split()[0]
+    return None
+
+
+def parse_args():
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(description="Minimize the root filesystem of an application.")
+    parser.add_argument("-i", "--input", default="rootfs.cpio",
+                        help="initrd to minimize (default: rootfs.cpio)")
+    parser.add_argument("-o", "--output", default="rootfs.min.cpio",
+                        help="minimized initrd (default: rootfs.min.cpio)")
+    parser.add_argument("--vmm", choices=["qemu", "fc"], default="qemu",
+                        help="run script to use with the strace kernel (default: qemu)")
+    parser.add_argument("--run", help="command booting the application with a strace kernel "
+                                      "(default: generated run script for --vmm)")
+    parser.add_argument("--ready", help="console regular expression telling the application is ready")
+    parser.add_argument("--workload", help="shell command to run once the application is ready, "
+                                           "UK_IP is set to the guest address")
+    parser.add_argument("--address",
+                        help="guest address for the workload (default: guest address of the "
+                             "instance leased by the run command)")
+    parser.add_argument("--timeout", type=float, default=60,
+                        help="seconds to wait for readiness or exit (default: 60)")
+    parser.add_argument("--settle", type=float, default=2,
+                        help="seconds to wait after the workload before stopping (default: 2)")
+    parser.add_argument("--log", default="minimize.log",
+                        help="console log file (default: minimize.log)")
+    parser.add_argument("--from-log", help="parse an existing console log instead of booting")
+    parser.add_argument("--keep", action="append", default=[],
+                        help="glob pattern of paths to keep, may be repeated")
+    parser.add_argument("--allowlist", default=ALLOWLIST,
+                        help=f"file with patterns of paths to keep (default: {ALLOWLIST})")
+    parser.add_argument("--mtime", type=int, default=tar2cpio.source_date_epoch(),
+                        help="modification time of entries (default: SOURCE_DATE_EPOCH or 0)")
+    args = parser.parse_args()
+    if args.workload and not args.ready:
+        parser.error("--workload requires --ready")
+    if not args.run:
+        args.run = default_run(args.vmm)
+    return args
+
+
+def main():
+    """The main program function."""
+
+    args = parse_args()
+
+    if args.from_log:
+        with open(args.from_log, "r", encoding="utf8", errors="replace") as stream:
+            lines = stream.readlines()
+    else:
+        lines = run_workload(args, args.log)
+
+    paths = parse_log(lines)
+    if not paths:
+        print("Error: No traced file system calls found; is the kernel strace-enabled?",
+              file=sys.stderr)
+        sys.exit(1)
+
+    patterns = DEFAULT_KEEP + args.keep
+    if os.path.isfile(args.allowlist):
+        with open(args.allowlist, "r", encoding="utf8") as stream:
+            patterns += [line.strip() for line in stream
+                         if line.strip() and not line.startswith("#")]
+
+    try:
+        layer = tar2cpio.CpioLayer(args.input)
+    except (IOError, tar2cpio.ConvertError) as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        sys.exit(1)
+    before = (len(layer.entries), sum(e['size'] for e in layer.entries if e['kind'] == "file"))
+    minimize(layer, paths, patterns, executable())
+
+    with open(args.output + ".tmp", "wb") as output:
+        stats = tar2cpio.convert_deterministic([layer], output, args.mtime, sys.stderr)
+    os.replace(args.output + ".tmp", args.output)
+
+    size_in = os.path.getsize(args.input)
+    size_out = os.path.getsize(args.output)
+    print(f"{len(paths)} paths traced")
+    print(f"{args.input:<20} {before[0]:>7} entries {before[1] / (1 << 20):9.1f} MiB data "
+          f"{size_in / (1 << 20):9.1f} MiB")
+    print(f"{args.output:<20} {stats['entries']:>7} entries {stats['bytes'] / (1 << 20):9.1f} MiB data "
+          f"{size_out / (1 << 20):9.1f} MiB ({100 * (1 - size_out / size_in):.1f}% smaller)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2023, Unikraft GmbH and The Unikraft Authors.
+
+"""Assemble a deterministic initrd (newc CPIO) from a Docker image.
+
+The input is the output of `docker save`. The archive is the
+concatenation of:
+  - the directories of the merged root filesystem
+  - one fragment per image layer, with the other visible entries of the
+    layer (regular files, symbolic links, special files)
+  - the trailer
+
+Fragments are cached (in `~/.cache/unikraft/initrd/` by default, set
+`UK_INITRD_CACHE` to change it), keyed by the layer digest (diff ID)
+and by the list of its entries still visible in the merged filesystem.
+Images sharing base layers, such as the Python images, share the
+fragments, and rebuilding an image after an application change only
+encodes the changed layers.
+
+Output is deterministic, see `tar2cpio.py --deterministic`.
+
+Usage:
+    docker save <image> | mkinitrd.py -o rootfs.cpio -
+    mkinitrd.py -o rootfs.cpio image.tar
+"""
+
+import sys
+import os
+import json
+import hashlib
+import argparse
+import tempfile
+import tarfile
+import tar2cpio
+
+
+CACHE_DIR = os.environ.get("UK_INITRD_CACHE", os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "unikraft", "initrd"))
+
+# Update when the fragment encoding changes.
+FORMAT_VERSION = 1
+
+
+def member(image, name):
+    """Return the member of a saved image with the given name."""
+
+    for info in image.getmembers():
+        if tar2cpio.normalize(info.name) == tar2cpio.normalize(name):
+            return info
+    raise KeyError(name)
+
+
+def read_json(image, name):
+    """Read a JSON file from a saved image."""
+
+    try:
+        with image.extractfile(member(image, name)) as stream:
+            return json.load(stream)
+    except (KeyError, ValueError) as exc:
+        raise tar2cpio.ConvertError(f"Invalid image, unable to read '{name}'") from exc
+
+
+def image_layers(image):
+    """Return (member name, diff ID) of the layers of a saved image, bottom layer first."""
+
+    manifest = read_json(image, "manifest.json")
+    if len(manifest) != 1:
+        raise tar2cpio.ConvertError(f"Expected a single image, found {len(manifest)}")
+    config = read_json(image, manifest[0]["Config"])
+    diff_ids = config.get("rootfs", {}).get("diff_ids", [])
+    layers = manifest[0]["Layers"]
+    if len(layers) != len(diff_ids):
+        raise tar2cpio.ConvertError("Layers don't match the image configuration")
+    return list(zip(layers, diff_ids))
+
+
+def load_layer(image, name, diff_id, cache_dir):
+    """Return the layer, with its index read from or saved to the cache."""
+
+    info = member(image, name)
+
+    def opener():
+        return image.extractfile(info)
+
+    index_file = os.path.join(cache_dir, "index", diff_id.replace(":", "-") + ".json")
+    try:
+        with open(index_file, "r", encoding="utf8") as stream:
+            return tar2cpio.TarLayer(opener, json.load(stream))
+    except (IOError, ValueError):
+        pass
+
+    layer = tar2cpio.TarLayer(opener)
+    os.makedirs(os.path.dirname(index_file), exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", encoding="utf8", delete=False,
+                                     dir=os.path.dirname(index_file)) as stream:
+        json.dump(layer.entries, stream)
+    os.replace(stream.name, index_file)
+    return layer
+
+
+def fragment_key(diff_ids, index, body, mtime):
+    """Compute the cache key of a layer fragment.
+
+    Besides the layer, the key depends on which of its entries are
+    visible and on the layers providing the data of hard links.
+    """
+
+    hasher = hashlib.sha256()
+    hasher.update(f"{FORMAT_VERSION}\0{mtime}\0{diff_ids[index]}\0".encode("utf-8"))
+    for entry in sorted(body, key=lambda e: tar2cpio.sort_key(e['path'])):
+        hasher.update(entry['path'].encode("utf-8") + b"\0")
+        if 'source' in entry:
+            hasher.update(f"{diff_ids[entry['source'][0]]}\0".encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def build(image, output, mtime, cache_dir, log=None):
+    """Write the initrd of a saved image; return per-layer statistics."""
+
+    layers = []
+    diff_ids = []
+    for name, diff_id in image_layers(image):
+        layers.append(load_layer(image, name, diff_id, cache_dir))
+        diff_ids.append(diff_id)
+
+    dirs, bodies = tar2cpio.merge(layers)
+    writer = tar2cpio.Writer(output, mtime)
+    tar2cpio.write_dirs(writer, dirs)
+
+    stats = []
+    fragments = os.path.join(cache_dir, "fragments")
+    os.makedirs(fragments, exist_ok=True)
+    for index, body in enumerate(bodies):
+        path = os.path.join(fragments, fragment_key(diff_ids, index, body, mtime) + ".cpio")
+        hit = os.path.isfile(path)
+        if not hit:
+            with tempfile.NamedTemporaryFile(dir=fragments, delete=False) as stream:
+                tar2cpio.write_body(tar2cpio.Writer(stream, mtime), layers, index, body, log)
+            os.replace(stream.name, path)
+        else:
+            # Record last use, to allow pruning old fragments.
+            os.utime(path)
+        writer.fragment(path)
+        stats.append((diff_ids[index], hit, len(body), os.path.getsize(path)))
+
+    writer.trailer()
+    return stats
+
+
+def parse_args():
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(description="Assemble a deterministic initrd from a Docker image.")
+    parser.add_argument("image", metavar="IMAGE",
+                        help="output of `docker save`, or - for standard input")
+    parser.add_argument("-o", "--output", required=True, help="output CPIO file")
+    parser.add_argument("--mtime", type=int, default=tar2cpio.source_date_epoch(),
+                        help="modification time of entries (default: SOURCE_DATE_EPOCH or 0)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR,
+                        help=f"fragment cache directory (default: {CACHE_DIR})")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="print per-layer cache status")
+    return parser.parse_args()
+
+
+def main():
+    """The main program function."""
+
+    args = parse_args()
+
+    spooled = None
+    if args.image == "-":
+        spooled = tar2cpio.spool(sys.stdin.buffer)
+        image_path = spooled.name
+    else:
+        image_path = args.image
+
+    try:
+        with tarfile.open(image_path, "r:") as image, \
+                open(args.output + ".tmp", "wb") as output:
+            stats = build(image, output, args.mtime, args.cache_dir, sys.stderr)
+    except (tar2cpio.ConvertError, tarfile.TarError, OSError) as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        if os.path.exists(args.output + ".tmp"):
+            os.remove(args.output + ".tmp")
+        sys.exit(1)
+    os.replace(args.output + ".tmp", args.output)
+
+    if args.verbose:
+        for diff_id, hit, entries, size in stats:
+            print(f"{diff_id[:19]}  {'cached ' if hit else 'encoded'}  "
+                  f"{entries:>6} entries  {size / (1 << 20):8.1f} MiB", file=sys.stderr)
+        print(f"{sum(1 for s in stats if s[1])}/{len(stats)} layers from cache", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2023, Unikraft GmbH and The Unikraft Authors.
+
+"""Track files written by the generator scripts.
+
+In incremental mode, generated contents are only written when they
+differ from what is on disk, so unchanged files keep their
+modification time. A manifest file stores a hash of the generator
+inputs and of every generated file. It is used to skip generation
+altogether when nothing changed, and to remove stale files that are
+no longer generated.
+"""
+
+import contextlib
+import hashlib
+import io
+import json
+import os
+import stat
+
+
+MANIFEST = ".generate.manifest.json"
+
+
+def digest(data):
+    """Return the hex SHA-256 digest of the given bytes."""
+
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path):
+    """Return the hex SHA-256 digest of a file or None if it can't be read."""
+
+    try:
+        with open(path, "rb") as stream:
+            return digest(stream.read())
+    except IOError:
+        return None
+
+
+def inputs_digest(paths, extra=None):
+    """Compute the digest of generator inputs.
+
+    Inputs are the contents of the given files (missing files are
+    hashed as such) and the JSON serialization of `extra`. File names
+    are not part of the digest, only their order.
+    """
+
+    hasher = hashlib.sha256()
+    for path in paths:
+        hasher.update((file_digest(path) or "missing").encode("utf-8") + b"\0")
+    hasher.update(json.dumps(extra, sort_keys=True).encode("utf-8"))
+    return hasher.hexdigest()
+
+
+class Outputs:
+    """Write generated files, optionally incrementally.
+
+    Without `incremental`, every file is rewritten, as the generators
+    always did. With `incremental`, files are only written if their
+    contents changed and stale files from the previous run are
+    removed. With `check`, nothing is written; `finish()` returns the
+    changes that would be made.
+    """
+
+    def __init__(self, generator, inputs, incremental=False, check=False, manifest=MANIFEST):
+        self.generator = generator
+        self.inputs = inputs
+        self.incremental = incremental or check
+        self.check = check
+        self.manifest = manifest
+        self.written = {}
+        self.changes = []
+        self.previous = {}
+        if self.incremental:
+            try:
+                with open(self.manifest, "r", encoding="utf8") as stream:
+                    self.previous = json.load(stream)
+            except (IOError, ValueError):
+                self.previous = {}
+
+    def up_to_date(self):
+        """Check if generated files are current.
+
+        This is the case if the inputs didn't change since the last run
+        and the files on disk match the manifest.
+        """
+
+        if not self.incremental or not self.previous:
+            return False
+        if self.previous.get("generator") != self.generator or \
+                self.previous.get("inputs") != self.inputs:
+            return False
+        for path, expected in self.previous.get("outputs", {}).items():
+            if file_digest(path) != expected:
+                return False
+        return True
+
+    def write(self, path, contents, executable=False):
+        """Write contents to the given path."""
+
+        data = contents.encode("utf-8")
+        self.written[path] = digest(data)
+
+        if not self.incremental:
+            with open(path, "wb") as stream:
+                stream.write(data)
+            if executable:
+                sbuf = os.stat(path)
+                os.chmod(path, sbuf.st_mode | stat.S_IEXEC)
+            return
+
+        current = file_digest(path)
+        if current != self.written[path]:
+            self.changes.append(("created" if current is None else "updated", path))
+            if not self.check:
+                with open(path, "wb") as stream:
+                    stream.write(data)
+        if executable and not self.check:
+            sbuf = os.stat(path)
+            if not sbuf.st_mode & stat.S_IEXEC:
+                os.chmod(path, sbuf.st_mode | stat.S_IEXEC)
+
+    @contextlib.contextmanager
+    def open(self, path, executable=False):
+        """Return a text stream whose contents are written on close."""
+
+        stream = io.StringIO()
+        yield stream
+        self.write(path, stream.getvalue(), executable)
+
+    def finish(self):
+        """Remove stale files, update the manifest and return the changes.
+
+        Changes are (action, path) tuples, with action one of
+        `created`, `updated` or `removed`.
+        """
+
+        if not self.incremental:
+            return self.changes
+
+        for path in sorted(self.previous.get("outputs", {})):
+            if path in self.written:
+                continue
+            if not os.path.exists(path):
+                continue
+            self.changes.append(("removed", path))
+            if not self.check:
+                os.remove(path)
+
+        if not self.check:
+            manifest = {
+                "generator": self.generator,
+                "inputs": self.inputs,
+                "outputs": dict(sorted(self.written.items())),
+            }
+            if manifest != self.previous:
+                with open(self.manifest, "w", encoding="utf8") as stream:
+                    json.dump(manifest, stream, indent=2)
+                    stream.write("\n")
+
+        return self.changes
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2023, Unikraft GmbH and The Unikraft Authors.
+
+"""Precompile the Python modules of a root filesystem.
+
+The interpreter of the image (e.g. `/usr/local/bin/python3`) is run on
+the host, through the dynamic loader and libraries of the root
+filesystem, to compile every module (standard library, site-packages
+and application sources) into unchecked-hash `.pyc` files:
+  - a cold start in the guest doesn't compile anything, and it never
+    tries to write bytecode to the read-only-ish ramfs
+  - unlike timestamp-based `.pyc` files (as shipped in the Python Docker
+    images), unchecked-hash ones stay valid when modification times are
+    normalized in deterministic initrds
+
+Sources matching `--drop-sources` patterns are replaced by legacy
+`.pyc` files next to them, to save space (don't drop the script run by
+the application command). The `.pyc` files are then
+verified by the interpreter (magic number, flags, loadable code), and
+the interpreter startup time (with `--import` modules) is measured
+before and after.
+
+Usage:
+    pyc-rootfs.py [--import flask] [--drop-sources '/usr/local/lib/python3.12/*'] rootfs
+"""
+
+import sys
+import os
+import re
+import glob
+import time
+import fnmatch
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+
+INTERPRETERS = ["usr/local/bin/python3", "usr/bin/python3"]
+LOADERS = ["lib64/ld-linux-*.so.*", "lib/ld-linux-*.so.*", "lib/x86_64-linux-gnu/ld-linux-*.so.*"]
+LIBRARY_DIRS = ["lib/x86_64-linux-gnu", "usr/lib/x86_64-linux-gnu", "usr/local/lib",
+                "lib64", "lib", "usr/lib"]
+STDLIBS = ["usr/local/lib/python3.*/os.py", "usr/lib/python3.*/os.py"]
+
+# Unchecked-hash .pyc files: hash-based (bit 0) without source check (bit 1).
+PYC_FLAGS = 0b01
+
+VERIFY_SCRIPT = """
+import sys, os, marshal, importlib.util
+root, expected = sys.argv[1], int(sys.argv[2])
+ok, bad = 0, []
+for dirpath, _, filenames in os.walk(root):
+    for name in filenames:
+        if not name.endswith(".pyc"):
+            continue
+        path = os.path.join(dirpath, name)
+        with open(path, "rb") as stream:
+            data = stream.read()
+        try:
+            if data[:4] != importlib.util.MAGIC_NUMBER:
+                raise ValueError("bad magic number")
+            if int.from_bytes(data[4:8], "little") != expected:
+                raise ValueError("not an unchecked-hash pyc")
+            marshal.loads(data[16:])
+            ok += 1
+        except Exception as exc:
+            bad.append(f"{path}: {exc}")
+print(ok)
+for line in bad:
+    print(line)
+"""
+
+
+def in_root(root, path):
+    """Resolve the symbolic links of a path inside the root filesystem."""
+
+    path = os.path.join(root, path)
+    for _ in range(40):
+        if not os.path.islink(path):
+            break
+        link = os.readlink(path)
+        if link.startswith("/"):
+            path = os.path.join(root, link.lstrip("/"))
+        else:
+            path = os.path.join(os.path.dirname(path), link)
+    return path
+
+
+class Interpreter:
+    """Python interpreter of a root filesystem, run on the host."""
+
+    def __init__(self, root, python=None):
+        self.root = root
+        if python:
+            self.command = python.split()
+            self.env = {}
+            return
+
+        executable = next((in_root(root, p) for p in INTERPRETERS
+                           if os.path.exists(in_root(root, p))), None)
+        loader = next((m for pattern in LOADERS for m in glob.glob(os.path.join(root, pattern))),
+                      None)
+        # The interpreter may not live in its prefix (e.g. copied to /usr/bin).
+        home = next((os.path.dirname(os.path.dirname(os.path.dirname(m)))
+                     for pattern in STDLIBS for m in glob.glob(os.path.join(root, pattern))), None)
+        if not executable or not loader or not home:
+            raise RuntimeError(f"No Python interpreter or dynamic loader in '{root}', use --python")
+        libs = [os.path.join(root, d) for d in LIBRARY_DIRS if os.path.isdir(os.path.join(root, d))]
+        self.command = [loader, "--library-path", ":".join(libs), executable]
+        self.env = {'PYTHONHOME': home}
+
+    def run(self, args, **kwargs):
+        """Run the interpreter with the given arguments."""
+
+        env = dict(os.environ, PYTHONNOUSERSITE="1", **self.env)
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        env.update(kwargs.pop('env', {}))
+        return subprocess.run(self.command + args, env=env, check=False,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **kwargs)
+
+    def version(self):
+        """Return the interpreter version string."""
+
+        result = self.run(["-c", "import sys; print('%d.%d' % sys.version_info[:2])"])
+        if result.returncode != 0:
+            raise RuntimeError(f"Unable to run the interpreter: {result.stdout.decode().strip()}")
+        return result.stdout.decode().strip()
+
+
+def startup_time(interpreter, modules, runs):
+    """Return the median time (seconds) to start the interpreter and import modules.
+
+    Bytecode is not written, and an empty cache prefix hides `__pycache__`
+    directories when measuring without precompiled modules.
+    """
+
+    code = "; ".join(f"import {m}" for m in modules) or "pass"
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = interpreter.run(["-B", "-c", code])
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError(f"'{code}' failed: {result.stdout.decode().strip()}")
+    return statistics.median(times)
+
+
+def sources(root, patterns):
+    """Return the .py files of the root filesystem matching the patterns."""
+
+    matches = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if not name.endswith(".py"):
+                continue
+            path = os.path.join(dirpath, name)
+            guest = "/" + os.path.relpath(path, root)
+            if any(fnmatch.fnmatchcase(guest, pattern) for pattern in patterns):
+                matches.append(path)
+    return matches
+
+
+def compile_all(interpreter, root, legacy=None):
+    """Compile modules to unchecked-hash .pyc files; return the error lines.
+
+    With `legacy`, only the given files are compiled, to `.pyc` files
+    next to the sources.
+    """
+
+    # Parallel workers (-j 0) are started through sys.executable (forkserver
+    # in 3.12+), without the loader and library path of the root filesystem.
+    args = ["-m", "compileall", "-q", "-f", "-j", "1", "--invalidation-mode", "unchecked-hash",
+            "-s", root, "-p", "/"]
+    if legacy is None:
+        result = interpreter.run(args + [root])
+    else:
+        with tempfile.NamedTemporaryFile("w", encoding="utf8") as stream:
+            stream.write("\n".join(legacy))
+            stream.flush()
+            result = interpreter.run(args + ["-b", "-i", stream.name])
+    output = result.stdout.decode("utf-8", "replace")
+    return [line for line in output.splitlines() if re.search(r"Error|\*\*\*", line)]
+
+
+def drop_sources(files):
+    """Remove sources and their __pycache__ files, keeping legacy .pyc files."""
+
+    dropped = 0
+    for path in files:
+        if not os.path.exists(path + "c"):
+            continue
+        os.remove(path)
+        directory, name = os.path.split(path)
+        for cached in glob.glob(os.path.join(directory, "__pycache__", name[:-3] + ".*.pyc")):
+            os.remove(cached)
+        cache = os.path.join(directory, "__pycache__")
+        if os.path.isdir(cache) and not os.listdir(cache):
+            os.rmdir(cache)
+        dropped += 1
+    return dropped
+
+
+def verify(interpreter, root):
+    """Check .pyc files with the interpreter; return (number ok, problems)."""
+
+    result = interpreter.run(["-c", VERIFY_SCRIPT, root, str(PYC_FLAGS)])
+    lines = result.stdout.decode("utf-8", "replace").splitlines()
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(f"Verification failed: {' '.join(lines)}")
+    return int(lines[0]), lines[1:]
+
+
+def parse_args():
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(description="Precompile Python modules of a root filesystem.")
+    parser.add_argument("rootfs", help="root filesystem directory")
+    parser.add_argument("--python",
+                        help="interpreter command (default: the one of the root filesystem)")
+    parser.add_argument("--drop-sources", action="append", default=[], metavar="PATTERN",
+                        help="replace sources matching the glob pattern (guest path) "
+                             "with legacy .pyc files, may be repeated")
+    parser.add_argument("--import", dest="modules", action="append", default=[],
+                        metavar="MODULE", help="module to import when measuring startup time, "
+                                               "may be repeated")
+    parser.add_argument("--runs", type=int, default=5,
+                        help="startup time measurements (default: 5)")
+    parser.add_argument("--no-bench", action="store_true",
+                        help="don't measure startup time")
+    return parser.parse_args()
+
+
+def main():
+    """The main program function."""
+
+    args = parse_args()
+    root = os.path.abspath(args.rootfs)
+
+    try:
+        interpreter = Interpreter(root, args.python)
+        version = interpreter.version()
+        print(f"Python {version}: {' '.join(interpreter.command)}")
+        if not any(glob.glob(os.path.join(root, pattern.replace("3.*", version)))
+                   for pattern in STDLIBS):
+            raise RuntimeError(f"Python {version} doesn't match the standard library of '{root}'")
+
+        if not args.no_bench:
+            with tempfile.TemporaryDirectory() as prefix:
+                before = startup_time(interpreter, args.modules, args.runs)
+                interpreter.env['PYTHONPYCACHEPREFIX'] = prefix
+                cold = startup_time(interpreter, args.modules, args.runs)
+                del interpreter.env['PYTHONPYCACHEPREFIX']
+
+        errors = compile_all(interpreter, root)
+        dropped = 0
+        if args.drop_sources and not errors:
+            files = sources(root, args.drop_sources)
+            errors = compile_all(interpreter, root, legacy=files)
+            if not errors:
+                dropped = drop_sources(files)
+        if errors:
+            # Modules that don't compile would fail to import in the guest.
+            for line in errors:
+                print(f"Error: {line}", file=sys.stderr)
+            sys.exit(1)
+
+        ok, problems = verify(interpreter, root)
+        for line in problems:
+            print(f"Error: {line}", file=sys.stderr)
+        print(f"{ok} .pyc files verified, {len(problems)} rejected, {dropped} sources dropped")
+
+        if not args.no_bench:
+            after = startup_time(interpreter, args.modules, args.runs)
+            what = ", ".join(args.modules) or "interpreter"
+            print(f"Startup time ({what}, median of {args.runs}, on the host):")
+            print(f"  no .pyc files:       {cold * 1000:8.1f} ms")
+            print(f"  before:              {before * 1000:8.1f} ms")
+            print(f"  after:               {after * 1000:8.1f} ms")
+    except (RuntimeError, OSError) as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        sys.exit(1)
+
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2023, Unikraft GmbH and The Unikraft Authors.
+
+"""Measure how the throughput of an application scales with vCPUs.
+
+For each vCPU count, the script:
+  - sets `vcpus` in `config.yaml` and regenerates the scripts
+    (`generate.py` for bincompat applications, `generate.einitrd.py`
+    otherwise)
+  - runs the `--build` command, if any (the Unikraft configuration of
+    the kernel depends on the number of vCPUs)
+  - boots the application with the `--run` script, waits for it to
+    accept connections and runs `utils/loadgen.py` against it
+
+`config.yaml` is restored at the end. Throughput, speedup, parallel
+efficiency and latencies are printed as a table, and saved as JSON
+with `--json`. Run the script from the application directory:
+
+    ../../utils/bincompat/smp-sweep.py --vcpus 1,2,4 --run ./run-qemu-x86_64.sh
+"""
+
+import sys
+import os
+import json
+import time
+import socket
+import signal
+import argparse
+import tempfile
+import subprocess
+import yaml
+import instance
+
+
+CONFIG = "config.yaml"
+KRAFTCONFIG = "Kraftfile"
+BINCOMPAT_DIR = os.path.dirname(os.path.abspath(__file__))
+LOADGEN = os.path.join(BINCOMPAT_DIR, "..", "loadgen.py")
+
+
+def generator():
+    """Return the generator of the application in the current directory."""
+
+    with open(KRAFTCONFIG, "r", encoding="utf8") as stream:
+        data = yaml.safe_load(stream) or {}
+    if 'runtime' in data and 'unikraft' not in data:
+        return os.path.join(BINCOMPAT_DIR, "generate.py")
+    return os.path.join(BINCOMPAT_DIR, "generate.einitrd.py")
+
+
+def configure(original, vcpus):
+    """Write config.yaml with the given number of vCPUs."""
+
+    config = yaml.safe_load(original) or {}
+    config['vcpus'] = vcpus
+    # A fixed topology only fits one vCPU count.
+    config.pop('topology', None)
+    with open(CONFIG, "w", encoding="utf8") as stream:
+        yaml.safe_dump(config, stream, sort_keys=False)
+
+
+def wait_ready(process, address, port, timeout):
+    """Wait for the application to accept connections; return the boot time or None."""
+
+    start = time.monotonic()
+    while time.monotonic() - start < timeout and process.poll() is None:
+        try:
+            with socket.create_connection((address, port), timeout=0.5):
+                return time.monotonic() - start
+        except OSError:
+            time.sleep(0.05)
+    return None
+
+
+def stop(process):
+    """Stop the process group of a run script, including VMMs run with sudo."""
+
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        if process.poll() is not None:
+            return
+        try:
+            os.killpg(process.pid, sig)
+        except PermissionError:
+            subprocess.run(["sudo", "-n", "kill", f"-{sig.name[3:]}", "--", f"-{process.pid}"],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        except ProcessLookupError:
+            return
+        try:
+            process.wait(3)
+        except subprocess.TimeoutExpired:
+            continue
+
+
+def measure(args, vcpus, log):
+    """Boot the application with the given vCPUs and run the load; return the results."""
+
+    result = {'vcpus': vcpus, 'boot': None, 'load': None}
+    process = subprocess.Popen([args.run], stdout=log, stderr=subprocess.STDOUT,
+                               stdin=subprocess.DEVNULL, start_new_session=True)
+    try:
+        address = args.address or instance.guest_address(process.pid, timeout=5)
+        result['boot'] = wait_ready(process, address, args.port, args.timeout)
+        if result['boot'] is None:
+            print(f"Warning: {vcpus} vCPUs: application not ready", file=sys.stderr)
+            return result
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            command = [sys.executable, LOADGEN, f"http://{address}:{args.port}{args.path}",
+                       "--duration", str(args.duration), "--warmup", str(args.warmup),
+                       "--connections", str(args.connections), "--json", output.name]
+            if args.scenario:
+                command += ["--scenario", args.scenario]
+            subprocess.run(command, stdout=log, stderr=subprocess.STDOUT, check=False)
+            try:
+                result['load'] = json.load(output)
+            except ValueError:
+                print(f"Warning: {vcpus} vCPUs: no load results", file=sys.stderr)
+    finally:
+        stop(process)
+    return result
+
+
+def print_table(results):
+    """Print throughput and latency per vCPU count."""
+
+    base = next((r['load']['throughput'] for r in results if r['load']), None)
+    print(f"{'vcpus':>5} {'req/s':>10} {'speedup':>8} {'efficiency':>10} "
+          f"{'p50 (ms)':>9} {'p99 (ms)':>9} {'errors':>7}")
+    for result in results:
+        if not result['load']:
+            print(f"{result['vcpus']:>5} {'-':>10}")
+            continue
+        load = result['load']
+        speedup = load['throughput'] / base if base else 0
+        percentiles = load['latency_us']['percentiles']
+        print(f"{result['vcpus']:>5} {load['throughput']:10.1f} {speedup:8.2f} "
+              f"{speedup / result['vcpus'] * results[0]['vcpus']:10.2f} "
+              f"{percentiles['50'] / 1000:9.3f} {percentiles['99'] / 1000:9.3f} "
+              f"{sum(load['errors'].values()):>7}")
+
+
+def parse_args():
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(description="Measure throughput scaling with vCPUs.")
+    parser.add_argument("--vcpus", default="1,2,4",
+                        help="comma-separated vCPU counts (default: 1,2,4)")
+    parser.add_argument("--run", required=True, help="run script booting the application")
+    parser.add_argument("--build", help="shell command rebuilding the kernel after regeneration")
+    parser.add_argument("--address",
+                        help="application address (default: guest address of the instance)")
+    parser.add_argument("--port", type=int, default=8080, help="application port (default: 8080)")
+    parser.add_argument("--path", default="/", help="request path (default: /)")
+    parser.add_argument("--scenario", help="utils/loadgen.yaml scenario (expected body)")
+    parser.add_argument("--connections", type=int, default=64,
+                        help="load generator connections (default: 64)")
+    parser.add_argument("--duration", type=float, default=20,
+                        help="seconds of load per vCPU count (default: 20)")
+    parser.add_argument("--warmup", type=float, default=3,
+                        help="seconds of load not recorded (default: 3)")
+    parser.add_argument("--timeout", type=float, default=120,
+                        help="seconds to wait for the application (default: 120)")
+    parser.add_argument("--log", default="smp-sweep.log",
+                        help="output of builds, runs and load (default: smp-sweep.log)")
+    parser.add_argument("--json", help="save results to this file")
+    args = parser.parse_args()
+    try:
+        args.vcpus = [int(v) for v in args.vcpus.split(",")]
+    except ValueError:
+        parser.error(f"invalid vCPU counts '{args.vcpus}'")
+    return args
+
+
+def main():
+    """The main program function."""
+
+    args = parse_args()
+
+    try:
+        with open(CONFIG, "r", encoding="utf8") as stream:
+            original = stream.read()
+        script = generator()
+    except IOError as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        sys.exit(1)
+
+    results = []
+    with open(args.log, "w", encoding="utf8") as log:
+        try:
+            for vcpus in args.vcpus:
+                print(f"{vcpus} vCPUs", file=sys.stderr)
+                configure(original, vcpus)
+                if subprocess.run([sys.executable, script], stdout=log, stderr=subprocess.STDOUT,
+                                  check=False).returncode != 0:
+                    print(f"Error: Generating scripts for {vcpus} vCPUs failed, see '{args.log}'",
+                          file=sys.stderr)
+                    break
+                if args.build and subprocess.run(args.build, shell=True, stdout=log,
+                                                 stderr=subprocess.STDOUT).returncode != 0:
+                    print(f"Error: Build for {vcpus} vCPUs failed, see '{args.log}'",
+                          file=sys.stderr)
+                    break
+                log.flush()
+                results.append(measure(args, vcpus, log))
+        except KeyboardInterrupt:
+            print("Interrupted, reporting completed runs", file=sys.stderr)
+        finally:
+            with open(CONFIG, "w", encoding="utf8") as stream:
+                stream.write(original)
+            subprocess.run([sys.executable, script], stdout=log, stderr=subprocess.STDOUT,
+                           check=False)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as stream:
+            json.dump(results, stream, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
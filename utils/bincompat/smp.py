@@ -0,0 +1,97 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2023, Unikraft GmbH and The Unikraft Authors.
+
+"""Virtual CPU configuration of applications.
+
+The `config.yaml` attributes are:
+  - `vcpus`: number of virtual CPUs (default: 1)
+  - `topology`: optional `sockets`, `cores` and `threads` (per core),
+    whose product is the number of virtual CPUs
+  - `pinning`: optional host CPUs running the VMM, as a list or as a
+    `taskset` CPU list (e.g. `0-3`)
+
+They are mapped to QEMU (`-smp`), Firecracker (`vcpu_count`, `smt`),
+`taskset` for pinning and the Unikraft configuration.
+"""
+
+import re
+
+
+# Firecracker supports at most 32 vCPUs, and SMT with two threads per core.
+FC_MAX_VCPUS = 32
+CPU_LIST_RE = re.compile(r"^\d+(-\d+)?(,\d+(-\d+)?)*$")
+
+
+def parse(config):
+    """Return the vCPU configuration of a `config.yaml` dictionary.
+
+    Raise ValueError for invalid attributes.
+    """
+
+    vcpus = config.get('vcpus', 1)
+    if not isinstance(vcpus, int) or vcpus < 1:
+        raise ValueError(f"'vcpus' must be a positive integer, not '{vcpus}'")
+
+    topology = config.get('topology')
+    if topology:
+        topology = {key: topology.get(key, 1) for key in ['sockets', 'cores', 'threads']}
+        if any(not isinstance(v, int) or v < 1 for v in topology.values()):
+            raise ValueError(f"Invalid 'topology' {topology}")
+        if topology['sockets'] * topology['cores'] * topology['threads'] != vcpus:
+            raise ValueError(f"'topology' {topology} doesn't have {vcpus} vCPUs")
+
+    pinning = config.get('pinning')
+    if isinstance(pinning, list):
+        pinning = ",".join(str(cpu) for cpu in pinning)
+    elif pinning is not None:
+        pinning = str(pinning)
+    if pinning is not None and not CPU_LIST_RE.match(pinning):
+        raise ValueError(f"Invalid 'pinning' '{pinning}'")
+
+    return {
+        'vcpus': vcpus,
+        'topology': topology or None,
+        'pinning': pinning,
+        }
+
+
+def qemu_args(smp):
+    """Return the QEMU `-smp` argument."""
+
+    args = str(smp['vcpus'])
+    if smp['topology']:
+        args += ",".join([""] + [f"{key}={value}" for key, value in smp['topology'].items()])
+    return args
+
+
+def fc_machine(smp):
+    """Return the Firecracker `vcpu_count` and `smt` values.
+
+    Raise ValueError if Firecracker doesn't support the configuration.
+    """
+
+    threads = smp['topology']['threads'] if smp['topology'] else 1
+    if smp['vcpus'] > FC_MAX_VCPUS or threads > 2 or (threads == 2 and smp['vcpus'] % 2):
+        raise ValueError(f"Firecracker doesn't support {smp['vcpus']} vCPUs "
+                         f"with {threads} threads per core")
+    return smp['vcpus'], threads == 2
+
+
+def taskset(smp):
+    """Return the command prefix pinning the VMM to host CPUs, or an empty string."""
+
+    if not smp['pinning']:
+        return ""
+    return f"taskset -c {smp['pinning']} "
+
+
+def kconfig(smp, arch):
+    """Return the Unikraft configuration options required by the guest."""
+
+    if smp['vcpus'] == 1:
+        return {}
+    options = {'CONFIG_UKPLAT_LCPU_MAXCOUNT': smp['vcpus']}
+    if arch == "x86_64":
+        # Secondary CPUs are found in the ACPI MADT.
+        options['CONFIG_UKPLAT_ACPI'] = "y"
+    return options
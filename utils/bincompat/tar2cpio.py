@@ -0,0 +1,830 @@
+#!/usr/bin/env python
+
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2023, Unikraft GmbH and The Unikraft Authors.
+
+"""Convert a root filesystem tar stream to a newc CPIO archive.
+
+The input is either a tar stream on standard input, such as the output
+of `docker export`, or a list of (optionally compressed) OCI / Docker
+layer tarballs, from the bottom layer to the top layer. The CPIO
+archive is written in a single pass, without extracting files to disk,
+and file contents are copied in chunks, so memory use doesn't depend
+on file sizes.
+
+The archive is laid out like `find -depth | tac | cpio -o -H newc` run
+in an extracted root filesystem:
+  - names are relative to the root (`./usr/bin/...`), starting with `.`
+  - directories precede their contents; missing parent directories are
+    added and later updated with their real metadata
+  - hard links are stored as copies, as the Unikraft CPIO extractor
+    doesn't support links between entries
+
+Layers are applied top to bottom: entries of a lower layer that are
+replaced by an upper layer, or hidden by a whiteout (`.wh.<name>`) or
+an opaque directory marker (`.wh..wh..opq`), are skipped.
+
+With `--deterministic`, the same input always yields the same archive:
+entries are indexed first, then written sorted (all directories, then
+the other entries of each layer, bottom layer first), with modification
+times set to `--mtime` (`SOURCE_DATE_EPOCH` or 0 by default), owners set
+to root and inode numbers derived from names. A tar stream on standard
+input is spooled to a temporary file for this. A directory can also be
+archived this way, with `-C`.
+
+Usage:
+    docker export <container> | tar2cpio.py -o rootfs.cpio
+    tar2cpio.py -o rootfs.cpio layer0.tar.gz layer1.tar.gz ...
+    tar2cpio.py --deterministic -C rootfs -o rootfs.cpio
+"""
+
+import sys
+import os
+import stat
+import zlib
+import shutil
+import filecmp
+import argparse
+import tempfile
+import posixpath
+import contextlib
+import tarfile
+
+
+CHUNK_SIZE = 1 << 20
+
+NEWC_MAGIC = b"070701"
+NEWC_TRAILER = "TRAILER!!!"
+
+WHITEOUT_PREFIX = ".wh."
+WHITEOUT_OPAQUE = ".wh..wh..opq"
+
+# Field indexes in the newc header.
+FIELD_MODE = 1
+FIELD_UID = 2
+FIELD_GID = 3
+FIELD_MTIME = 5
+
+TAR_TYPES = {
+        tarfile.REGTYPE: stat.S_IFREG,
+        tarfile.AREGTYPE: stat.S_IFREG,
+        tarfile.CONTTYPE: stat.S_IFREG,
+        tarfile.DIRTYPE: stat.S_IFDIR,
+        tarfile.SYMTYPE: stat.S_IFLNK,
+        tarfile.CHRTYPE: stat.S_IFCHR,
+        tarfile.BLKTYPE: stat.S_IFBLK,
+        tarfile.FIFOTYPE: stat.S_IFIFO,
+        }
+
+
+class ConvertError(Exception):
+    """The input can't be converted."""
+
+
+def pad(length):
+    """Return the padding bytes to align length to 4 bytes."""
+
+    return b"\0" * (-length % 4)
+
+
+def normalize(name):
+    """Return the path of a tar member relative to the root, or "" for the root."""
+
+    name = posixpath.normpath("/" + name).lstrip("/")
+    return "" if name == "." else name
+
+
+def ancestors(path):
+    """Return the parent directories of a path, closest first."""
+
+    result = []
+    while True:
+        path = posixpath.dirname(path)
+        if not path:
+            return result
+        result.append(path)
+
+
+def sort_key(path):
+    """Return the sort key of a path; directories precede their contents."""
+
+    return path.split("/")
+
+
+def source_date_epoch():
+    """Return the default modification time of deterministic archives."""
+
+    try:
+        return int(os.environ.get("SOURCE_DATE_EPOCH", "0"))
+    except ValueError:
+        return 0
+
+
+class Writer:
+    """Write newc CPIO entries to a binary stream.
+
+    If `mtime` is set, entries are normalized: their modification time
+    is `mtime`, they are owned by root and their inode number is derived
+    from their name, so that it doesn't depend on the other entries.
+    """
+
+    def __init__(self, stream, mtime=None):
+        self.stream = stream
+        self.mtime = mtime
+        self.offset = 0
+        self.ino = 0
+        try:
+            self.seekable = stream.seekable() and stream.readable()
+        except (AttributeError, OSError):
+            self.seekable = False
+
+    def write(self, data):
+        """Write raw bytes."""
+
+        self.stream.write(data)
+        self.offset += len(data)
+
+    def header(self, name, mode, uid=0, gid=0, mtime=0, nlink=1, size=0, rdev=(0, 0)):
+        """Write an entry header and name; return the header offset."""
+
+        self.ino += 1
+        ino = self.ino
+        if self.mtime is not None:
+            mtime, uid, gid = self.mtime, 0, 0
+            ino = zlib.crc32(name.encode("utf-8"))
+        name = name.encode("utf-8") + b"\0"
+        fields = [ino, mode, uid, gid, nlink, int(mtime), size,
+                  0, 0, rdev[0], rdev[1], len(name), 0]
+        offset = self.offset
+        data = NEWC_MAGIC + b"".join(b"%08X" % (f & 0xffffffff) for f in fields) + name
+        self.write(data + pad(len(data)))
+        return offset
+
+    def data(self, source, size):
+        """Copy size bytes from a readable file object."""
+
+        remaining = size
+        while remaining:
+            chunk = source.read(min(remaining, CHUNK_SIZE))
+            if not chunk:
+                raise ConvertError("Unexpected end of input")
+            self.write(chunk)
+            remaining -= len(chunk)
+        self.write(pad(size))
+
+    def copy(self, offset, size):
+        """Copy size bytes previously written at offset as entry data."""
+
+        self.stream.flush()
+        fd = self.stream.fileno()
+        remaining = size
+        while remaining:
+            chunk = os.pread(fd, min(remaining, CHUNK_SIZE), offset)
+            if not chunk:
+                raise ConvertError("Unable to read back output")
+            self.write(chunk)
+            offset += len(chunk)
+            remaining -= len(chunk)
+        self.write(pad(size))
+
+    def patch(self, offset, mode, uid, gid, mtime):
+        """Update metadata of the entry written at offset."""
+
+        self.stream.seek(offset + len(NEWC_MAGIC) + 8 * FIELD_MODE)
+        self.stream.write(b"%08X%08X%08X" % (mode, uid, gid))
+        self.stream.seek(offset + len(NEWC_MAGIC) + 8 * FIELD_MTIME)
+        self.stream.write(b"%08X" % (int(mtime) & 0xffffffff))
+        self.stream.seek(self.offset)
+
+    def trailer(self):
+        """Write the archive trailer."""
+
+        self.header(NEWC_TRAILER, 0, nlink=1)
+        self.stream.flush()
+
+    def fragment(self, path):
+        """Append the entries of a fragment file (an archive without trailer)."""
+
+        with open(path, "rb") as stream:
+            shutil.copyfileobj(stream, self.stream, CHUNK_SIZE)
+            self.offset += stream.tell()
+
+
+class Converter:
+    """Convert tar layers, from the top layer down, to CPIO entries."""
+
+    def __init__(self, writer, log=None):
+        self.writer = writer
+        self.log = log
+        # Directories written: path -> header offset if synthesized, else None.
+        self.dirs = {"": None}
+        # Paths written from an upper layer.
+        self.seen = set()
+        # Paths whose lower layer entries and descendants are hidden.
+        self.hidden = set()
+        # Paths whose lower layer descendants are hidden.
+        self.opaque = set()
+        # Regular files written: path -> (layer, data offset, size).
+        self.files = {}
+        # Hard links waiting for their target: target -> [(name, member)].
+        self.pending = {}
+        # Regular files of the current layer that were not written: path -> member.
+        self.skipped = {}
+        self.stats = {'entries': 0, 'bytes': 0, 'hardlinks': 0, 'whiteouts': 0,
+                      'skipped': 0, 'synthesized': 0}
+        self.writer.header(".", stat.S_IFDIR | 0o755, nlink=2)
+
+    def is_hidden(self, path):
+        """Check if a path of the current layer is hidden by an upper layer."""
+
+        if path in self.hidden:
+            return True
+        for parent in ancestors(path):
+            if parent in self.hidden or parent in self.opaque:
+                return True
+        return False
+
+    def make_parents(self, path):
+        """Write missing parent directories of path, outermost first."""
+
+        for parent in reversed(ancestors(path)):
+            if parent in self.dirs:
+                continue
+            offset = self.writer.header(f"./{parent}", stat.S_IFDIR | 0o755, nlink=2)
+            self.dirs[parent] = offset
+            self.stats['synthesized'] += 1
+
+    def add_dir(self, path, member):
+        """Write a directory entry, or update a synthesized one."""
+
+        mode = stat.S_IFDIR | stat.S_IMODE(member.mode)
+        if self.dirs.get(path) is not None and self.writer.seekable:
+            self.writer.patch(self.dirs[path], mode, member.uid, member.gid, member.mtime)
+            self.dirs[path] = None
+            return
+        self.make_parents(path)
+        # Without a seekable output, a synthesized directory is written again.
+        self.writer.header(f"./{path}", mode, member.uid, member.gid, member.mtime, nlink=2)
+        self.dirs[path] = None
+
+    def add_file(self, path, member, layer, source=None, copy_of=None):
+        """Write a regular file, with data from source or copied from a file written before."""
+
+        self.make_parents(path)
+        mode = stat.S_IFREG | stat.S_IMODE(member.mode)
+        size = copy_of[2] if copy_of else member.size
+        self.writer.header(f"./{path}", mode, member.uid, member.gid, member.mtime, size=size)
+        offset = self.writer.offset
+        if copy_of:
+            self.writer.copy(copy_of[1], size)
+        else:
+            self.writer.data(source, size)
+        self.files[path] = (layer, offset, size)
+        self.stats['bytes'] += size
+
+    def add_link(self, path, member, layer, tar):
+        """Write a hard link as a copy of its target."""
+
+        target = normalize(member.linkname)
+        self.stats['hardlinks'] += 1
+        if target in self.files and self.files[target][0] == layer and self.writer.seekable:
+            self.add_file(path, member, layer, copy_of=self.files[target])
+        elif target in self.skipped and layer_source(tar):
+            # The target was replaced by an upper layer; read it back from the input.
+            with layer_source(tar)(self.skipped[target]) as source:
+                self.add_file(path, member, layer, source=source)
+        elif target in self.files and self.files[target][0] == layer:
+            raise ConvertError(f"Hard link '{path}' requires a seekable output, use -o")
+        else:
+            # The target is in a lower layer.
+            self.pending.setdefault(target, []).append((path, member))
+
+    def resolve(self, path, layer):
+        """Write hard links pending on a file just written."""
+
+        if not self.writer.seekable:
+            raise ConvertError(f"Hard links to '{path}' require a seekable output, use -o")
+        for name, member in self.pending.pop(path, []):
+            self.add_file(name, member, layer, copy_of=self.files[path])
+
+    def add_layer(self, tar, layer):
+        """Convert the members of a tar archive; upper layers come first."""
+
+        hidden = set()
+        opaque = set()
+        written = set()
+        self.skipped = {}
+        for member in tar:
+            path = normalize(member.name)
+            if not path:
+                continue
+
+            base = posixpath.basename(path)
+            if base.startswith(WHITEOUT_PREFIX):
+                self.stats['whiteouts'] += 1
+                if base == WHITEOUT_OPAQUE:
+                    opaque.add(posixpath.dirname(path))
+                else:
+                    hidden.add(posixpath.join(posixpath.dirname(path),
+                                              base[len(WHITEOUT_PREFIX):]))
+                continue
+
+            shadowed = self.is_hidden(path) or (path in self.seen and not member.isdir())
+            if member.isdir():
+                if not shadowed and (path not in self.dirs or self.dirs[path] is not None):
+                    self.add_dir(path, member)
+                    self.stats['entries'] += 1
+                written.add(path)
+                continue
+
+            if shadowed:
+                self.stats['skipped'] += 1
+                if member.isreg() and path in self.pending:
+                    # Write the first link with the file data, then copy it.
+                    name, link = self.pending[path].pop(0)
+                    self.add_file(name, link, layer, source=tar.extractfile(member))
+                    self.files[path] = self.files[name]
+                    self.resolve(path, layer)
+                    del self.files[path]
+                elif member.isreg():
+                    self.skipped[path] = member
+                continue
+
+            if path in self.dirs and self.dirs[path] is not None:
+                raise ConvertError(f"'{path}' is both a directory and a file")
+            if member.islnk() and normalize(member.linkname) == path:
+                # Archived twice, e.g. `tar -cf - dir dir/file`.
+                continue
+            if member.islnk():
+                self.add_link(path, member, layer, tar)
+            elif member.isreg():
+                self.add_file(path, member, layer, source=tar.extractfile(member))
+                if path in self.pending:
+                    self.resolve(path, layer)
+            elif member.type in TAR_TYPES:
+                self.make_parents(path)
+                mode = TAR_TYPES[member.type] | stat.S_IMODE(member.mode)
+                if member.issym():
+                    data = member.linkname.encode("utf-8")
+                    self.writer.header(f"./{path}", mode, member.uid, member.gid, member.mtime,
+                                       size=len(data))
+                    self.writer.write(data + pad(len(data)))
+                else:
+                    self.writer.header(f"./{path}", mode, member.uid, member.gid, member.mtime,
+                                       rdev=(member.devmajor, member.devminor))
+            else:
+                if self.log:
+                    print(f"Warning: skipping '{path}' of unsupported type", file=self.log)
+                continue
+            written.add(path)
+            self.stats['entries'] += 1
+
+        # Entries of this layer hide entries of lower layers.
+        for path in written:
+            self.seen.add(path)
+            if path not in self.dirs:
+                self.hidden.add(path)
+        self.hidden |= hidden
+        self.opaque |= opaque
+
+    def finish(self):
+        """Write the trailer; return the statistics."""
+
+        for target, links in self.pending.items():
+            if self.log:
+                for name, _ in links:
+                    print(f"Warning: hard link '{name}' to missing '{target}' skipped",
+                          file=self.log)
+        self.writer.trailer()
+        return self.stats
+
+
+def layer_source(tar):
+    """Return a function reopening member data of a layer file, or None for streams."""
+
+    path = getattr(tar, "layer_path", None)
+    if not path:
+        return None
+
+    class Source:
+        """Context manager reading a member of the layer file."""
+
+        def __init__(self, member):
+            self.member = member
+            self.tar = None
+
+        def __enter__(self):
+            self.tar = tarfile.open(path, "r:*")
+            self.tar.fileobj.seek(self.member.offset_data)
+            return self.tar.fileobj
+
+        def __exit__(self, *exc):
+            self.tar.close()
+
+    return Source
+
+
+def open_layers(paths):
+    """Open layer files as tar streams, top layer first."""
+
+    for path in reversed(paths):
+        try:
+            tar = tarfile.open(path, "r|*")
+        except (IOError, tarfile.TarError) as exc:
+            raise ConvertError(f"Unable to open layer '{path}': {exc}") from exc
+        tar.layer_path = path
+        yield tar
+
+
+def convert(tars, output, log=None):
+    """Convert tar streams, top layer first, to a CPIO archive; return statistics."""
+
+    converter = Converter(Writer(output), log)
+    for layer, tar in enumerate(tars):
+        with tar:
+            try:
+                converter.add_layer(tar, layer)
+            except tarfile.TarError as exc:
+                raise ConvertError(f"Invalid tar input: {exc}") from exc
+    return converter.finish()
+
+
+def index_tar(tar):
+    """Return the entries of a tar layer, without their data.
+
+    Entries are dictionaries with the normalized path, the kind (`dir`,
+    `file`, `symlink`, `hardlink`, `special`, `whiteout` or `opaque`),
+    the metadata and the offset of the data in the (decompressed) tar.
+    """
+
+    entries = []
+    for member in tar:
+        path = normalize(member.name)
+        if not path:
+            continue
+        base = posixpath.basename(path)
+        link = None
+        if base == WHITEOUT_OPAQUE:
+            kind, path = "opaque", posixpath.dirname(path)
+        elif base.startswith(WHITEOUT_PREFIX):
+            kind = "whiteout"
+            path = posixpath.join(posixpath.dirname(path), base[len(WHITEOUT_PREFIX):])
+        elif member.islnk():
+            kind, link = "hardlink", normalize(member.linkname)
+            if link == path:
+                # Archived twice, e.g. `tar -cf - dir dir/file`.
+                continue
+        elif member.type in TAR_TYPES:
+            kind = {stat.S_IFDIR: "dir", stat.S_IFREG: "file",
+                    stat.S_IFLNK: "symlink"}.get(TAR_TYPES[member.type], "special")
+            if member.issym():
+                link = member.linkname
+        else:
+            continue
+        mode = TAR_TYPES.get(member.type, stat.S_IFREG) | stat.S_IMODE(member.mode)
+        entries.append({'path': path, 'kind': kind, 'mode': mode,
+                        'uid': member.uid, 'gid': member.gid, 'mtime': int(member.mtime),
+                        'size': member.size, 'link': link,
+                        'rdev': [member.devmajor, member.devminor],
+                        'offset': member.offset_data})
+    return entries
+
+
+class TarLayer:
+    """Tar layer with random access to member data.
+
+    `opener` returns a new seekable binary file object of the
+    (optionally compressed) layer tar.
+    """
+
+    def __init__(self, opener, entries=None):
+        self.opener = opener
+        self.tar = None
+        self.entries = entries
+        if entries is None:
+            with opener() as stream, tarfile.open(fileobj=stream, mode="r|*") as tar:
+                self.entries = index_tar(tar)
+
+    @contextlib.contextmanager
+    def data(self, entry):
+        """Return a file object positioned at the data of an entry."""
+
+        if self.tar is None:
+            self.tar = tarfile.open(fileobj=self.opener(), mode="r:*")
+        self.tar.fileobj.seek(entry['offset'])
+        yield self.tar.fileobj
+
+
+class CpioLayer:
+    """Newc CPIO archive, as a single layer.
+
+    Hard links (entries sharing an inode, with the data stored once)
+    are indexed as `hardlink` entries of the entry with the data.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stream = None
+        self.entries = []
+        links = {}
+        with open(path, "rb") as stream:
+            while True:
+                header = stream.read(110)
+                if len(header) < 110 or header[:6] != NEWC_MAGIC:
+                    raise ConvertError(f"'{path}' is not a newc CPIO archive")
+                fields = [int(header[6 + 8 * i:14 + 8 * i], 16) for i in range(13)]
+                ino, mode, uid, gid, nlink, mtime, size = fields[:7]
+                name = stream.read(fields[11])[:-1].decode("utf-8", "surrogateescape")
+                stream.seek(-(110 + fields[11]) % 4, os.SEEK_CUR)
+                if name == NEWC_TRAILER:
+                    break
+                offset = stream.tell()
+                link = stream.read(size).decode("utf-8", "surrogateescape") \
+                    if stat.S_ISLNK(mode) else None
+                stream.seek(offset + size + (-size % 4))
+                relpath = normalize(name)
+                if not relpath:
+                    continue
+                kind = "special"
+                if stat.S_ISDIR(mode):
+                    kind = "dir"
+                elif stat.S_ISREG(mode):
+                    kind = "file"
+                elif stat.S_ISLNK(mode):
+                    kind = "symlink"
+                entry = {'path': relpath, 'kind': kind, 'mode': mode, 'uid': uid, 'gid': gid,
+                         'mtime': mtime, 'size': size, 'link': link,
+                         'rdev': [fields[9], fields[10]], 'offset': offset}
+                if kind == "file" and nlink > 1:
+                    links.setdefault((fields[7], fields[8], ino), []).append(entry)
+                self.entries.append(entry)
+        for group in links.values():
+            data = [e for e in group if e['size']]
+            for entry in group:
+                if data and entry is not data[-1]:
+                    entry['kind'], entry['link'] = "hardlink", data[-1]['path']
+
+    @contextlib.contextmanager
+    def data(self, entry):
+        """Return a file object positioned at the data of an entry."""
+
+        if self.stream is None:
+            self.stream = open(self.path, "rb")
+        self.stream.seek(entry['offset'])
+        yield self.stream
+
+
+class DirLayer:
+    """Directory tree, as a single layer."""
+
+    def __init__(self, root):
+        self.root = root
+        self.entries = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            for name in sorted(dirnames + filenames):
+                full = os.path.join(dirpath, name)
+                sbuf = os.lstat(full)
+                path = os.path.relpath(full, root).replace(os.sep, "/")
+                link = os.readlink(full) if stat.S_ISLNK(sbuf.st_mode) else None
+                kind = "special"
+                if stat.S_ISDIR(sbuf.st_mode):
+                    kind = "dir"
+                elif stat.S_ISREG(sbuf.st_mode):
+                    kind = "file"
+                elif link is not None:
+                    kind = "symlink"
+                self.entries.append({'path': path, 'kind': kind, 'mode': sbuf.st_mode,
+                                     'uid': sbuf.st_uid, 'gid': sbuf.st_gid,
+                                     'mtime': int(sbuf.st_mtime),
+                                     'size': sbuf.st_size if kind == "file" else 0,
+                                     'link': link,
+                                     'rdev': [os.major(sbuf.st_rdev), os.minor(sbuf.st_rdev)],
+                                     'offset': None})
+
+    @contextlib.contextmanager
+    def data(self, entry):
+        """Return a file object reading the data of an entry."""
+
+        with open(os.path.join(self.root, entry['path']), "rb") as stream:
+            yield stream
+
+
+def is_hidden(path, hidden, opaque):
+    """Check if a path is hidden by a whiteout, opaque directory or replaced parent."""
+
+    if path in hidden:
+        return True
+    for parent in ancestors(path):
+        if parent in hidden or parent in opaque:
+            return True
+    return False
+
+
+def merge(layers):
+    """Apply layers (bottom layer first) to their entries.
+
+    Return (dirs, bodies): the visible directories, with the metadata of
+    the topmost layer defining them, and for each layer the list of
+    other visible entries. Hard link entries get a `source` item, the
+    (layer index, entry) of the regular file they link to.
+    """
+
+    dirs = {}
+    bodies = [None] * len(layers)
+    hidden = set()
+    opaque = set()
+    for index in reversed(range(len(layers))):
+        body = {}
+        layer_hidden = set()
+        layer_opaque = set()
+        for entry in layers[index].entries:
+            path = entry['path']
+            if entry['kind'] == "whiteout":
+                layer_hidden.add(path)
+            elif entry['kind'] == "opaque":
+                layer_opaque.add(path)
+            elif is_hidden(path, hidden, opaque):
+                continue
+            elif entry['kind'] == "dir":
+                dirs.setdefault(path, entry)
+            elif path not in dirs:
+                body[path] = entry
+        # Entries of this layer hide entries of lower layers.
+        hidden |= layer_hidden | set(body)
+        opaque |= layer_opaque
+        bodies[index] = list(body.values())
+
+    files = [None] * len(layers)
+    for index, body in enumerate(bodies):
+        for entry in body:
+            if entry['kind'] != "hardlink":
+                continue
+            # The target is in the same layer or in a lower one.
+            for source in reversed(range(index + 1)):
+                if files[source] is None:
+                    files[source] = {e['path']: e for e in layers[source].entries
+                                     if e['kind'] == "file"}
+                if entry['link'] in files[source]:
+                    entry['source'] = (source, files[source][entry['link']])
+                    break
+
+    # Parent directories missing from the layers.
+    for body in bodies:
+        for entry in body:
+            for parent in ancestors(entry['path']):
+                if parent not in dirs:
+                    dirs[parent] = {'path': parent, 'kind': "dir", 'mode': stat.S_IFDIR | 0o755,
+                                    'uid': 0, 'gid': 0, 'mtime': 0}
+    for path in list(dirs):
+        for parent in ancestors(path):
+            if parent not in dirs:
+                dirs[parent] = {'path': parent, 'kind': "dir", 'mode': stat.S_IFDIR | 0o755,
+                                'uid': 0, 'gid': 0, 'mtime': 0}
+
+    return dirs, bodies
+
+
+def write_dirs(writer, dirs):
+    """Write the root and the directories, sorted."""
+
+    writer.header(".", stat.S_IFDIR | 0o755, nlink=2)
+    for path in sorted(dirs, key=sort_key):
+        entry = dirs[path]
+        writer.header(f"./{path}", entry['mode'], entry['uid'], entry['gid'], entry['mtime'],
+                      nlink=2)
+
+
+def write_body(writer, layers, index, body, log=None):
+    """Write the non-directory entries of a layer, sorted.
+
+    Hard links are written as copies of their source file. Return the
+    number of bytes of file data written.
+    """
+
+    size = 0
+    for entry in sorted(body, key=lambda e: sort_key(e['path'])):
+        name = f"./{entry['path']}"
+        if entry['kind'] in ("file", "hardlink"):
+            layer, source = layers[index], entry
+            if entry['kind'] == "hardlink":
+                if 'source' not in entry:
+                    if log:
+                        print(f"Warning: hard link '{entry['path']}' to missing "
+                              f"'{entry['link']}' skipped", file=log)
+                    continue
+                layer, source = layers[entry['source'][0]], entry['source'][1]
+            mode = stat.S_IFREG | stat.S_IMODE(entry['mode'])
+            writer.header(name, mode, entry['uid'], entry['gid'], entry['mtime'],
+                          size=source['size'])
+            with layer.data(source) as stream:
+                writer.data(stream, source['size'])
+            size += source['size']
+        elif entry['kind'] == "symlink":
+            data = entry['link'].encode("utf-8")
+            writer.header(name, entry['mode'], entry['uid'], entry['gid'], entry['mtime'],
+                          size=len(data))
+            writer.write(data + pad(len(data)))
+        else:
+            writer.header(name, entry['mode'], entry['uid'], entry['gid'], entry['mtime'],
+                          rdev=tuple(entry['rdev']))
+    return size
+
+
+def convert_deterministic(layers, output, mtime, log=None):
+    """Write a deterministic CPIO archive of layers, bottom layer first."""
+
+    dirs, bodies = merge(layers)
+    writer = Writer(output, mtime)
+    write_dirs(writer, dirs)
+    size = 0
+    for index, body in enumerate(bodies):
+        size += write_body(writer, layers, index, body, log)
+    writer.trailer()
+    return {'entries': len(dirs) + sum(len(body) for body in bodies), 'bytes': size}
+
+
+def spool(stream):
+    """Copy a stream to a named temporary file and return it."""
+
+    tmp = tempfile.NamedTemporaryFile()
+    shutil.copyfileobj(stream, tmp, CHUNK_SIZE)
+    tmp.flush()
+    return tmp
+
+
+def parse_args():
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(description="Convert a root filesystem tar stream to newc CPIO.")
+    parser.add_argument("layers", metavar="LAYER", nargs="*",
+                        help="layer tarballs, bottom layer first (default: tar stream on stdin)")
+    parser.add_argument("-o", "--output", help="output CPIO file (default: stdout)")
+    parser.add_argument("-C", "--directory",
+                        help="archive a directory instead of tar input (implies --deterministic)")
+    parser.add_argument("-d", "--deterministic", action="store_true",
+                        help="sort entries and normalize metadata")
+    parser.add_argument("--mtime", type=int, default=source_date_epoch(),
+                        help="modification time of deterministic archives "
+                             "(default: SOURCE_DATE_EPOCH or 0)")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="print statistics to stderr")
+    return parser.parse_args()
+
+
+def main():
+    """The main program function."""
+
+    args = parse_args()
+
+    # Concurrent runs of an application may create the same archive.
+    tmp_output = f"{args.output}.{os.getpid()}.tmp"
+    if args.output:
+        output = open(tmp_output, "w+b")
+    else:
+        output = sys.stdout.buffer
+
+    try:
+        if args.directory:
+            stats = convert_deterministic([DirLayer(args.directory)], output, args.mtime,
+                                          sys.stderr)
+        elif args.deterministic:
+            if args.layers:
+                layers = [TarLayer(lambda path=path: open(path, "rb")) for path in args.layers]
+            else:
+                tmp = spool(sys.stdin.buffer)
+                layers = [TarLayer(lambda: open(tmp.name, "rb"))]
+            stats = convert_deterministic(layers, output, args.mtime, sys.stderr)
+        else:
+            if args.layers:
+                tars = open_layers(args.layers)
+            else:
+                tars = [tarfile.open(fileobj=sys.stdin.buffer, mode="r|*")]
+            stats = convert(tars, output, sys.stderr)
+    except (ConvertError, tarfile.TarError, OSError) as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        if args.output:
+            output.close()
+            os.remove(tmp_output)
+        sys.exit(1)
+
+    if args.output:
+        output.close()
+        # An unchanged archive keeps its modification time, so that run
+        # scripts don't compress it again.
+        if os.path.isfile(args.output) and filecmp.cmp(tmp_output, args.output, shallow=False):
+            os.remove(tmp_output)
+        else:
+            os.replace(tmp_output, args.output)
+
+    if args.verbose and 'hardlinks' not in stats:
+        print(f"{stats['entries']} entries, {stats['bytes']} bytes of file data",
+              file=sys.stderr)
+    elif args.verbose:
+        print(f"{stats['entries']} entries, {stats['bytes']} bytes of file data, "
+              f"{stats['hardlinks']} hard links, {stats['whiteouts']} whiteouts, "
+              f"{stats['skipped']} entries hidden, {stats['synthesized']} directories added",
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2023, Unikraft GmbH and The Unikraft Authors.
+
+"""Discover compiler toolchains available on the system.
+
+Each directory in PATH is scanned once for GCC and Clang executables
+(`gcc`, `gcc-12`, `aarch64-linux-gnu-gcc-12`, `clang-15` etc.). Every
+candidate is then queried for its real version and for the
+architectures it targets. Results are cached on disk, keyed by PATH
+and by the modification times of its directories, so that repeated
+runs don't spawn any process.
+
+Run the script to print the toolchains found.
+"""
+
+import sys
+import os
+import re
+import json
+import argparse
+import tempfile
+import subprocess
+import concurrent.futures
+
+
+CACHE_VERSION = 1
+CACHE_FILE = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+                          "unikraft", "toolchains.json")
+
+# Toolchain executable names: optional target prefix, family, optional version.
+NAME_RE = re.compile(r"^(?P<prefix>(?:[A-Za-z0-9_.]+-)+)?(?P<family>gcc|clang)(?:-(?P<major>\d+))?$")
+VERSION_RE = re.compile(r"version (\d+\.\d+(?:\.\d+)?)|(\d+\.\d+(?:\.\d+)?)\s*$")
+
+# Map target triple CPUs and Clang target names to Unikraft architectures.
+ARCHS = {
+        "x86_64": "x86_64",
+        "x86-64": "x86_64",
+        "aarch64": "arm64",
+        "arm64": "arm64",
+        }
+
+
+def path_dirs(path=None):
+    """Return the list of unique directories in PATH."""
+
+    if path is None:
+        path = os.environ.get("PATH", os.defpath)
+    dirs = []
+    for directory in path.split(os.pathsep):
+        directory = directory or "."
+        if directory not in dirs:
+            dirs.append(directory)
+    return dirs
+
+
+def cache_key(dirs):
+    """Compute the cache key from PATH directories and their modification times."""
+
+    key = [CACHE_VERSION]
+    for directory in dirs:
+        try:
+            key.append([directory, os.stat(directory).st_mtime_ns])
+        except OSError:
+            key.append([directory, None])
+    return key
+
+
+def scan(dirs):
+    """Scan PATH directories once and return the toolchain candidates.
+
+    Return a list of (name, path) tuples. Like for command lookup, the
+    first occurrence of a name in PATH wins.
+    """
+
+    candidates = {}
+    for directory in dirs:
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in sorted(entries, key=lambda e: e.name):
+            if entry.name in candidates or not NAME_RE.match(entry.name):
+                continue
+            try:
+                if not entry.is_file() or not os.access(entry.path, os.X_OK):
+                    continue
+            except OSError:
+                continue
+            candidates[entry.name] = entry.path
+    return sorted(candidates.items())
+
+
+def run(args):
+    """Run command and return its standard output, or None on failure."""
+
+    try:
+        result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                stdin=subprocess.DEVNULL, check=True, timeout=30)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.decode("utf-8", "replace")
+
+
+def probe(name, path):
+    """Query a toolchain executable for its version and targets.
+
+    Return a toolchain dictionary or None if it is not usable.
+    """
+
+    match = NAME_RE.match(name)
+    family = match.group("family")
+    prefix = match.group("prefix") or ""
+
+    output = run([path, "--version"])
+    if not output:
+        return None
+    match = VERSION_RE.search(output.splitlines()[0])
+    if not match:
+        return None
+    version = match.group(1) or match.group(2)
+
+    machine = run([path, "-dumpmachine"])
+    if not machine:
+        return None
+    machine = machine.strip()
+    # Only accept target prefixes, not wrappers such as c99-gcc.
+    if prefix and prefix[:-1] != machine:
+        return None
+    host_arch = ARCHS.get(machine.split("-")[0])
+
+    targets = []
+    if host_arch:
+        targets.append(host_arch)
+    if family == "clang":
+        # Clang is a cross compiler, only list architectures it was built for.
+        output = run([path, "-print-targets"]) or ""
+        for line in output.splitlines():
+            arch = ARCHS.get(line.strip().split(" ")[0])
+            if arch and arch not in targets:
+                targets.append(arch)
+    if not targets:
+        return None
+
+    major = version.split(".")[0]
+    # The versioned name, e.g. gcc-12, is used to tell builds apart.
+    # The compiler (without target prefix) is passed as COMPILER to Make.
+    return {
+            'name': f"{family}-{major}",
+            'family': family,
+            'version': version,
+            'command': name,
+            'compiler': name[len(prefix):],
+            'prefix': prefix,
+            'path': os.path.realpath(path),
+            'machine': machine,
+            'targets': sorted(targets),
+            }
+
+
+def index(candidates, jobs=None):
+    """Probe candidates and return the list of unique toolchains.
+
+    Several names resolving to the same executable (e.g. `gcc`,
+    `gcc-12` and `x86_64-linux-gnu-gcc-12`) yield a single toolchain,
+    preferring versioned names without target prefix.
+    """
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        probed = list(executor.map(lambda c: probe(*c), candidates))
+
+    probed = [t for t in probed if t]
+    probed.sort(key=lambda t: (t['prefix'] != "", t['compiler'] == t['family'], t['command']))
+
+    toolchains = []
+    seen = set()
+    for toolchain in probed:
+        key = (toolchain['name'], tuple(toolchain['targets']))
+        if toolchain['path'] in seen or key in seen:
+            continue
+        seen.add(toolchain['path'])
+        seen.add(key)
+        toolchains.append(toolchain)
+
+    toolchains.sort(key=lambda t: (t['family'], int(t['name'].split("-")[1]), t['prefix']))
+    return toolchains
+
+
+def load_cache(key, cache_file=CACHE_FILE):
+    """Return cached toolchains for the given key or None."""
+
+    try:
+        with open(cache_file, "r", encoding="utf8") as stream:
+            data = json.load(stream)
+    except (IOError, ValueError):
+        return None
+    if data.get("key") != key:
+        return None
+    return data.get("toolchains")
+
+
+def save_cache(key, toolchains, cache_file=CACHE_FILE):
+    """Store toolchains in the cache; failures are ignored."""
+
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", encoding="utf8", delete=False,
+                                         dir=os.path.dirname(cache_file)) as stream:
+            json.dump({"key": key, "toolchains": toolchains}, stream, indent=2)
+        os.replace(stream.name, cache_file)
+    except OSError:
+        pass
+
+
+def discover(path=None, refresh=False, cache_file=CACHE_FILE):
+    """Return the list of toolchains available in PATH.
+
+    Use the on-disk cache unless `refresh` is set or PATH changed.
+    """
+
+    dirs = path_dirs(path)
+    key = cache_key(dirs)
+    if not refresh:
+        toolchains = load_cache(key, cache_file)
+        if toolchains is not None:
+            return toolchains
+
+    toolchains = index(scan(dirs))
+    save_cache(key, toolchains, cache_file)
+    return toolchains
+
+
+def for_arch(toolchains, arch):
+    """Return the toolchains targeting the given architecture.
+
+    Prefer native compilers to cross compilers of the same name.
+    """
+
+    selected = {}
+    for toolchain in toolchains:
+        if arch not in toolchain['targets']:
+            continue
+        native = ARCHS.get(toolchain['machine'].split("-")[0]) == arch
+        if toolchain['name'] not in selected or native:
+            selected[toolchain['name']] = toolchain
+    return list(selected.values())
+
+
+def main():
+    """Print the toolchains found on the system."""
+
+    parser = argparse.ArgumentParser(description="Discover compiler toolchains.")
+    parser.add_argument("--refresh", action="store_true",
+                        help="ignore the cache and probe toolchains again")
+    parser.add_argument("--json", action="store_true",
+                        help="print toolchains as JSON")
+    args = parser.parse_args()
+
+    toolchains = discover(refresh=args.refresh)
+    if args.json:
+        json.dump(toolchains, sys.stdout, indent=2)
+        print()
+        return
+
+    for toolchain in toolchains:
+        print(f"{toolchain['name']:<10} {toolchain['version']:<10} "
+              f"{','.join(toolchain['targets']):<14} {toolchain['path']}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,514 @@
+#!/usr/bin/env python
+
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2023, Unikraft GmbH and The Unikraft Authors.
+
+"""HTTP load generator for the catalog applications.
+
+Requests are sent with asyncio from a single process, in one of two
+modes:
+  - closed loop (default): `--connections` connections send requests
+    back to back; the request rate is what the application sustains
+  - open loop (`--rate`): requests are started at a constant rate,
+    using at most `--connections` connections. Latencies are measured
+    from the intended start time of each request, not from the time it
+    was actually sent, correcting the coordinated omission of closed
+    loop measurements when the application stalls
+
+Connections are kept alive by default; use `--no-keepalive` to open a
+connection per request. Latencies are recorded in a log-linear
+(HdrHistogram-like) histogram and percentiles are printed at the end,
+or saved as JSON with `--json`.
+
+Scenarios for the catalog applications (port, path, Host header,
+expected response body) are defined in `loadgen.yaml`, next to this script:
+
+    utils/loadgen.py --scenario examples/http-go1.21 --duration 30
+    utils/loadgen.py --rate 2000 --no-keepalive http://172.44.0.2:8080/
+
+Use `--self-test` to check the load generator against a local stand-in
+server, without booting an application.
+"""
+
+import sys
+import os
+import json
+import time
+import asyncio
+import argparse
+import urllib.parse
+import yaml
+
+
+SCENARIOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loadgen.yaml")
+
+DEFAULTS = {
+    'host': "172.44.0.2",
+    'port': 8080,
+    'path': "/",
+    # Host header, if the application only accepts some names.
+    'host_header': None,
+    'expect': None,
+    'connections': 32,
+    'rate': None,
+    'duration': 10.0,
+    'warmup': 0.0,
+    'timeout': 10.0,
+    'keepalive': True,
+    }
+
+PERCENTILES = [50, 75, 90, 99, 99.9, 99.99]
+
+
+class Histogram:
+    """Log-linear histogram of latencies (microseconds).
+
+    Values are grouped in buckets of powers of two, each divided in
+    2^SUB_BITS linear sub-buckets, so the recorded values have a
+    relative error below 2^-SUB_BITS, whatever their magnitude.
+    """
+
+    SUB_BITS = 8
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def index(self, value):
+        """Return the bucket index of a value."""
+
+        if value < (1 << self.SUB_BITS):
+            return value
+        shift = value.bit_length() - self.SUB_BITS
+        return (shift << self.SUB_BITS) + (value >> shift)
+
+    def highest(self, index):
+        """Return the highest value of a bucket."""
+
+        shift = index >> self.SUB_BITS
+        low = (index - (shift << self.SUB_BITS)) << shift
+        return low + (1 << shift) - 1
+
+    def record(self, seconds):
+        """Record a latency given in seconds."""
+
+        value = max(int(seconds * 1e6), 0)
+        index = self.index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        """Return the value (microseconds) below which percent of values fall."""
+
+        if not self.count:
+            return 0
+        target = max(1, int(percent / 100 * self.count + 0.5))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self.highest(index), self.max)
+        return self.max
+
+    def summary(self):
+        """Return the distribution, in microseconds."""
+
+        return {
+            'count': self.count,
+            'min': self.min or 0,
+            'mean': self.total / self.count if self.count else 0,
+            'max': self.max,
+            'percentiles': {str(p): self.percentile(p) for p in PERCENTILES},
+            }
+
+
+class Stats:
+    """Results of a run."""
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.ok = 0
+        self.errors = {}
+        self.connections = 0
+        self.start = None
+        self.end = None
+        self.finished = None
+
+    def error(self, kind):
+        """Count an error of the given kind."""
+
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+class Client:
+    """HTTP/1.1 connection sending the same request."""
+
+    def __init__(self, config, stats):
+        self.config = config
+        self.stats = stats
+        self.reader = None
+        self.writer = None
+        close = "" if config['keepalive'] else "Connection: close\r\n"
+        host = config['host_header'] or config['host']
+        self.request = (f"GET {config['path']} HTTP/1.1\r\nHost: {host}\r\n"
+                        f"User-Agent: loadgen\r\n{close}\r\n").encode("ascii")
+        self.expect = config['expect'].encode("utf-8") if config['expect'] else None
+
+    async def connect(self):
+        """Open the connection."""
+
+        self.reader, self.writer = await asyncio.open_connection(self.config['host'],
+                                                                 self.config['port'])
+        self.stats.connections += 1
+
+    def close(self):
+        """Close the connection."""
+
+        if self.writer:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def read_response(self):
+        """Read a response; return (status, body, whether the connection is closed)."""
+
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("connection closed")
+        version, status = line.split(None, 2)[:2]
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.partition(b":")
+            headers[name.strip().lower()] = value.strip().lower()
+
+        closed = headers.get(b"connection") == b"close" or \
+            (version == b"HTTP/1.0" and headers.get(b"connection") != b"keep-alive")
+        if b"chunked" in headers.get(b"transfer-encoding", b""):
+            body = b""
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                body += await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif b"content-length" in headers:
+            body = await self.reader.readexactly(int(headers[b"content-length"]))
+        else:
+            body = await self.reader.read()
+            closed = True
+        return int(status), body, closed
+
+    async def send(self, started):
+        """Send the request; record its latency from `started` (a monotonic time)."""
+
+        try:
+            if not self.writer:
+                await self.connect()
+            self.writer.write(self.request)
+            status, body, closed = await asyncio.wait_for(self.read_response(),
+                                                          self.config['timeout'])
+        except asyncio.TimeoutError:
+            self.stats.error("timeout")
+            self.close()
+            return
+        except (OSError, ValueError, asyncio.IncompleteReadError) as exc:
+            self.stats.error(type(exc).__name__)
+            self.close()
+            return
+
+        if closed or not self.config['keepalive']:
+            self.close()
+        if status != 200:
+            self.stats.error(f"status {status}")
+        elif self.expect and self.expect not in body:
+            self.stats.error("unexpected body")
+        else:
+            self.stats.ok += 1
+            if started >= self.stats.start + self.config['warmup']:
+                self.stats.latency.record(time.monotonic() - started)
+
+
+async def closed_loop(config, stats):
+    """Send requests back to back on each connection until the end of the run."""
+
+    async def worker():
+        client = Client(config, stats)
+        while time.monotonic() < stats.end:
+            await client.send(time.monotonic())
+        client.close()
+
+    await asyncio.gather(*(worker() for _ in range(config['connections'])))
+
+
+async def open_loop(config, stats):
+    """Start requests at a constant rate, using a bounded number of connections.
+
+    Requests waiting for a free connection are late: their latency
+    includes the wait, from their intended start time.
+    """
+
+    queue = asyncio.Queue()
+
+    async def worker():
+        client = Client(config, stats)
+        while True:
+            intended = await queue.get()
+            if intended is None:
+                break
+            await client.send(intended)
+        client.close()
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(config['connections'])]
+    interval = 1 / config['rate']
+    index = 0
+    while True:
+        intended = stats.start + index * interval
+        if intended >= stats.end:
+            break
+        delay = intended - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        queue.put_nowait(intended)
+        index += 1
+    for _ in workers:
+        queue.put_nowait(None)
+    await asyncio.gather(*workers)
+
+
+async def run(config):
+    """Run the load and return the statistics."""
+
+    stats = Stats()
+    stats.start = time.monotonic()
+    stats.end = stats.start + config['warmup'] + config['duration']
+    if config['rate']:
+        await open_loop(config, stats)
+    else:
+        await closed_loop(config, stats)
+    stats.finished = time.monotonic()
+    return stats
+
+
+def report(config, stats):
+    """Return the results of a run."""
+
+    elapsed = stats.finished - stats.start - config['warmup']
+    return {
+        'target': f"http://{config['host']}:{config['port']}{config['path']}",
+        'mode': "open" if config['rate'] else "closed",
+        'rate': config['rate'],
+        'connections': config['connections'],
+        'keepalive': config['keepalive'],
+        'duration': elapsed,
+        'requests': stats.ok,
+        'throughput': stats.latency.count / elapsed if elapsed > 0 else 0,
+        'errors': stats.errors,
+        'opened_connections': stats.connections,
+        'latency_us': stats.latency.summary(),
+        }
+
+
+def print_report(result):
+    """Print the results of a run."""
+
+    mode = f"open loop, {result['rate']} req/s" if result['mode'] == "open" else "closed loop"
+    latency = result['latency_us']
+    print(f"target:      {result['target']} ({mode}, {result['connections']} connections, "
+          f"keep-alive {'on' if result['keepalive'] else 'off'})")
+    print(f"requests:    {result['requests']} ok, {sum(result['errors'].values())} errors "
+          f"{result['errors'] or ''}")
+    print(f"throughput:  {result['throughput']:.1f} req/s")
+    print(f"connections: {result['opened_connections']}")
+    print(f"latency:     min {latency['min'] / 1000:.3f} ms, mean {latency['mean'] / 1000:.3f} ms, "
+          f"max {latency['max'] / 1000:.3f} ms")
+    for percent, value in latency['percentiles'].items():
+        print(f"  p{percent:<7} {value / 1000:10.3f} ms")
+
+
+def load_scenario(name):
+    """Return the settings of a scenario from the scenarios file."""
+
+    with open(SCENARIOS, "r", encoding="utf8") as stream:
+        data = yaml.safe_load(stream) or {}
+    scenarios = data.get('scenarios') or {}
+    if name not in scenarios:
+        raise KeyError(f"Unknown scenario '{name}' in '{SCENARIOS}'")
+    return dict(data.get('defaults') or {}, **(scenarios[name] or {}))
+
+
+async def stand_in_server(delay, stall_at, stall):
+    """Start a local HTTP server answering "Hello, World!" after `delay` seconds.
+
+    The server stops answering for `stall` seconds, `stall_at` seconds
+    after it starts. Return the server and its counters.
+    """
+
+    counters = {'connections': 0, 'requests': 0}
+    started = time.monotonic()
+    stall_end = started + stall_at + stall
+
+    async def handle(reader, writer):
+        counters['connections'] += 1
+        try:
+            while True:
+                request = await reader.readuntil(b"\r\n\r\n")
+                now = time.monotonic()
+                if started + stall_at <= now < stall_end:
+                    await asyncio.sleep(stall_end - now)
+                if delay:
+                    await asyncio.sleep(delay)
+                counters['requests'] += 1
+                close = b"connection: close" in request.lower()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: 13\r\n" +
+                             (b"Connection: close\r\n" if close else b"") + b"\r\nHello, World!")
+                await writer.drain()
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, counters
+
+
+async def self_test():
+    """Check the load generator against a stand-in server; return the failures."""
+
+    failures = []
+
+    def check(name, condition, detail):
+        print(f"{'ok  ' if condition else 'FAIL'} {name}: {detail}")
+        if not condition:
+            failures.append(name)
+
+    async def measure(settings, delay=0.0, stall_at=1e9, stall=0.0):
+        server, counters = await stand_in_server(delay, stall_at, stall)
+        config = dict(DEFAULTS, host="127.0.0.1", port=server.sockets[0].getsockname()[1],
+                      expect="Hello, World!", duration=2.0, **settings)
+        stats = await run(config)
+        server.close()
+        await server.wait_closed()
+        return report(config, stats), counters
+
+    # Closed loop throughput is bounded by connections / service time.
+    result, counters = await measure({'connections': 4}, delay=0.01)
+    check("closed loop throughput", 250 <= result['throughput'] <= 420,
+          f"{result['throughput']:.0f} req/s, expected below 400 (4 connections, 10 ms)")
+    check("closed loop errors", not result['errors'], result['errors'])
+    check("closed loop accounting", counters['requests'] >= result['requests'],
+          f"server {counters['requests']}, client {result['requests']}")
+    check("keep-alive on", result['opened_connections'] == 4,
+          f"{result['opened_connections']} connections")
+
+    # Open loop sends the requested rate, whatever the latency.
+    result, counters = await measure({'rate': 200, 'connections': 16})
+    check("open loop rate", 360 <= result['requests'] <= 401,
+          f"{result['requests']} requests, expected 400 (200 req/s for 2 s)")
+
+    result, counters = await measure({'rate': 100, 'connections': 8, 'keepalive': False})
+    check("keep-alive off", result['opened_connections'] == result['requests'] == counters['requests'],
+          f"{result['opened_connections']} connections, {result['requests']} requests")
+
+    # A 500 ms stall delays all requests intended during the stall: about
+    # 25% of them here. The corrected latencies show it, while a closed
+    # loop only records one slow request per connection.
+    settings = {'rate': 200, 'connections': 4}
+    result, _ = await measure(settings, stall_at=1.0, stall=0.5)
+    p90 = result['latency_us']['percentiles']['90'] / 1e6
+    check("coordinated omission (open loop)", p90 >= 0.15,
+          f"p90 {p90 * 1000:.0f} ms, expected at least 150 ms")
+    result, _ = await measure({'connections': 4}, stall_at=1.0, stall=0.5)
+    p90 = result['latency_us']['percentiles']['90'] / 1e6
+    check("coordinated omission (closed loop)", p90 < 0.05,
+          f"p90 {p90 * 1000:.0f} ms, stall hidden by the closed loop")
+
+    # Histogram precision.
+    histogram = Histogram()
+    for value in range(1, 100001):
+        histogram.record(value / 1e6)
+    p99 = histogram.percentile(99)
+    check("histogram precision", abs(p99 - 99000) / 99000 < 0.01, f"p99 {p99} us, expected 99000")
+    return failures
+
+
+def parse_args():
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(description="HTTP load generator.")
+    parser.add_argument("url", nargs="?", help="target URL (default: http://172.44.0.2:8080/)")
+    parser.add_argument("-s", "--scenario", help=f"scenario (application directory) from {SCENARIOS}")
+    parser.add_argument("-c", "--connections", type=int, help="connections (default: 32)")
+    parser.add_argument("-r", "--rate", type=float,
+                        help="open loop request rate (req/s), instead of a closed loop")
+    parser.add_argument("-d", "--duration", type=float, help="seconds (default: 10)")
+    parser.add_argument("--warmup", type=float, help="seconds not recorded, before the run")
+    parser.add_argument("--timeout", type=float, help="request timeout (default: 10)")
+    parser.add_argument("--expect", help="string expected in response bodies")
+    parser.add_argument("--no-keepalive", dest="keepalive", action="store_false", default=None,
+                        help="open a connection per request")
+    parser.add_argument("--json", help="save results to this file")
+    parser.add_argument("--list", action="store_true", help="list scenarios")
+    parser.add_argument("--self-test", action="store_true",
+                        help="check the load generator against a local stand-in server")
+    return parser.parse_args()
+
+
+def main():
+    """The main program function."""
+
+    args = parse_args()
+
+    if args.self_test:
+        failures = asyncio.run(self_test())
+        if failures:
+            print(f"Error: {len(failures)} checks failed", file=sys.stderr)
+            sys.exit(1)
+        return 0
+
+    config = dict(DEFAULTS)
+    try:
+        if args.list:
+            with open(SCENARIOS, "r", encoding="utf8") as stream:
+                for name in (yaml.safe_load(stream) or {}).get('scenarios') or {}:
+                    print(name)
+            return 0
+        if args.scenario:
+            config.update(load_scenario(args.scenario.rstrip("/")))
+    except (IOError, KeyError) as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.url:
+        url = urllib.parse.urlsplit(args.url)
+        if url.scheme != "http" or not url.hostname:
+            print(f"Error: Unsupported URL '{args.url}'", file=sys.stderr)
+            sys.exit(1)
+        config['host'] = url.hostname
+        config['port'] = url.port or 80
+        config['path'] = url.path or "/"
+        if url.query:
+            config['path'] += "?" + url.query
+    for key in ['connections', 'rate', 'duration', 'warmup', 'timeout', 'expect', 'keepalive']:
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+
+    result = report(config, asyncio.run(run(config)))
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as stream:
+            json.dump(result, stream, indent=2)
+    if not result['requests']:
+        sys.exit(1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())